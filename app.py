@@ -1,47 +1,189 @@
+import itertools
 import os
 import re
-import requests
 
-from flask import Flask, render_template, redirect, request, flash, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import Blueprint, Flask, Response, current_app, render_template, redirect, request, flash, session, g, abort, jsonify, make_response, stream_with_context, url_for
 from sqlalchemy.exc import IntegrityError
 
-from models import db, connect_db, User, Recipe, Likes
+from models import db, connect_db, User, Recipe, Likes, FacetCount, IngestJob, SearchQuery
 from forms import SignupForm, LoginForm, AddRecipeForm
-
-import pdb
+from cache import normalize_query, search_cache, search_snapshots
+from cards import recipe_cards
+from conditional import listing_validators, is_fresh, not_modified, with_validators
+from search_index import search_index
+from pantry import pantry_search
+from typeahead import typeahead
+from ingest_jobs import ingest_queue
+from edamam import edamam_client
+from likes import liked_recipe_ids, toggle_like
+from identity import load_identity
+from hashing import HashingBusy, hash_executor
+from images import image_proxy
+from recommend import recommender
+from metrics import metrics, registry
 
 CURR_USER_KEY = 'curr_user'
+# Url of the search results page the user last saw, for like() to return to.
 CURR_SEARCH_REQUEST = 'curr_query'
 
-app = Flask(__name__)
-
-uri = os.environ.get('DATABASE_URL', 'postgresql:///capstone_one')
-if uri.startswith("postgres://"):
-    uri = uri.replace("postgres://", "postgresql://", 1)
-# rest of connection code using the connection string `uri`
-app.config['SQLALCHEMY_DATABASE_URI'] = uri
-
+bp = Blueprint('main', __name__)
+
+
+def create_app(config=None):
+    '''Build the app. `config` overrides the settings read from the environment.
+
+    Nothing connects here: the database engine, the HTTP sessions and the
+    worker pools are all created on first use. Startup stays fast, and
+    gunicorn --preload can fork workers without sharing any socket.
+    '''
+
+    app = Flask(__name__)
+
+    uri = os.environ.get('DATABASE_URL', 'postgresql:///capstone_one')
+    if uri.startswith("postgres://"):
+        uri = uri.replace("postgres://", "postgresql://", 1)
+    # rest of connection code using the connection string `uri`
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'shhh secret!')
+
+    # 'memory' keeps the cache per worker, 'sqlite' shares one file between all workers on the box.
+    app.config['SEARCH_CACHE_BACKEND'] = os.environ.get('SEARCH_CACHE_BACKEND', 'memory')
+    app.config['SEARCH_CACHE_PATH'] = os.environ.get('SEARCH_CACHE_PATH')
+    app.config['SEARCH_CACHE_TTL'] = int(os.environ.get('SEARCH_CACHE_TTL', 3600))
+    app.config['SEARCH_CACHE_SIZE'] = int(os.environ.get('SEARCH_CACHE_SIZE', 512))
+    app.config['RECIPES_PER_PAGE'] = int(os.environ.get('RECIPES_PER_PAGE', 24))
+    app.config['LIKED_IDS_TTL'] = int(os.environ.get('LIKED_IDS_TTL', 60))
+    app.config['IDENTITY_TTL'] = int(os.environ.get('IDENTITY_TTL', 300))
+    app.config['CARD_CACHE_SIZE'] = int(os.environ.get('CARD_CACHE_SIZE', 4096))
+    # Rows fetched per round trip when streaming the recipes and likes pages.
+    app.config['STREAM_YIELD_PER'] = int(os.environ.get('STREAM_YIELD_PER', 100))
+
+    # Existing hashes with another cost are rehashed on the next successful login.
+    # BCRYPT_WORKERS + BCRYPT_QUEUE must stay below the gunicorn threads per worker (see the Procfile)
+    # for the cap to refuse anything; see hashing.py.
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    app.config['BCRYPT_WORKERS'] = int(os.environ.get('BCRYPT_WORKERS', 2))
+    app.config['BCRYPT_QUEUE'] = int(os.environ.get('BCRYPT_QUEUE', 4))
+
+    # Searches answered by at least SEARCH_LOCAL_MIN stored recipes never reach Edamam.
+    app.config['SEARCH_LOCAL_MIN'] = int(os.environ.get('SEARCH_LOCAL_MIN', 10))
+    app.config['SEARCH_LOCAL_LIMIT'] = int(os.environ.get('SEARCH_LOCAL_LIMIT', 20))
+    # Search results are kept as ordered ids for paging. The result pages can be served by any
+    # worker, so they live in the database ('memory' and 'sqlite' only suit one worker or one box).
+    app.config['SEARCH_SNAPSHOT_BACKEND'] = os.environ.get('SEARCH_SNAPSHOT_BACKEND', 'database')
+    app.config['SEARCH_SNAPSHOT_PATH'] = os.environ.get('SEARCH_SNAPSHOT_PATH')
+    app.config['SEARCH_SNAPSHOT_TTL'] = int(os.environ.get('SEARCH_SNAPSHOT_TTL', 1800))
+    app.config['SEARCH_SNAPSHOT_SIZE'] = int(os.environ.get('SEARCH_SNAPSHOT_SIZE', 4096))
+
+    app.config['EDAMAM_URL'] = os.environ.get('EDAMAM_URL', 'https://api.edamam.com/api/recipes/v2')
+    app.config['EDAMAM_CONNECT_TIMEOUT'] = float(os.environ.get('EDAMAM_CONNECT_TIMEOUT', 3.05))
+    app.config['EDAMAM_READ_TIMEOUT'] = float(os.environ.get('EDAMAM_READ_TIMEOUT', 10))
+    app.config['EDAMAM_RETRIES'] = int(os.environ.get('EDAMAM_RETRIES', 2))
+    app.config['EDAMAM_PAGES'] = int(os.environ.get('EDAMAM_PAGES', 1))
+    # Requests per second allowed across all workers on the box (0: no limit), with bursts of EDAMAM_BURST.
+    app.config['EDAMAM_RATE'] = float(os.environ.get('EDAMAM_RATE', 0))
+    app.config['EDAMAM_BURST'] = int(os.environ.get('EDAMAM_BURST', 10))
+    app.config['EDAMAM_QUOTA_PATH'] = os.environ.get('EDAMAM_QUOTA_PATH')
+
+    # Threads per process that fetch and store Edamam searches in the background; see ingest_jobs.py.
+    app.config['INGEST_WORKERS'] = int(os.environ.get('INGEST_WORKERS', 2))
+    app.config['INGEST_POLL'] = float(os.environ.get('INGEST_POLL', 2))
+
+    # Card images are served through /images/<token> as cached thumbnails; see images.py.
+    app.config['IMAGE_CACHE_DIR'] = os.environ.get('IMAGE_CACHE_DIR')
+    app.config['IMAGE_CACHE_MAX_BYTES'] = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    app.config['IMAGE_THUMB_WIDTH'] = int(os.environ.get('IMAGE_THUMB_WIDTH', 600))
+    app.config['IMAGE_PROXY_ALLOW_PRIVATE'] = os.environ.get('IMAGE_PROXY_ALLOW_PRIVATE') == '1'
+
+    # "Recommended for you" on the homepage; see recommend.py.
+    app.config['RECOMMEND_TOP_K'] = int(os.environ.get('RECOMMEND_TOP_K', 20))
+    app.config['RECOMMEND_LIMIT'] = int(os.environ.get('RECOMMEND_LIMIT', 4))
+    app.config['RECOMMEND_REFRESH'] = int(os.environ.get('RECOMMEND_REFRESH', 30))
+    app.config['RECOMMEND_REBUILD'] = int(os.environ.get('RECOMMEND_REBUILD', 3600))
+
+    # The recommendation, pantry and typeahead indexes are rebuilt on a background thread; see indexes.py.
+    app.config['BACKGROUND_INDEX_BUILDS'] = os.environ.get('BACKGROUND_INDEX_BUILDS', '1') == '1'
+
+    # "Cook with what I have" at /recipes/pantry; see pantry.py.
+    app.config['PANTRY_MAX_MISSING'] = int(os.environ.get('PANTRY_MAX_MISSING', 3))
+    app.config['PANTRY_REFRESH'] = int(os.environ.get('PANTRY_REFRESH', 30))
+    app.config['PANTRY_REBUILD'] = int(os.environ.get('PANTRY_REBUILD', 3600))
+
+    # Search box suggestions from /api/typeahead; see typeahead.py.
+    # A past search is only suggested once it was made TYPEAHEAD_MIN_COUNT times.
+    app.config['TYPEAHEAD_LIMIT'] = int(os.environ.get('TYPEAHEAD_LIMIT', 8))
+    app.config['TYPEAHEAD_MIN_COUNT'] = int(os.environ.get('TYPEAHEAD_MIN_COUNT', 3))
+    app.config['TYPEAHEAD_MAX_QUERIES'] = int(os.environ.get('TYPEAHEAD_MAX_QUERIES', 5000))
+    app.config['TYPEAHEAD_REFRESH'] = int(os.environ.get('TYPEAHEAD_REFRESH', 30))
+    app.config['TYPEAHEAD_REBUILD'] = int(os.environ.get('TYPEAHEAD_REBUILD', 3600))
+
+    app.config.update(config or {})
+
+    # The debug toolbar is a dev-only dependency, so only import it when asked for.
+    if app.config.get('DEBUG_TB_ENABLED'):
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    search_cache.init_app(app)
+    search_snapshots.init_app(app)
+    recipe_cards.init_app(app)
+    image_proxy.init_app(app)
+    edamam_client.init_app(app)
+    ingest_queue.init_app(app)
+    recommender.init_app(app)
+    pantry_search.init_app(app)
+    typeahead.init_app(app)
+    metrics.init_app(app)
+    registry.collect('search_cache', search_cache.stats)
+    registry.collect('search_snapshots', search_snapshots.stats)
+    registry.collect('card_cache', recipe_cards.stats)
+    registry.collect('bcrypt_pool', hash_executor.stats)
+    registry.collect('recommender', recommender.stats)
+    registry.collect('pantry', pantry_search.stats)
+    registry.collect('typeahead', typeahead.stats)
+    registry.collect('ingest_queue', ingest_queue.stats)
+
+    app.register_blueprint(bp)
+
+    return app
+
+
+def after_fork():
+    '''Forget the HTTP sessions, thread pools and cache connections a forked worker inherited.
+
+    Database connections are handled by the pool itself; see models.py.
+    '''
+
+    edamam_client.after_fork()
+    image_proxy.after_fork()
+    hash_executor.after_fork()
+    search_cache.after_fork()
+    search_snapshots.after_fork()
+    recommender.after_fork()
+    pantry_search.after_fork()
+    typeahead.after_fork()
+    ingest_queue.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'shhh secret!')
-
-# toolbar = DebugToolbarExtension(app)
-
-connect_db(app)
-# db.create_all()
 
 
 # ------- User signup, login, and logout ------- #
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     '''After logged in, add curr user to Flask global.'''
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = load_identity(session[CURR_USER_KEY], ttl=current_app.config['IDENTITY_TTL'])
 
     else:
         g.user = None
@@ -59,7 +201,7 @@ def do_logout():
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
 
-@app.route('/signup', methods=['GET', 'POST'])
+@bp.route('/signup', methods=['GET', 'POST'])
 def signup():
     '''Handel user signup.'''
 
@@ -78,6 +220,10 @@ def signup():
             flash('Username already taken', 'danger')
             return render_template('users/signup.html', form=form)
 
+        except HashingBusy:
+            flash('Too many sign ups right now, please try again in a moment.', 'warning')
+            return render_template('users/signup.html', form=form), 503
+
         do_login(user)
 
         return redirect('/')
@@ -86,16 +232,22 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     '''Handle user login.'''
 
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data, form.password.data)
+        try:
+            user = User.authenticate(form.username.data, form.password.data)
+        except HashingBusy:
+            flash('Too many logins right now, please try again in a moment.', 'warning')
+            return render_template('users/login.html', form=form), 503
 
         if user:
+            # Saves the password hash if authenticate() upgraded its cost.
+            db.session.commit()
             do_login(user)
             flash(f'Welcome back! {user.username}!', 'success')
             return redirect('/')
@@ -105,7 +257,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     '''Handle user logout.'''
 
@@ -118,7 +270,27 @@ def logout():
 
 # ------- Users route ------- #
 
-@app.route('/users/<int:user_id>/recipes')
+def stream_template(template_name, **context):
+    '''Response that sends the page while it renders, so the header goes out before the rows are read.'''
+
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template(template_name).stream(context)
+    # Send a few dozen template fragments per write instead of one each.
+    stream.enable_buffering(32)
+    return Response(stream_with_context(stream))
+
+
+def peek(rows):
+    '''(has_rows, rows) without losing the first row of a lazy result.'''
+
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return False, iter(())
+    return True, itertools.chain([first], rows)
+
+
+@bp.route('/users/<int:user_id>/recipes')
 def show_recipes(user_id):
     '''Show user's recipes.'''
 
@@ -126,13 +298,19 @@ def show_recipes(user_id):
         flash('Access unauthorized', 'danger')
         return redirect('/')
 
+    etag, last_modified = listing_validators([f'recipes:{user_id}'], g.user.id)
+    if is_fresh(etag, last_modified):
+        return not_modified(etag, last_modified)
+
     user = User.query.get_or_404(user_id)
-    recipes = Recipe.query.filter(Recipe.user_id == user_id).all()
+    recipes = Recipe.query.filter(Recipe.user_id == user_id).order_by(Recipe.id).yield_per(current_app.config['STREAM_YIELD_PER'])
+    has_recipes, recipes = peek(recipes)
 
-    return render_template('users/recipes.html', user=user, recipes=recipes)
+    response = stream_template('users/recipes.html', user=user, recipes=recipes, empty=not has_recipes)
+    return with_validators(response, etag, last_modified)
 
 
-@app.route('/users/<int:user_id>/likes')
+@bp.route('/users/<int:user_id>/likes')
 def show_likes(user_id):
     '''Show user's likes.'''
 
@@ -140,148 +318,216 @@ def show_likes(user_id):
         flash('Access unauthorized', 'danger')
         return redirect('/')
 
+    etag, last_modified = listing_validators(['catalog', f'likes:{user_id}', f'likes:{g.user.id}'], g.user.id)
+    if is_fresh(etag, last_modified):
+        return not_modified(etag, last_modified)
+
     user = User.query.get_or_404(user_id)
-    likes = Likes.query.filter(Likes.user_id == user_id).all()
+    recipes = (Recipe.query
+        .join(Likes, Likes.recipe_id == Recipe.id)
+        .filter(Likes.user_id == user_id)
+        .order_by(Likes.id)
+        .yield_per(current_app.config['STREAM_YIELD_PER']))
+    has_likes, recipes = peek(recipes)
 
-    liked_recipe_ids = [recipe.id for recipe in g.user.likes]
+    liked_ids = liked_recipe_ids(g.user.id, ttl=current_app.config['LIKED_IDS_TTL'])
 
-    return render_template('users/likes.html', user=user, likes=likes, liked=liked_recipe_ids)
+    response = stream_template('users/likes.html', user=user, recipes=recipes, liked=liked_ids, empty=not has_likes)
+    return with_validators(response, etag, last_modified)
 
 
-@app.route('/users/add_like/<int:recipe_id>', methods=['POST'])
-def add_like(recipe_id):
-    '''Like a recipe.'''
+def toggle_current_user_like(recipe_id):
+    '''Toggle g.user's like of a recipe. Returns (liked, error message).'''
+
+    recipe = db.session.query(Recipe.user_id).filter(Recipe.id == recipe_id).first()
+    if recipe is None:
+        abort(404)
+
+    if recipe.user_id == g.user.id:
+        return None, 'Sorry! You are not allowed to like your own recipes.'
+
+    liked = toggle_like(g.user.id, recipe_id)
+    db.session.commit()
+    recommender.record(g.user.id, recipe_id, liked)
+
+    return liked, None
+
+
+def like_and_redirect(recipe_id, next_url, code=302):
+    '''Shared body of the form-based like routes.'''
 
     if not g.user:
         flash('Access unauthorized', 'danger')
         return redirect('/')
 
-    current_recipe = Recipe.query.get_or_404(recipe_id)
-    if current_recipe.user_id == g.user.id:
-        flash('Sorry! You are not allowed to like your own recipes.', 'warning')
+    liked, error = toggle_current_user_like(recipe_id)
+    if error:
+        flash(error, 'warning')
         return redirect('/')
 
-    user_likes = g.user.likes
+    return redirect(next_url, code=code)
 
-    if current_recipe in user_likes:
-        g.user.likes = [like for like in user_likes if like != current_recipe]
-    else:
-        g.user.likes.append(current_recipe)
-    
-    db.session.commit()
 
-    return redirect('/')
+@bp.route('/users/add_like/<int:recipe_id>', methods=['POST'])
+def add_like(recipe_id):
+    '''Like a recipe.'''
+
+    return like_and_redirect(recipe_id, '/')
 
 
-@app.route('/users/unlike/<int:recipe_id>', methods=['POST'])
+@bp.route('/users/unlike/<int:recipe_id>', methods=['POST'])
 def unlike(recipe_id):
     '''Unlike a recipe.'''
 
-    if not g.user:
-        flash('Access unauthorized', 'danger')
-        return redirect('/')
+    return like_and_redirect(recipe_id, f'/users/{g.user.id}/likes' if g.user else '/')
 
-    current_recipe = Recipe.query.get_or_404(recipe_id)
-    if current_recipe.user_id == g.user.id:
-        flash('Sorry! You are not allowed to like your own recipes.', 'warning')
-        return redirect('/')
 
-    user_likes = g.user.likes
+@bp.route('/api/likes/<int:recipe_id>/toggle', methods=['POST'])
+def toggle_like_json(recipe_id):
+    '''Like or unlike a recipe without reloading the page.'''
 
-    if current_recipe in user_likes:
-        g.user.likes = [like for like in user_likes if like != current_recipe]
-    else:
-        g.user.likes.append(current_recipe)
-    
-    db.session.commit()
+    if not g.user:
+        return jsonify(error='Access unauthorized'), 401
 
-    return redirect(f'/users/{g.user.id}/likes')
+    liked, error = toggle_current_user_like(recipe_id)
+    if error:
+        return jsonify(error=error), 403
 
+    return jsonify(recipe_id=recipe_id, liked=liked)
 
-@app.route('/users/search', methods=['GET', 'POST'])
+
+@bp.route('/users/search', methods=['GET', 'POST'])
 def search():
-    '''Search all the recipes in the website.'''
+    '''Search all the recipes in the website.
+
+    A POST searches the stored recipes, queues an Edamam fetch if they are
+    too few, keeps the ordered result ids as a snapshot and redirects to it.
+    GET ?rs=<id>&page=N shows one page of a snapshot, reading only its
+    recipes and the user's likes.
+    '''
 
     if not g.user:
         flash('Access unauthorized', 'danger')
         return redirect('/')
 
-    recipes_list = []
-
     if request.method == 'POST':
+        search_term = request.form.get('query', '')
+        term = normalize_query(search_term)[:200]
+        if term:
+            count = SearchQuery.record(term)
+            db.session.commit()
+            typeahead.record(term, count)
 
-        if request.form:
-            search_term = request.form.get('query')
-            session[CURR_SEARCH_REQUEST] = search_term
-        else:
-            search_term = session[CURR_SEARCH_REQUEST]
-        
-        response = requests.get(f'https://api.edamam.com/api/recipes/v2?type=public&q={search_term}&app_id=d097d304&app_key=ccb5ad1a079a4045adc90a739f7f2785')
-        results = response.json()
-
-        sample_user = User.query.get(1)
-
-        for recipe in results['hits']:
-            new_dict = {k: v for k, v in recipe['recipe'].items() if k in {'label', 'image',  'ingredientLines', 'cuisineType', 'dishType', 'url'}}
-            
-            url = new_dict['url']
-            existing_recipe = Recipe.query.filter_by(url=url).first()
-            if existing_recipe:
-                recipes_list.append(existing_recipe)
-            else:
-                new_recipe = Recipe(
-                title=new_dict['label'], 
-                recipe_image=new_dict['image'], 
-                url=new_dict['url'], 
-                recipe=new_dict['ingredientLines'], 
-                cuisine_type=new_dict['cuisineType'][0].capitalize(), 
-                dish_type=new_dict.get('dishType', ['none'])[0].capitalize()
-                )
-                sample_user.recipes.append(new_recipe)
-
-                recipes_list.append(new_recipe)
-
-
-                
-        db.session.commit()
-        liked_recipe_ids = [recipe.id for recipe in g.user.likes]
+        recipes_list = search_index.search(search_term, limit=current_app.config['SEARCH_LOCAL_LIMIT'])
+
+        # Only go out to Edamam when we don't already know enough matching recipes,
+        # and then in the background: the page polls for the job's results.
+        job_id = None
+        if len(recipes_list) < current_app.config['SEARCH_LOCAL_MIN'] and search_term.strip():
+            job_id = ingest_queue.enqueue(search_term).id
+
+        snapshot_id = search_snapshots.create(search_term, [recipe.id for recipe in recipes_list], job_id=job_id)
+        return redirect(url_for('.search', rs=snapshot_id), code=303)
+
+    snapshot_id = request.args.get('rs')
+    snapshot = search_snapshots.get(snapshot_id) if snapshot_id else None
+    if snapshot_id and snapshot is None:
+        flash('These search results have expired, please search again.', 'warning')
+
+    recipes_list = []
+    query = None
+    page = max(request.args.get('page', 1, type=int), 1)
+    pages = 1
+    if snapshot is not None:
+        query = snapshot['query']
+        per_page = current_app.config['RECIPES_PER_PAGE']
+        pages = max((len(snapshot['ids']) + per_page - 1) // per_page, 1)
+        page = min(page, pages)
+        page_ids = snapshot['ids'][(page - 1) * per_page:page * per_page]
+
+        # Recipes deleted since the search are left out.
+        recipes = {recipe.id: recipe for recipe in Recipe.query.filter(Recipe.id.in_(page_ids))}
+        recipes_list = [recipes[recipe_id] for recipe_id in page_ids if recipe_id in recipes]
+        session[CURR_SEARCH_REQUEST] = url_for('.search', rs=snapshot_id, page=page)
+
+    liked_ids = liked_recipe_ids(g.user.id, ttl=current_app.config['LIKED_IDS_TTL'])
     
-    return render_template('users/search.html', recipes=recipes_list, likes=liked_recipe_ids)
+    return render_template('users/search.html', recipes=recipes_list, likes=liked_ids,
+        query=query, snapshot_id=snapshot_id if snapshot else None, page=page, pages=pages,
+        job_id=snapshot.get('job') if snapshot else None)
 
 
-@app.route('/users/like/<int:recipe_id>', methods=['POST'])
-def like(recipe_id):
-    '''Like a recipe.'''
+@bp.route('/api/search/jobs/<int:job_id>')
+def search_job_status(job_id):
+    '''Status of a background Edamam fetch. Once done, the url of a snapshot with its results.
+
+    ?rs= is the snapshot of the search that is waiting on the job; its local
+    matches are kept at the top of the results.
+    '''
 
     if not g.user:
-        flash('Access unauthorized', 'danger')
-        return redirect('/')
+        return jsonify(error='Access unauthorized'), 401
 
-    current_recipe = Recipe.query.get_or_404(recipe_id)
-    if current_recipe.user_id == g.user.id:
-        flash('Sorry! You are not allowed to like your own recipes.', 'warning')
-        return redirect('/')
+    job = IngestJob.query.get_or_404(job_id)
+    if job.status == 'done':
+        return jsonify(status='done', url=url_for('.search', rs=job_snapshot(job, request.args.get('rs'))))
+    if job.status == 'failed':
+        return jsonify(status='failed', message='Recipe search is slow right now, showing the recipes we already have.')
+    return jsonify(status=job.status)
 
-    user_likes = g.user.likes
 
-    if current_recipe in user_likes:
-        g.user.likes = [like for like in user_likes if like != current_recipe]
-    else:
-        g.user.likes.append(current_recipe)
-    # pdb.set_trace()
+def job_snapshot(job, waiting_id):
+    '''Id of the snapshot of a finished job: the local matches of the waiting snapshot, then the fetched recipes.
 
-    try:
-        db.session.commit()
-    except Exception as e:
-        print(e)
+    Made on the first poll after the job is done and kept on the job, so
+    later polls, and other searches sharing the job, get the same one.
+    '''
 
-    return redirect('/users/search', code=307)
-    
+    if job.snapshot_id and search_snapshots.get(job.snapshot_id) is not None:
+        return job.snapshot_id
+
+    waiting = search_snapshots.get(waiting_id) if waiting_id else None
+    local_ids = waiting['ids'] if waiting is not None and waiting.get('job') == job.id else []
+    seen = set(local_ids)
+    ids = local_ids + [recipe_id for recipe_id in job.result_ids if recipe_id not in seen]
+    snapshot_id = search_snapshots.create(waiting['query'] if waiting is not None else job.term, ids)
+
+    # Only one of two polls racing here gets its snapshot kept on the job.
+    stored = (IngestJob.query
+        .filter(IngestJob.id == job.id, IngestJob.snapshot_id == job.snapshot_id)
+        .update({'snapshot_id': snapshot_id}, synchronize_session=False))
+    db.session.commit()
+    if not stored:
+        return IngestJob.query.get(job.id).snapshot_id
+    return snapshot_id
+
+
+@bp.route('/api/typeahead')
+def typeahead_suggestions():
+    '''Suggestions for the search box as the user types: popular searches, then recipe titles.'''
+
+    if not g.user:
+        return jsonify(error='Access unauthorized'), 401
+
+    prefix = request.args.get('q', '')
+    suggestions = typeahead.suggest(prefix, limit=current_app.config['TYPEAHEAD_LIMIT'])
+    response = jsonify(query=prefix, suggestions=suggestions)
+    # Backspacing over a prefix asks for it again; let the browser answer that.
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    return response
+
+
+@bp.route('/users/like/<int:recipe_id>', methods=['POST'])
+def like(recipe_id):
+    '''Like a recipe and go back to the search results page it was liked on.'''
+
+    return like_and_redirect(recipe_id, session.get(CURR_SEARCH_REQUEST) or url_for('.search'))
 
 
 # ------- Recipes route ------- #
 
-@app.route('/recipes/add', methods=['GET', 'POST'])
+@bp.route('/recipes/add', methods=['GET', 'POST'])
 def add_recipe():
     '''Add a new recipe.'''
 
@@ -301,14 +547,18 @@ def add_recipe():
         )
         
         g.user.recipes.append(recipe)
+        FacetCount.add([recipe])
         db.session.commit()
+        search_index.add([recipe])
+        pantry_search.add([recipe])
+        typeahead.add([recipe])
 
         return redirect(f'/users/{g.user.id}/recipes')
 
     return render_template('recipes/new.html', form=form)
 
 
-@app.route('/recipes/<int:recipe_id>/delete', methods=['POST'])
+@bp.route('/recipes/<int:recipe_id>/delete', methods=['POST'])
 def delete_recipe(recipe_id):
     '''Delete recipes.'''
 
@@ -317,24 +567,127 @@ def delete_recipe(recipe_id):
         return redirect('/')
 
     recipe = Recipe.query.get_or_404(recipe_id)
+    FacetCount.remove([recipe])
     db.session.delete(recipe)
     db.session.commit()
+    search_index.remove(recipe_id)
+    pantry_search.remove(recipe_id)
+    typeahead.remove(recipe_id)
 
     return redirect(f'/users/{g.user.id}/recipes')
 
 
+@bp.route('/recipes/browse')
+def browse_recipes():
+    '''Browse recipes by cuisine type and/or dish type.'''
+
+    if not g.user:
+        flash('Access unauthorized', 'danger')
+        return redirect('/')
+
+    cuisine_type = request.args.get('cuisine') or None
+    dish_type = request.args.get('dish') or None
+
+    query = Recipe.query
+    if cuisine_type:
+        query = query.filter(Recipe.cuisine_type == cuisine_type)
+    if dish_type:
+        query = query.filter(Recipe.dish_type == dish_type)
+
+    recipes, has_prev, has_next = Recipe.keyset_page(
+        after=request.args.get('after', type=int),
+        before=request.args.get('before', type=int),
+        per_page=current_app.config['RECIPES_PER_PAGE'],
+        query=query
+    )
+
+    return render_template(
+        'recipes/browse.html',
+        recipes=recipes,
+        likes=liked_recipe_ids(g.user.id, ttl=current_app.config['LIKED_IDS_TTL']),
+        cuisine=cuisine_type,
+        dish=dish_type,
+        cuisine_counts=FacetCount.counts('cuisine_type', dish_type=dish_type),
+        dish_counts=FacetCount.counts('dish_type', cuisine_type=cuisine_type),
+        prev_cursor=recipes[0].id if has_prev and recipes else None,
+        next_cursor=recipes[-1].id if has_next and recipes else None
+    )
+
+
+@bp.route('/recipes/pantry')
+def pantry():
+    '''Find recipes to cook with the ingredients the user has, allowing a few missing ones.'''
+
+    if not g.user:
+        flash('Access unauthorized', 'danger')
+        return redirect('/')
+
+    have_text = request.args.get('have', '')
+    have = [item.strip() for item in re.split(r'[,\n]', have_text) if item.strip()]
+    max_missing = min(max(request.args.get('missing', 0, type=int), 0), current_app.config['PANTRY_MAX_MISSING'])
+
+    matches = pantry_search.search(have, max_missing, limit=current_app.config['RECIPES_PER_PAGE']) if have else []
+
+    groups = [
+        (missing, [recipe for recipe, recipe_missing in matches if recipe_missing == missing])
+        for missing in range(max_missing + 1)
+    ]
+
+    return render_template(
+        'recipes/pantry.html',
+        have=have_text,
+        max_missing=max_missing,
+        max_missing_limit=current_app.config['PANTRY_MAX_MISSING'],
+        groups=[(missing, recipes) for missing, recipes in groups if recipes],
+        searched=bool(have),
+        ready=pantry_search.ready,
+        likes=liked_recipe_ids(g.user.id, ttl=current_app.config['LIKED_IDS_TTL'])
+    )
+
+
 # ------- Home route ------- #
 
-@app.route('/')
+@bp.route('/')
 def homepage():
     '''Show homepage.'''
 
-    recipes = Recipe.query.all()
-
     if g.user:
-        liked_recipe_ids = [recipe.id for recipe in g.user.likes]
+        after = request.args.get('after', type=int)
+        before = request.args.get('before', type=int)
+        per_page = current_app.config['RECIPES_PER_PAGE']
+        liked_ids = liked_recipe_ids(g.user.id, ttl=current_app.config['LIKED_IDS_TTL'])
+
+        # Starts a background refresh of the recommendations if one is due, so
+        # they catch up with new likes even while the page itself is unchanged.
+        recommender.sync()
+
+        # Only on the first page, so paging through the catalog doesn't repeat it. Other
+        # users' likes change what is recommended, so the recommended ids are part of the ETag.
+        recommended_ids = []
+        if after is None and before is None:
+            recommended_ids = recommender.recommend_ids(g.user.id, frozenset(liked_ids), limit=current_app.config['RECOMMEND_LIMIT'])
+        viewer = f'{g.user.id}/{",".join(map(str, recommended_ids))}'
+
+        etag, last_modified = listing_validators(['catalog', f'likes:{g.user.id}'], viewer)
+        if is_fresh(etag, last_modified):
+            return not_modified(etag, last_modified)
+
+        recipes, has_prev, has_next = Recipe.keyset_page(after=after, before=before, per_page=per_page)
+
+        # Counting the whole catalog is a full scan, so only do it when asked for.
+        total = Recipe.query.count() if request.args.get('count') else None
+
+        recommended = recommender.recipes(recommended_ids)
     
-        return render_template('homepage.html', recipes=recipes, likes=liked_recipe_ids)
+        return with_validators(make_response(render_template(
+            'homepage.html',
+            recipes=recipes,
+            recommended=recommended,
+            likes=liked_ids,
+            prev_cursor=recipes[0].id if has_prev and recipes else None,
+            next_cursor=recipes[-1].id if has_next and recipes else None,
+            total=total
+        )), etag, last_modified)
     
     return render_template('homepage-anon.html')
 
@@ -0,0 +1,91 @@
+'''Synthetic users, recipes and likes for load tests.
+
+Point DATABASE_URL at a scratch database first.
+
+    DATABASE_URL=postgresql:///capstone_one_bench python -m benchmarks.datagen --users 1000 --recipes 100000 --likes 50
+'''
+
+import argparse
+import random
+
+from models import db, dialect_insert, User, Recipe, Likes
+from benchmarks.stub_edamam import synthetic_page
+
+BENCH_PASSWORD = 'benchpassword'
+WORDS = ['chicken', 'beef', 'tofu', 'salmon', 'pasta', 'rice', 'curry', 'soup', 'salad', 'cake', 'bread', 'taco']
+
+
+def bench_username(n):
+    return f'benchuser{n}'
+
+
+def generate(users=100, recipes=10000, likes=20, batch_size=1000, seed=0):
+    '''Add `users` users, `recipes` recipes and about `likes` likes per user.'''
+
+    rng = random.Random(seed)
+
+    # Hash once; every bench user shares the password. Bench users are always
+    # benchuser0..N-1, the names the driver logs in as; ones that exist are kept.
+    password = User.hash_password(BENCH_PASSWORD)
+    for offset in range(0, users, batch_size):
+        db.session.execute(dialect_insert(User.__table__).on_conflict_do_nothing(index_elements=['username']), [
+            {'username': bench_username(n), 'email': f'{bench_username(n)}@example.com', 'password': password}
+            for n in range(offset, min(offset + batch_size, users))
+        ])
+        db.session.commit()
+
+    for offset in range(0, recipes, batch_size):
+        hits = []
+        page = offset // 20
+        while len(hits) < min(batch_size, recipes - offset):
+            hits.extend(synthetic_page(rng.choice(WORDS), f'{seed}-{page}')['hits'])
+            page += 1
+        Recipe.ingest(hits[:min(batch_size, recipes - offset)])
+        db.session.commit()
+        db.session.expunge_all()
+
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+    recipe_ids = [recipe_id for (recipe_id,) in db.session.query(Recipe.id)]
+    if not recipe_ids:
+        return
+
+    # Skew likes towards popular recipes, like real traffic.
+    popular = recipe_ids[:max(1, len(recipe_ids) // 20)]
+    rows = []
+    for user_id in user_ids:
+        for _ in range(likes):
+            recipe_id = rng.choice(popular) if rng.random() < 0.5 else rng.choice(recipe_ids)
+            rows.append({'user_id': user_id, 'recipe_id': recipe_id})
+        if len(rows) >= batch_size:
+            db.session.execute(dialect_insert(Likes.__table__).on_conflict_do_nothing(index_elements=['user_id', 'recipe_id']), rows)
+            db.session.commit()
+            rows = []
+    if rows:
+        db.session.execute(dialect_insert(Likes.__table__).on_conflict_do_nothing(index_elements=['user_id', 'recipe_id']), rows)
+        db.session.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fill the database with synthetic benchmark data.')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--recipes', type=int, default=10000)
+    parser.add_argument('--likes', type=int, default=20, help='likes per user')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables first')
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    from migrations import upgrade
+
+    with create_app().app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+        upgrade()
+        generate(args.users, args.recipes, args.likes, seed=args.seed)
+
+    print(f'Generated {args.users} users, {args.recipes} recipes, ~{args.likes} likes per user. Password: {BENCH_PASSWORD}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+'''Route-level load driver.
+
+Logs in a pool of bench users (see benchmarks.datagen) against a running
+app and hammers the main routes from concurrent threads. It reports
+p50/p95/p99 latency and requests/sec per route and can save the results as
+JSON and compare them with an earlier run.
+
+    gunicorn -w 4 --worker-class gthread --threads 8 --preload wsgi:app &
+    python -m benchmarks.stub_edamam --latency 0.2 &
+    python -m benchmarks.driver --base-url http://127.0.0.1:8000 --duration 30 --out results.json
+    python -m benchmarks.driver --duration 30 --compare results.json
+'''
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import requests
+
+from benchmarks.datagen import BENCH_PASSWORD, WORDS, bench_username
+
+SCENARIOS = ['home', 'search', 'likes', 'login', 'like_toggle', 'like_form']
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+USER_LINK = re.compile(r'/users/(\d+)/')
+
+
+class LoginFailed(Exception):
+    '''A bench user could not log in, so its requests would only time the logged-out redirects.'''
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class VirtualUser:
+    '''One logged-in browser session.'''
+
+    def __init__(self, base_url, n, recipe_ids):
+        self.base_url = base_url
+        self.username = bench_username(n)
+        self.recipe_ids = recipe_ids
+        self.session = requests.Session()
+        self.user_id = None
+        self.csrf_token = None
+
+    def login(self):
+        # The login form is CSRF protected; the token is tied to the session, so one fetch will do.
+        if self.csrf_token is None:
+            match = CSRF_TOKEN.search(self.session.get(f'{self.base_url}/login').text)
+            self.csrf_token = match.group(1) if match else ''
+        response = self.session.post(
+            f'{self.base_url}/login',
+            data={'username': self.username, 'password': BENCH_PASSWORD, 'csrf_token': self.csrf_token},
+            allow_redirects=False
+        )
+        return response
+
+    def sign_in(self):
+        '''Log in and find the user's id, or raise LoginFailed.'''
+
+        response = self.login()
+        if not response.is_redirect or urlparse(response.headers['Location']).path != '/':
+            raise LoginFailed(
+                f'{self.username} could not log in (HTTP {response.status_code}). '
+                f'Create the bench users first: python -m benchmarks.datagen --users N'
+            )
+
+        # The likes page needs the numeric user id, which the navbar links carry.
+        match = USER_LINK.search(self.session.get(f'{self.base_url}/').text)
+        if match is None:
+            raise LoginFailed(f'No user id on the homepage for {self.username}')
+        self.user_id = match.group(1)
+
+    def run(self, scenario, rng):
+        url = self.base_url
+        if scenario == 'home':
+            return self.session.get(f'{url}/')
+        if scenario == 'search':
+            return self.session.post(f'{url}/users/search', data={'query': rng.choice(WORDS)})
+        if scenario == 'likes':
+            return self.session.get(f'{url}/users/{self.user_id}/likes')
+        if scenario == 'login':
+            return self.login()
+        if scenario == 'like_toggle':
+            return self.session.post(f'{url}/api/likes/{rng.choice(self.recipe_ids)}/toggle')
+        if scenario == 'like_form':
+            return self.session.post(f'{url}/users/add_like/{rng.choice(self.recipe_ids)}', allow_redirects=False)
+        raise ValueError(scenario)
+
+
+def drive(base_url, users=10, duration=10.0, scenarios=SCENARIOS, recipe_ids=None, seed=0):
+    '''Run the scenarios for `duration` seconds with `users` concurrent sessions. Returns the report dict.'''
+
+    recipe_ids = recipe_ids or list(range(1, 1001))
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    vusers = [VirtualUser(base_url, n, recipe_ids) for n in range(users)]
+    for vuser in vusers:
+        vuser.sign_in()
+
+    deadline = time.perf_counter() + duration
+
+    def worker(vuser, n):
+        rng = random.Random(seed + n)
+        while time.perf_counter() < deadline:
+            scenario = rng.choice(scenarios)
+            started = time.perf_counter()
+            try:
+                response = vuser.run(scenario, rng)
+                failed = response.status_code >= 500
+            except requests.RequestException:
+                failed = True
+            elapsed = time.perf_counter() - started
+            with lock:
+                timings[scenario].append(elapsed)
+                if failed:
+                    errors[scenario] += 1
+
+    threads = [threading.Thread(target=worker, args=(vuser, n)) for n, vuser in enumerate(vusers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    report = {'base_url': base_url, 'users': users, 'duration': wall, 'routes': {}}
+    for scenario, values in sorted(timings.items()):
+        values.sort()
+        report['routes'][scenario] = {
+            'requests': len(values),
+            'errors': errors[scenario],
+            'rps': len(values) / wall,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+        }
+    return report
+
+
+def print_report(report, baseline=None):
+    print(f'{"route":<12} {"reqs":>7} {"err":>5} {"rps":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for route, stats in report['routes'].items():
+        line = f'{route:<12} {stats["requests"]:>7} {stats["errors"]:>5} {stats["rps"]:>8.1f} {stats["p50_ms"]:>9.1f} {stats["p95_ms"]:>9.1f} {stats["p99_ms"]:>9.1f}'
+        old = (baseline or {}).get('routes', {}).get(route)
+        if old and old['p95_ms']:
+            line += f'   p95 {100 * (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"]:+.0f}%'
+        print(line)
+
+
+def regressions(report, baseline, threshold=0.2):
+    '''Routes whose p95 got more than `threshold` slower than in baseline.'''
+
+    slower = []
+    for route, stats in report['routes'].items():
+        old = baseline.get('routes', {}).get(route)
+        if old and old['p95_ms'] and stats['p95_ms'] > old['p95_ms'] * (1 + threshold):
+            slower.append(route)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the main app routes.')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--users', type=int, default=10, help='concurrent logged-in sessions')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='limit to these routes, repeatable')
+    parser.add_argument('--recipes', type=int, default=1000, help='like recipe ids 1..N')
+    parser.add_argument('--out', help='save the report as JSON')
+    parser.add_argument('--compare', help='earlier JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p95 slowdown that counts as a regression')
+    args = parser.parse_args(argv)
+
+    try:
+        report = drive(args.base_url, args.users, args.duration, args.scenario or SCENARIOS, list(range(1, args.recipes + 1)))
+    except LoginFailed as e:
+        sys.exit(f'Login failed: {e}')
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_report(report, baseline)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if baseline is not None:
+        slower = regressions(report, baseline, args.threshold)
+        if slower:
+            print(f'Regressed: {", ".join(slower)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+'''Cold start timings.
+
+Each run starts a fresh interpreter, so module imports are measured the way a
+gunicorn worker or a test run pays for them. It reports the median time to
+import app, to build the app with create_app(), and to answer the first
+request to /metrics (which touches no database).
+
+    python -m benchmarks.startup --runs 10
+'''
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+flask_app.test_client().get('/metrics')
+served = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported, 'first_request': served - created}))
+'''
+
+
+def measure(runs=5):
+    '''Median seconds per startup phase over `runs` fresh interpreters.'''
+
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {phase: statistics.median(sample[phase] for sample in samples) for phase in samples[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time app import, create_app() and the first request.')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for phase, seconds in measure(args.runs).items():
+        print(f'{phase:<14} {seconds * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
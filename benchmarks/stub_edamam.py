@@ -0,0 +1,124 @@
+'''Local stand-in for the Edamam recipe search API.
+
+Replays pages recorded with `importer.py --save-jsonl` (or synthesizes
+recipes when no recording is given) after a configurable delay, so load
+tests don't depend on the real API. Point the app at it with
+EDAMAM_URL=http://127.0.0.1:<port>/api/recipes/v2.
+
+    python -m benchmarks.stub_edamam --port 8001 --latency 0.2 --recording dump.jsonl
+'''
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+CUISINES = ['American', 'Asian', 'British', 'Chinese', 'French', 'Indian', 'Italian', 'Mexican']
+DISHES = ['Main course', 'Soup', 'Salad', 'Desserts', 'Starter', 'Bread']
+
+
+def synthetic_page(query, page, per_page=20):
+    '''A deterministic fake page of hits for query.'''
+
+    rng = random.Random(f'{query}:{page}')
+    return {
+        'hits': [
+            {'recipe': {
+                'label': f'{query.title()} Recipe {page}-{n}',
+                'image': f'https://example.com/images/{query}/{page}/{n}.jpg',
+                'url': f'https://example.com/recipes/{query}/{page}/{n}',
+                'ingredientLines': [f'{rng.randint(1, 4)} cups {query}', 'salt', 'pepper'],
+                'cuisineType': [rng.choice(CUISINES).lower()],
+                'dishType': [rng.choice(DISHES).lower()],
+            }}
+            for n in range(per_page)
+        ]
+    }
+
+
+class StubEdamam:
+    '''Pages to serve and how slowly to serve them.'''
+
+    def __init__(self, recording=None, latency=0.0, jitter=0.0, pages=5):
+        self.latency = latency
+        self.jitter = jitter
+        self.pages = pages
+        self.recorded = []
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        if recording:
+            with open(recording) as f:
+                self.recorded = [json.loads(line) for line in f if line.strip()]
+
+    def page(self, query, page):
+        if self.recorded:
+            # Recorded pages are shared by every query, rotated so queries differ.
+            offset = sum(map(ord, query))
+            body = dict(self.recorded[(offset + page - 1) % len(self.recorded)])
+        else:
+            body = synthetic_page(query, page)
+        body['_links'] = {}
+        return body
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                query = params.get('q', [''])[0]
+                page = int(params.get('page', ['1'])[0])
+
+                time.sleep(max(0.0, stub.latency + random.uniform(-stub.jitter, stub.jitter)))
+
+                body = stub.page(query, page)
+                if page < stub.pages:
+                    next_params = urlencode({'q': query, 'page': page + 1})
+                    body['_links']['next'] = {'href': f'http://{self.headers["Host"]}{url.path}?{next_params}'}
+
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def serve(self, host='127.0.0.1', port=0):
+        '''Start serving on a background thread. Returns the server; its port is server.server_port.'''
+
+        server = ThreadingHTTPServer((host, port), self.handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the Edamam API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--recording', help='JSONL of recorded Edamam pages')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds to wait before answering')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--pages', type=int, default=5, help='pages available per query')
+    args = parser.parse_args(argv)
+
+    stub = StubEdamam(args.recording, args.latency, args.jitter, args.pages)
+    server = ThreadingHTTPServer((args.host, args.port), stub.handler())
+    print(f'Stub Edamam on http://{args.host}:{args.port}/api/recipes/v2')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
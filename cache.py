@@ -0,0 +1,293 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import delete, func, select
+
+from models import db, SearchSnapshot, dialect_insert
+
+
+def normalize_query(query):
+    '''Lowercase and collapse whitespace so "Chicken " and "chicken" share an entry.'''
+
+    return ' '.join((query or '').lower().split())
+
+
+class MemoryBackend:
+    '''Size-bounded LRU store private to one worker process.'''
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Return (value, expires) for key, or None.'''
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteBackend:
+    '''Size-bounded LRU store in a local sqlite file, shared by every gunicorn worker on the box.'''
+
+    def __init__(self, path, maxsize=512):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+
+        with self._conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires REAL NOT NULL,
+                used REAL NOT NULL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        '''Open new connections in a forked child instead of sharing the parent's.'''
+
+        self._local = threading.local()
+
+    def get(self, key):
+        '''Return (value, expires) for key, or None.'''
+
+        conn = self._conn()
+        row = conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute('UPDATE cache SET used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires):
+        with self._conn() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires, used) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), expires, time.time())
+            )
+            conn.execute(
+                '''DELETE FROM cache WHERE key IN (
+                    SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)''',
+                (self.maxsize,)
+            )
+
+    def delete(self, key):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM cache')
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+class DatabaseBackend:
+    '''Store in a table of the app's database, shared by every worker on every dyno.
+
+    Entries are dropped once expired rather than by size: writing one deletes
+    the rows that have expired since.
+    '''
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, key):
+        '''Return (value, expires) for key, or None.'''
+
+        with db.engine.connect() as conn:
+            row = conn.execute(select(self.table.c.value, self.table.c.expires).where(self.table.c.key == key)).first()
+        if row is None:
+            return None
+        return json.loads(row.value), row.expires
+
+    def set(self, key, value, expires):
+        stmt = dialect_insert(self.table).values(key=key, value=json.dumps(value), expires=expires)
+        stmt = stmt.on_conflict_do_update(index_elements=['key'], set_={'value': stmt.excluded.value, 'expires': stmt.excluded.expires})
+        with db.engine.begin() as conn:
+            conn.execute(stmt)
+            conn.execute(delete(self.table).where(self.table.c.expires < time.time()))
+
+    def delete(self, key):
+        with db.engine.begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.key == key))
+
+    def clear(self):
+        with db.engine.begin() as conn:
+            conn.execute(delete(self.table))
+
+    def __len__(self):
+        with db.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(self.table)).scalar()
+
+
+def make_backend(kind, path, maxsize):
+    '''A MemoryBackend, a SqliteBackend at path when kind is 'sqlite', or the app database's search_snapshots table.'''
+
+    if kind == 'database':
+        return DatabaseBackend(SearchSnapshot.__table__)
+    if kind == 'sqlite':
+        # A bare filename lives in the working directory, which exists already.
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SqliteBackend(path, maxsize)
+    return MemoryBackend(maxsize)
+
+
+class SearchCache:
+    '''TTL cache of Edamam search responses keyed by the normalized query.'''
+
+    def __init__(self, backend=None, ttl=3600):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        '''Pick the backend and limits from the app config.'''
+
+        self.backend = make_backend(
+            app.config.get('SEARCH_CACHE_BACKEND', 'memory'),
+            app.config.get('SEARCH_CACHE_PATH') or os.path.join(app.instance_path, 'search_cache.sqlite'),
+            app.config.get('SEARCH_CACHE_SIZE', 512)
+        )
+        self.ttl = app.config.get('SEARCH_CACHE_TTL', 3600)
+
+    def after_fork(self):
+        if hasattr(self.backend, 'after_fork'):
+            self.backend.after_fork()
+
+    def get(self, query):
+        '''Return the cached response for query, or None if missing or expired.'''
+
+        entry = self.backend.get(normalize_query(query))
+        if entry is None or entry[1] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def get_stale(self, query):
+        '''Return the cached response for query even if it has expired, or None.
+
+        Expired entries stay until they are evicted, so this is the fallback
+        when Edamam can't be asked.
+        '''
+
+        entry = self.backend.get(normalize_query(query))
+        return entry[0] if entry is not None else None
+
+    def set(self, query, value):
+        self.backend.set(normalize_query(query), value, time.time() + self.ttl)
+
+    def stats(self):
+        '''Hit/miss counters for this worker.'''
+
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.backend),
+        }
+
+
+class SearchSnapshots:
+    '''Ordered recipe ids of a search, kept for a while under a short random id.
+
+    A search is run once and its result pages are then plain GETs of
+    /users/search?rs=<id>&page=N, which only read the recipes on that page.
+    Those GETs can land on any worker, so snapshots are kept in the database
+    by default. The memory backend only suits a single worker.
+    '''
+
+    def __init__(self, backend=None, ttl=1800):
+        self.backend = backend if backend is not None else MemoryBackend(4096)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.backend = make_backend(
+            app.config.get('SEARCH_SNAPSHOT_BACKEND', 'database'),
+            app.config.get('SEARCH_SNAPSHOT_PATH') or os.path.join(app.instance_path, 'search_snapshots.sqlite'),
+            app.config.get('SEARCH_SNAPSHOT_SIZE', 4096)
+        )
+        self.ttl = app.config.get('SEARCH_SNAPSHOT_TTL', 1800)
+
+    def after_fork(self):
+        if hasattr(self.backend, 'after_fork'):
+            self.backend.after_fork()
+
+    def create(self, query, recipe_ids, job_id=None):
+        '''Store the ids in order and return the snapshot id.
+
+        job_id is the background fetch whose results will replace these ids, if any.
+        '''
+
+        snapshot = {'query': query, 'ids': list(recipe_ids)}
+        if job_id is not None:
+            snapshot['job'] = job_id
+        snapshot_id = secrets.token_urlsafe(8)
+        self.backend.set(snapshot_id, snapshot, time.time() + self.ttl)
+        return snapshot_id
+
+    def get(self, snapshot_id):
+        '''{'query': ..., 'ids': [...]} for snapshot_id, or None if unknown or expired.'''
+
+        entry = self.backend.get(snapshot_id)
+        if entry is None or entry[1] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def stats(self):
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+        # Counting the shared table on every scrape would be a query per worker; only local stores report a size.
+        if not isinstance(self.backend, DatabaseBackend):
+            stats['size'] = len(self.backend)
+        return stats
+
+
+search_cache = SearchCache()
+search_snapshots = SearchSnapshots()
@@ -0,0 +1,102 @@
+import threading
+
+from flask import current_app
+from markupsafe import Markup
+
+from cache import MemoryBackend
+
+CARD_TEMPLATE = 'macros/recipe_card.html'
+
+# Stands in for the heart icon class, which is the only per-user part of a card.
+HEART_SLOT = '__heart_slot__'
+LIKED = 'fa-solid'
+NOT_LIKED = 'fa-regular'
+
+
+class RecipeCards:
+    '''Rendered recipe card HTML, cached per worker.
+
+    Cards are keyed by (recipe id, recipe version, footer action), so editing a
+    recipe bumps its version and the next page renders it afresh. The cached
+    HTML is split around the heart icon class, which each request fills in from
+    its own liked ids; a page of cached cards is then just string joins.
+    '''
+
+    def __init__(self, maxsize=4096):
+        self.backend = MemoryBackend(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.backend = MemoryBackend(app.config.get('CARD_CACHE_SIZE', self.backend.maxsize))
+        app.jinja_env.globals['recipe_cards'] = self.render
+        app.jinja_env.globals['recipe_card_stream'] = self.stream
+
+    def parts(self, recipe, action):
+        '''(head, tail) of one card's HTML; tail is None for cards without a heart.'''
+
+        key = (recipe.id, recipe.version, action)
+        entry = self.backend.get(key)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            return entry[0]
+
+        macro = current_app.jinja_env.get_template(CARD_TEMPLATE).module.recipe_card
+        html = str(macro(recipe, action, HEART_SLOT))
+        # Split on the last slot: it sits in the footer, after any user-written text.
+        parts = tuple(html.rsplit(HEART_SLOT, 1)) if action != 'delete' else (html, None)
+
+        self.backend.set(key, parts, float('inf'))
+        with self._lock:
+            self.misses += 1
+        return parts
+
+    def _append(self, html, recipe, action, likes):
+        head, tail = self.parts(recipe, action)
+        html.append(head)
+        if tail is not None:
+            html.append(LIKED if recipe.id in likes else NOT_LIKED)
+            html.append(tail)
+
+    def render(self, recipes, action, likes=frozenset()):
+        '''HTML for a list of cards with the heart filled in from `likes`.'''
+
+        html = []
+        for recipe in recipes:
+            self._append(html, recipe, action, likes)
+        return Markup(''.join(html))
+
+    def stream(self, recipes, action, likes=frozenset(), batch=50):
+        '''Like render(), but yields the HTML `batch` cards at a time, consuming recipes lazily.'''
+
+        html = []
+        for n, recipe in enumerate(recipes, 1):
+            self._append(html, recipe, action, likes)
+            if n % batch == 0:
+                yield Markup(''.join(html))
+                html = []
+        if html:
+            yield Markup(''.join(html))
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        '''Hit/miss counters for this worker.'''
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.backend),
+            }
+
+
+recipe_cards = RecipeCards()
@@ -0,0 +1,73 @@
+'''ETag / Last-Modified validators for listing pages.
+
+A page's validators are derived from the ListingVersion stamps it depends
+on, the viewer, and a digest of the templates, so a client holding a current
+copy gets a 304 after one small primary-key lookup: no recipe rows are loaded
+and nothing is rendered.
+'''
+
+import hashlib
+import os
+from datetime import timezone
+
+from flask import Response, current_app, request, session
+
+from models import ListingVersion
+
+
+def template_digest(app):
+    '''Hash of every template, so a deploy that changes the markup changes every ETag.'''
+
+    digest = hashlib.sha1()
+    root = os.path.join(app.root_path, app.template_folder)
+    for folder, _, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            with open(os.path.join(folder, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def listing_validators(scopes, viewer_id):
+    '''(etag, last_modified) for a page built from scopes, as seen by viewer_id.'''
+
+    scopes = sorted(set(scopes))
+    stamps = ListingVersion.stamps(scopes)
+
+    versions = ','.join(f'{scope}={stamps[scope][0] if scope in stamps else 0}' for scope in scopes)
+    if 'TEMPLATE_DIGEST' not in current_app.config:
+        current_app.config['TEMPLATE_DIGEST'] = template_digest(current_app)
+    key = f'{current_app.config["TEMPLATE_DIGEST"]}|{viewer_id}|{versions}'
+    etag = hashlib.sha1(key.encode()).hexdigest()[:20]
+
+    updated = [updated_at for _, updated_at in stamps.values()]
+    last_modified = max(updated).replace(tzinfo=timezone.utc) if updated else None
+
+    return etag, last_modified
+
+
+def is_fresh(etag, last_modified):
+    '''True if the client's cached copy is current. Pending flash messages always force a render.'''
+
+    if session.get('_flashes'):
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def with_validators(response, etag, last_modified):
+    '''Add the validators and make browsers revalidate on every visit.'''
+
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified(etag, last_modified):
+    return with_validators(Response(status=304), etag, last_modified)
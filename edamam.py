@@ -0,0 +1,206 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache import normalize_query
+from metrics import upstream_coalesced, upstream_seconds, upstream_throttled
+from quota import SingleFlight, TokenBucket
+
+API_URL = 'https://api.edamam.com/api/recipes/v2'
+
+RECIPE_FIELDS = ['label', 'image', 'ingredientLines', 'cuisineType', 'dishType', 'url']
+
+
+class EdamamError(Exception):
+    '''Edamam could not be reached in time or answered with an error.'''
+
+
+class EdamamThrottled(EdamamError):
+    '''The call would go over our Edamam rate limit, so it was not made.'''
+
+
+def trim_results(results):
+    '''Keep only the parts of an Edamam response we use, so cached entries stay small.'''
+
+    return {
+        'hits': [{'recipe': {k: v for k, v in hit['recipe'].items() if k in RECIPE_FIELDS}} for hit in results['hits']],
+        '_links': results.get('_links', {}),
+    }
+
+
+class EdamamClient:
+    '''Edamam recipe search over a pooled keep-alive session.
+
+    Every call has connect/read timeouts and retries idempotent failures with
+    exponential backoff. Follow-up pages are fetched on a thread pool as soon
+    as their link is known, so the caller can work on one page while the next
+    one is on the wire.
+
+    Identical searches running at the same time in one worker share a single
+    upstream call. With a quota set, every page costs a token from a bucket
+    shared by all workers, and calls over budget raise EdamamThrottled
+    instead of being sent.
+    '''
+
+    def __init__(self, app_id=None, app_key=None, base_url=API_URL, timeout=(3.05, 10), retries=2, backoff=0.3, pool_size=10):
+        self.app_id = app_id or os.environ.get('EDAMAM_APP_ID', 'd097d304')
+        self.app_key = app_key or os.environ.get('EDAMAM_APP_KEY', 'ccb5ad1a079a4045adc90a739f7f2785')
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.quota = None
+        self.quota_wait = 0.0
+        self.flights = SingleFlight()
+        self._session = None
+        self._executor = None
+
+    def init_app(self, app):
+        '''Take credentials, endpoint and limits from the app config.'''
+
+        self.app_id = app.config.get('EDAMAM_APP_ID', self.app_id)
+        self.app_key = app.config.get('EDAMAM_APP_KEY', self.app_key)
+        self.base_url = app.config.get('EDAMAM_URL', self.base_url)
+        self.timeout = (app.config.get('EDAMAM_CONNECT_TIMEOUT', self.timeout[0]), app.config.get('EDAMAM_READ_TIMEOUT', self.timeout[1]))
+        self.retries = app.config.get('EDAMAM_RETRIES', self.retries)
+
+        rate = app.config.get('EDAMAM_RATE', 0)
+        if rate:
+            path = app.config.get('EDAMAM_QUOTA_PATH') or os.path.join(app.instance_path, 'edamam_quota.sqlite')
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.quota = TokenBucket(path, rate, app.config.get('EDAMAM_BURST', 10), name='edamam')
+        else:
+            self.quota = None
+        self.quota_wait = app.config.get('EDAMAM_QUOTA_WAIT', 0.0)
+        self.close()
+
+    @property
+    def session(self):
+        if self._session is None:
+            retry = Retry(
+                total=self.retries,
+                backoff_factor=self.backoff,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(['GET']),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='edamam')
+        return self._executor
+
+    def close(self):
+        '''Drop pooled connections and threads, e.g. after a config change or fork.'''
+
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def after_fork(self):
+        '''Forget the parent's session and threads without closing sockets it still uses.'''
+
+        self._session = None
+        self._executor = None
+        self.flights.after_fork()
+        if self.quota is not None:
+            self.quota.after_fork()
+
+    def get(self, url, params=None):
+        '''GET one page of results as trimmed JSON.'''
+
+        if self.quota is not None and not self.quota.take(wait=self.quota_wait):
+            upstream_throttled.inc(service='edamam')
+            raise EdamamThrottled('Over the Edamam rate limit')
+
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            status = str(response.status_code)
+            response.raise_for_status()
+            results = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise EdamamError(str(e)) from e
+        finally:
+            upstream_seconds.observe(time.perf_counter() - started, service='edamam', status=status)
+
+        if 'hits' not in results:
+            raise EdamamError(f'Unexpected response: {results}')
+
+        return trim_results(results)
+
+    def iter_pages(self, query, pages=1, start_url=None):
+        '''Yield up to `pages` pages for query, prefetching each next page in the background.
+
+        `start_url` resumes from a `_links.next` href saved earlier.
+        '''
+
+        if start_url:
+            page = self.get(start_url)
+        else:
+            params = {
+                'type': 'public',
+                'q': query,
+                'app_id': self.app_id,
+                'app_key': self.app_key,
+                'field': RECIPE_FIELDS,
+            }
+            page = self.get(self.base_url, params)
+
+        for n in range(1, pages + 1):
+            next_url = page['_links'].get('next', {}).get('href')
+            pending = self.executor.submit(self.get, next_url) if next_url and n < pages else None
+
+            yield page
+
+            if pending is None:
+                return
+            page = pending.result()
+
+    def search(self, query, pages=1):
+        '''All hits from the first `pages` pages for query, in order.
+
+        Callers searching for the same thing at the same time get one shared
+        result, so treat it as read-only.
+        '''
+
+        results, shared = self.flights.do((normalize_query(query), pages), self._search, query, pages)
+        if shared:
+            upstream_coalesced.inc(service='edamam')
+        return results
+
+    def _search(self, query, pages):
+        hits = []
+        links = {}
+        for page in self.iter_pages(query, pages):
+            hits.extend(page['hits'])
+            links = page['_links']
+        return {'hits': hits, '_links': links}
+
+    def search_many(self, queries, pages=1):
+        '''Run several searches concurrently. Returns {query: results}.'''
+
+        # A separate pool, so searches waiting on their prefetched pages can't starve them of threads.
+        with ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='edamam-search') as pool:
+            futures = {query: pool.submit(self.search, query, pages) for query in queries}
+            return {query: future.result() for query, future in futures.items()}
+
+
+edamam_client = EdamamClient()
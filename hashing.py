@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HashingBusy(Exception):
+    '''Too many password hashes are already queued; the caller should retry later.'''
+
+
+class HashExecutor:
+    '''Bounded thread pool for bcrypt work.
+
+    bcrypt releases the GIL, so hashing on a small pool keeps a login storm
+    from monopolising the worker. Once `max_workers + max_queue` hashes are in
+    flight, new ones are refused with HashingBusy instead of piling up.
+
+    The caller still waits for its hash, so this only helps when a worker
+    serves several requests at once: the Procfile runs gthread workers with
+    more threads than `max_workers + max_queue`, leaving the rest for
+    requests that don't hash. With sync workers the cap is never reached.
+    '''
+
+    def __init__(self, max_workers=2, max_queue=8):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    def init_app(self, app):
+        self.max_workers = app.config.get('BCRYPT_WORKERS', self.max_workers)
+        self.max_queue = app.config.get('BCRYPT_QUEUE', self.max_queue)
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self.close()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bcrypt')
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def after_fork(self):
+        '''A forked child has none of the parent's pool threads; start a fresh pool on first use.'''
+
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+
+    def run(self, fn, *args):
+        '''Run fn(*args) on the pool and wait for its result.'''
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy()
+
+        submitted = time.perf_counter()
+
+        def timed():
+            waited = time.perf_counter() - submitted
+            with self._lock:
+                self.queue_time_total += waited
+                self.queue_time_max = max(self.queue_time_max, waited)
+            return fn(*args)
+
+        try:
+            result = self.executor.submit(timed).result()
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'queue_time_avg': self.queue_time_total / finished if finished else 0.0,
+                'queue_time_max': self.queue_time_max,
+            }
+
+
+hash_executor = HashExecutor()
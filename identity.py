@@ -0,0 +1,49 @@
+import time
+
+from cache import MemoryBackend
+from models import db, User
+
+identity_cache = MemoryBackend(maxsize=4096)
+
+
+class CurrentUser:
+    '''The logged-in user's id and username. The full User row is only loaded when a route touches anything else.'''
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+        self._user = None
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = User.query.get(self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        # Only called for attributes not set in __init__, e.g. likes or recipes.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __repr__(self):
+        return f'<CurrentUser {self.id} {self.username}>'
+
+
+def load_identity(user_id, ttl=300):
+    '''CurrentUser for user_id, or None if there is no such user.
+
+    Identities are cached per worker for `ttl` seconds, so most requests
+    don't touch the users table at all.
+    '''
+
+    entry = identity_cache.get(user_id)
+    if entry is not None and entry[1] > time.time():
+        return CurrentUser(*entry[0])
+
+    row = db.session.query(User.id, User.username).filter(User.id == user_id).first()
+    if row is None:
+        return None
+
+    identity_cache.set(user_id, (row.id, row.username), time.time() + ttl)
+    return CurrentUser(row.id, row.username)
@@ -0,0 +1,335 @@
+'''Proxy and thumbnail cache for recipe images.
+
+Cards link to /images/<token>, where the token is the source url signed with
+the app's secret key, so only images we rendered can be fetched. The first
+request downloads the image, shrinks and recompresses it (when Pillow is
+installed) and stores it on disk under the hash of its bytes. Later requests,
+from any worker, are served from disk with year-long cache headers, even
+after Edamam's signed image url has expired.
+'''
+
+import hashlib
+import io
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+from urllib.parse import urljoin, urlparse
+
+import requests
+from flask import abort, redirect, send_file
+from itsdangerous import BadSignature, URLSafeSerializer
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import upstream_seconds
+
+try:
+    from PIL import Image
+    UNREADABLE_IMAGE = (OSError, ValueError, Image.DecompressionBombError)
+except ImportError:
+    Image = None
+    UNREADABLE_IMAGE = (OSError, ValueError)
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+class ImageFetchError(Exception):
+    '''The source image could not be downloaded or is not an image.'''
+
+
+def public_address(host):
+    '''An address to connect to host at, or None unless every address it resolves to is publicly routable.'''
+
+    try:
+        infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return None
+    addresses = [info[4][0].split('%')[0] for info in infos]
+    if not addresses or not all(ipaddress.ip_address(address).is_global for address in addresses):
+        return None
+    return addresses[0]
+
+
+def is_public_host(host):
+    '''True if every address host resolves to is publicly routable.'''
+
+    return public_address(host) is not None
+
+
+class PublicAddressConnection:
+    '''Connects to the address public_address() checked instead of looking the host up again.
+
+    A second lookup could get a different answer (DNS rebinding) and reach a
+    private address after all. TLS still verifies the host name.
+    '''
+
+    def _new_conn(self):
+        address = public_address(self.host)
+        if address is None:
+            raise ImageFetchError(f'Refusing non-public host: {self.host}')
+        self._dns_host = address
+        return super()._new_conn()
+
+
+class PublicHTTPConnection(PublicAddressConnection, HTTPConnection):
+    pass
+
+
+class PublicHTTPSConnection(PublicAddressConnection, HTTPSConnection):
+    pass
+
+
+class PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = PublicHTTPConnection
+
+
+class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = PublicHTTPSConnection
+
+
+class PublicOnlyAdapter(HTTPAdapter):
+    '''Transport adapter whose connections only ever go to public addresses.'''
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': PublicHTTPConnectionPool, 'https': PublicHTTPSConnectionPool}
+
+
+def make_thumbnail(data, width, quality=80):
+    '''(bytes, content type) of the image scaled down to `width` pixels wide as a JPEG.
+
+    Without Pillow the original bytes are kept as they are.
+    '''
+
+    if Image is None:
+        return data, None
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((width, width * 4))
+        if image.mode != 'RGB':
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+        return out.getvalue(), 'image/jpeg'
+
+
+class DiskCache:
+    '''Content-addressed blobs plus url -> blob references, bounded by total blob size.
+
+    Files are written to a temporary name and renamed into place, so several
+    workers can share one directory. Least recently served blobs are evicted
+    first; a reference to an evicted blob simply reads as a miss.
+    '''
+
+    def __init__(self, root, max_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, kind, digest):
+        return os.path.join(self.root, kind, digest[:2], digest)
+
+    def _write(self, path, data):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        '''(blob path, content type) stored for key, or None.'''
+
+        try:
+            with open(self._path('refs', key)) as f:
+                ref = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        path = self._path('blobs', ref['digest'])
+        try:
+            # The mtime doubles as the last-served time for eviction.
+            os.utime(path)
+        except OSError:
+            return None
+        return path, ref['type']
+
+    def set(self, key, data, content_type):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path('blobs', digest)
+        if not os.path.exists(path):
+            self._write(path, data)
+            with self._lock:
+                if self._size is not None:
+                    self._size += len(data)
+        self._write(self._path('refs', key), json.dumps({'digest': digest, 'type': content_type}).encode())
+        self.evict()
+        return path
+
+    def blobs(self):
+        for folder, _, files in os.walk(os.path.join(self.root, 'blobs')):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        '''Delete the least recently served blobs until the cache is below 90% of max_bytes.'''
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self.blobs())
+            if self._size <= self.max_bytes:
+                return
+
+            # Other workers write here too, so count again before deleting.
+            blobs = sorted(self.blobs())
+            total = sum(size for _, size, _ in blobs)
+            for _, size, path in blobs:
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+            self._size = total
+
+
+class ImageProxy:
+    '''Signed image urls and the /images/<token> route behind them.'''
+
+    def __init__(self):
+        self.serializer = None
+        self.cache = None
+        self.width = 600
+        self.max_bytes = 10 * 1024 * 1024
+        self.timeout = (3.05, 10)
+        self.allow_private = False
+        self._session = None
+
+    def init_app(self, app):
+        self.serializer = URLSafeSerializer(app.config['SECRET_KEY'], salt='image-proxy')
+        self.cache = DiskCache(
+            app.config.get('IMAGE_CACHE_DIR') or os.path.join(app.instance_path, 'image_cache'),
+            app.config.get('IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+        )
+        self.width = app.config.get('IMAGE_THUMB_WIDTH', self.width)
+        self.allow_private = app.config.get('IMAGE_PROXY_ALLOW_PRIVATE', False)
+
+        app.add_url_rule('/images/<token>', 'recipe_image', self.view)
+        app.jinja_env.globals['image_url'] = self.url_for
+
+    @property
+    def session(self):
+        '''Shared session; unless private hosts are allowed, it only connects to public addresses.'''
+
+        if self._session is None:
+            self._session = requests.Session()
+            if not self.allow_private:
+                adapter = PublicOnlyAdapter()
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def after_fork(self):
+        self._session = None
+
+    def url_for(self, source):
+        '''Proxy url for an image url; anything that isn't http(s) is returned unchanged.'''
+
+        if not source or urlparse(source).scheme not in ('http', 'https'):
+            return source
+        return f'/images/{self.serializer.dumps(source)}'
+
+    def check_url(self, source):
+        url = urlparse(source)
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise ImageFetchError(f'Unsupported url: {source}')
+        if not self.allow_private and not is_public_host(url.hostname):
+            raise ImageFetchError(f'Refusing non-public host: {url.hostname}')
+
+    def fetch(self, source, max_redirects=3):
+        '''Download source, refusing non-public hosts (also after redirects), non-images and oversized bodies.'''
+
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            for _ in range(max_redirects + 1):
+                self.check_url(source)
+                with self.session.get(source, timeout=self.timeout, stream=True, allow_redirects=False) as response:
+                    status = str(response.status_code)
+                    if response.is_redirect:
+                        source = urljoin(source, response.headers['Location'])
+                        continue
+
+                    response.raise_for_status()
+                    content_type = response.headers.get('Content-Type', '')
+                    if not content_type.startswith('image/'):
+                        raise ImageFetchError(f'Not an image: {content_type}')
+
+                    data = bytearray()
+                    for chunk in response.iter_content(64 * 1024):
+                        data += chunk
+                        if len(data) > self.max_bytes:
+                            raise ImageFetchError('Image too large')
+                    return bytes(data), content_type
+
+            raise ImageFetchError('Too many redirects')
+        except requests.RequestException as e:
+            raise ImageFetchError(str(e)) from e
+        finally:
+            upstream_seconds.observe(time.perf_counter() - started, service='images', status=status)
+
+    def thumbnail(self, source):
+        '''(path, content type) of the cached thumbnail for source, fetching it on a miss.'''
+
+        key = hashlib.sha256(f'{self.width}|{source}'.encode()).hexdigest()
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry
+
+        data, content_type = self.fetch(source)
+        try:
+            thumb, thumb_type = make_thumbnail(data, self.width)
+        except UNREADABLE_IMAGE as e:
+            raise ImageFetchError(f'Unreadable image: {e}') from e
+        content_type = thumb_type or content_type
+
+        return self.cache.set(key, thumb, content_type), content_type
+
+    def view(self, token):
+        try:
+            source = self.serializer.loads(token)
+        except BadSignature:
+            abort(404)
+
+        try:
+            path, content_type = self.thumbnail(source)
+        except ImageFetchError:
+            # Let the browser try the original; nothing is cached, so we retry next time.
+            return redirect(source)
+
+        response = send_file(path, mimetype=content_type, max_age=ONE_YEAR, etag=os.path.basename(path), conditional=True)
+        response.cache_control.immutable = True
+        return response
+
+
+image_proxy = ImageProxy()
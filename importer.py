@@ -0,0 +1,188 @@
+'''Bulk recipe importer.
+
+Streams Edamam pages, from the live API or from JSONL dumps, through a
+generator pipeline into batched inserts. Recipes are deduplicated on url and
+existing data is never dropped. Progress is checkpointed after every
+committed batch, so an interrupted load picks up where it stopped.
+
+    python importer.py --query chicken --query beef --pages 50 --save-jsonl dump.jsonl
+    python importer.py --jsonl dump.jsonl
+'''
+
+import argparse
+import json
+import os
+
+from models import db, User, Recipe
+from edamam import edamam_client
+
+
+class Checkpoint:
+    '''Import progress kept in a JSON file, written atomically.
+
+    For API sources it remembers each query's next page link and whether the
+    query is finished. For JSONL sources it remembers the byte offset reached.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.state = {'api': {}, 'jsonl': {}}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def get(self, kind, key):
+        return self.state[kind].get(key)
+
+    def update(self, kind, key, value):
+        self.state[kind][key] = value
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+
+def api_hits(queries, pages, checkpoint, client=edamam_client, save_to=None):
+    '''Yield (hit, marker) for every hit of every query.
+
+    marker is None except on the last hit of a page, where it is the
+    checkpoint entry to record once that hit is committed.
+    '''
+
+    for query in queries:
+        progress = checkpoint.get('api', query) or {'next': None, 'pages': 0, 'done': False}
+        if progress['done'] or progress['pages'] >= pages:
+            continue
+
+        for page in client.iter_pages(query, pages - progress['pages'], start_url=progress['next']):
+            if save_to is not None:
+                save_to.write(json.dumps(page) + '\n')
+
+            next_url = page['_links'].get('next', {}).get('href')
+            progress = {'next': next_url, 'pages': progress['pages'] + 1, 'done': next_url is None}
+
+            for n, hit in enumerate(page['hits'], 1):
+                yield hit, (('api', query, progress) if n == len(page['hits']) else None)
+            if not page['hits']:
+                yield None, ('api', query, progress)
+
+
+def jsonl_hits(paths, checkpoint):
+    '''Yield (hit, marker) from JSONL dumps of Edamam pages or single hits.'''
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            f.seek(checkpoint.get('jsonl', path) or 0)
+
+            for line in iter(f.readline, b''):
+                marker = ('jsonl', path, f.tell())
+                if not line.strip():
+                    yield None, marker
+                    continue
+
+                record = json.loads(line)
+                hits = record['hits'] if 'hits' in record else [record]
+
+                for n, hit in enumerate(hits, 1):
+                    yield hit, (marker if n == len(hits) else None)
+                if not hits:
+                    yield None, marker
+
+
+def batched(items, size):
+    '''Group (hit, marker) pairs into lists of up to `size` hits.'''
+
+    batch = []
+    markers = []
+    for hit, marker in items:
+        if hit is not None:
+            batch.append(hit)
+        if marker is not None:
+            markers.append(marker)
+        if len(batch) >= size:
+            yield batch, markers
+            batch, markers = [], []
+    if batch or markers:
+        yield batch, markers
+
+
+def load(items, checkpoint, user_id=None, batch_size=500):
+    '''Insert hits batch by batch, checkpointing after each commit. Returns (seen, stored) counts.'''
+
+    seen = 0
+    before = Recipe.query.count()
+
+    for batch, markers in batched(items, batch_size):
+        Recipe.ingest(batch, user_id=user_id)
+        db.session.commit()
+        # Drop the batch's rows from the session so memory stays flat.
+        db.session.expunge_all()
+
+        for kind, key, value in markers:
+            checkpoint.update(kind, key, value)
+        checkpoint.save()
+        seen += len(batch)
+
+    return seen, Recipe.query.count() - before
+
+
+def run_import(queries=(), jsonl=(), pages=1, checkpoint_path=None, batch_size=500, username='Recipe King', save_jsonl=None):
+    '''Import from every given source. Returns (seen, stored) counts.'''
+
+    checkpoint = Checkpoint(checkpoint_path)
+    user = User.query.filter_by(username=username).first() if username else None
+    user_id = user.id if user else None
+
+    save_to = open(save_jsonl, 'a') if save_jsonl else None
+    try:
+        seen, stored = load(jsonl_hits(jsonl, checkpoint), checkpoint, user_id, batch_size)
+        api_seen, api_stored = load(api_hits(queries, pages, checkpoint, save_to=save_to), checkpoint, user_id, batch_size)
+    finally:
+        if save_to is not None:
+            save_to.close()
+
+    return seen + api_seen, stored + api_stored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import recipes from Edamam or JSONL dumps.')
+    parser.add_argument('--query', action='append', default=[], help='search term to import, repeatable')
+    parser.add_argument('--queries-file', help='file with one search term per line')
+    parser.add_argument('--pages', type=int, default=1, help='pages to read per query')
+    parser.add_argument('--jsonl', action='append', default=[], help='JSONL dump of Edamam pages or hits, repeatable')
+    parser.add_argument('--save-jsonl', help='append every fetched API page to this JSONL file')
+    parser.add_argument('--checkpoint', default='import_checkpoint.json', help='progress file used to resume')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--user', default='Recipe King', help='username that owns imported recipes')
+    args = parser.parse_args(argv)
+
+    queries = list(args.query)
+    if args.queries_file:
+        with open(args.queries_file) as f:
+            queries.extend(line.strip() for line in f if line.strip())
+
+    from app import create_app
+    from migrations import upgrade
+
+    with create_app().app_context():
+        db.create_all()
+        upgrade()
+        seen, stored = run_import(
+            queries=queries,
+            jsonl=args.jsonl,
+            pages=args.pages,
+            checkpoint_path=args.checkpoint,
+            batch_size=args.batch_size,
+            username=args.user,
+            save_jsonl=args.save_jsonl,
+        )
+
+    print(f'Read {seen} recipes, stored {stored} new ones.')
+
+
+if __name__ == '__main__':
+    main()
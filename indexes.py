@@ -0,0 +1,157 @@
+'''In-process indexes kept in step with the database off the request path.
+
+The recommender, the pantry search and the typeahead each keep an index
+built from a table in every worker. Building one takes seconds on a large
+catalog, so it never happens on a request thread: sync() only looks at the
+clock, and when a rebuild or refresh is due it runs it on a daemon thread
+and returns. Requests keep answering from the index they have until the new
+one is swapped in.
+'''
+
+import threading
+import time
+
+from models import db
+
+
+class SyncedIndex:
+    '''Rebuild and refresh timing for an index read from the database.
+
+    Subclasses implement build(), which reads the tables into a fresh index
+    and returns a function that installs it, and refresh(), which reads the
+    rows added since into the installed index. Both run with `_lock` free,
+    so requests are never held up by them.
+
+    behind() may report changes that need a refresh before the interval is up.
+
+    Changes made through this worker go through change(). Changes made while
+    a rebuild is reading the tables are applied again once its index is
+    installed, so none are lost in the swap; they must be safe to apply
+    twice. With BACKGROUND_INDEX_BUILDS off (the tests) the work runs inline.
+    '''
+
+    config_prefix = None
+
+    def __init__(self, refresh=30, rebuild=3600):
+        self.app = None
+        self.background = True
+        self.refresh_every = refresh
+        self.rebuild_every = rebuild
+        self.refreshed_at = None
+        self.rebuilt_at = None
+        self.retry_at = None
+        self.builds = 0
+        self._running = False
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.background = app.config.get('BACKGROUND_INDEX_BUILDS', self.background)
+        self.refresh_every = app.config.get(f'{self.config_prefix}_REFRESH', self.refresh_every)
+        self.rebuild_every = app.config.get(f'{self.config_prefix}_REBUILD', self.rebuild_every)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.refreshed_at = None
+            self.rebuilt_at = None
+            self.retry_at = None
+            self.builds = 0
+            self._pending = None
+
+    def after_fork(self):
+        '''A forked child has none of the parent's threads, so no build is running in it.'''
+
+        self._running = False
+        self._pending = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        '''True once the first build was installed.'''
+
+        return self.rebuilt_at is not None
+
+    def behind(self):
+        '''True if the installed index has changes waiting for refresh().'''
+
+        return False
+
+    def build(self):
+        raise NotImplementedError
+
+    def refresh(self):
+        raise NotImplementedError
+
+    def sync(self):
+        '''Start a rebuild or refresh if one is due and none is running. Never waits for it.'''
+
+        now = time.monotonic()
+        with self._lock:
+            if self._running or (self.retry_at is not None and now < self.retry_at):
+                return
+            if self.rebuilt_at is None or now - self.rebuilt_at >= self.rebuild_every:
+                work = self._rebuild
+                self._pending = []
+            elif now - self.refreshed_at >= self.refresh_every or self.behind():
+                work = self._refresh
+            else:
+                return
+            self._running = True
+
+        if self.background:
+            thread = threading.Thread(target=self._run_in_app, args=(work,), name=f'{type(self).__name__}-sync', daemon=True)
+            thread.start()
+        else:
+            self._run(work)
+
+    def change(self, fn):
+        '''Apply fn() to the installed index, and again to the one a running rebuild is making.
+
+        fn must look the index up when called (self.index, not a copy of it).
+        Before the first build there is nothing to change: the build reads it.
+        '''
+
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(fn)
+            ready = self.rebuilt_at is not None
+        if ready:
+            fn()
+
+    def _rebuild(self):
+        install = self.build()
+        with self._lock:
+            install()
+            pending, self._pending = self._pending or [], None
+            self.rebuilt_at = self.refreshed_at = time.monotonic()
+            self.builds += 1
+        for fn in pending:
+            fn()
+
+    def _refresh(self):
+        self.refresh()
+        self.refreshed_at = time.monotonic()
+
+    def _run(self, work):
+        try:
+            work()
+            self.retry_at = None
+        except Exception:
+            # Try again after a refresh interval rather than on every request.
+            self.retry_at = time.monotonic() + self.refresh_every
+            with self._lock:
+                self._pending = None
+            if not self.background:
+                raise
+            self.app.logger.exception(f'{type(self).__name__} sync failed')
+        finally:
+            self._running = False
+
+    def _run_in_app(self, work):
+        with self.app.app_context():
+            try:
+                self._run(work)
+            finally:
+                db.session.remove()
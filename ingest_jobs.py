@@ -0,0 +1,237 @@
+'''Background ingestion of Edamam searches.
+
+search() answers right away from the recipes we already have and queues the
+Edamam fetch as an IngestJob row. Worker threads in each web process claim
+queued jobs, fetch and store the hits, and record the resulting recipe ids.
+The search page polls /api/search/jobs/<id> until they are there.
+
+The queue lives in the database, so a job survives a restart and any
+process can run it. To run the workers in a process of their own, set
+INGEST_WORKERS=0 on the web processes and start:
+
+    python ingest_jobs.py
+'''
+
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from cache import normalize_query, search_cache
+from edamam import edamam_client, EdamamError
+from metrics import upstream_fallbacks
+from models import db, IngestJob, Recipe, User
+from pantry import pantry_search
+from search_index import search_index
+from typeahead import typeahead
+
+PENDING = ('queued', 'running')
+
+
+def fetch_remote_recipes(search_term):
+    '''Search Edamam (through the response cache) and store any new hits.
+
+    If Edamam can't be reached or we're over our rate limit, an expired
+    cached response is used instead. Returns None if there isn't one either.
+    '''
+
+    results = search_cache.get(search_term)
+    if results is None:
+        try:
+            results = edamam_client.search(search_term, pages=current_app.config['EDAMAM_PAGES'])
+        except EdamamError:
+            results = search_cache.get_stale(search_term)
+            upstream_fallbacks.inc(service='edamam', fallback='local' if results is None else 'stale')
+            if results is None:
+                return None
+        else:
+            search_cache.set(search_term, results)
+
+    # Recipes pulled from the API belong to the sample user created by seed.py.
+    sample_user = User.query.get(1)
+
+    recipes_list = Recipe.ingest(results['hits'], user_id=sample_user.id if sample_user else None)
+    recipe_ids = [recipe.id for recipe in recipes_list]
+    db.session.commit()
+
+    # Reload the rows expired by the commit in one query instead of one per card.
+    Recipe.query.filter(Recipe.id.in_(recipe_ids)).all()
+    search_index.add(recipes_list)
+    pantry_search.add(recipes_list)
+    typeahead.add(recipes_list)
+
+    return recipes_list
+
+
+class IngestQueue:
+    '''IngestJob rows worked off by a small pool of daemon threads.
+
+    Threads start on the first enqueue in each process and wake up as soon
+    as this process queues a job. Jobs queued elsewhere, and jobs whose
+    worker died (after `lease` seconds), are picked up within `poll` seconds.
+    '''
+
+    def __init__(self, workers=2, poll=2.0, lease=300, max_attempts=3):
+        self.app = None
+        self.workers = workers
+        self.poll = poll
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.completed = 0
+        self.failed = 0
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('INGEST_WORKERS', self.workers)
+        self.poll = app.config.get('INGEST_POLL', self.poll)
+        self.lease = app.config.get('INGEST_LEASE', self.lease)
+        self.max_attempts = app.config.get('INGEST_MAX_ATTEMPTS', self.max_attempts)
+
+    def after_fork(self):
+        '''A forked child has none of the parent's threads; start new ones on the next enqueue.'''
+
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads or not self.workers:
+                return
+            self._stop.clear()
+            for n in range(self.workers):
+                thread = threading.Thread(target=self.work, name=f'ingest-{n}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join()
+
+    def enqueue(self, search_term):
+        '''Queue a fetch for search_term, or return the one already waiting or running for it.'''
+
+        term = normalize_query(search_term)
+        job = (IngestJob.query
+            .filter(IngestJob.term == term, IngestJob.status.in_(PENDING))
+            .order_by(IngestJob.id.desc())
+            .first())
+        if job is None:
+            job = IngestJob(term=term)
+            db.session.add(job)
+            db.session.commit()
+
+        self.start()
+        self._wake.set()
+        return job
+
+    def claim(self):
+        '''Mark the oldest job that is queued, or whose lease ran out, as running and return it.'''
+
+        now = datetime.utcnow()
+        job = (IngestJob.query
+            .filter(db.or_(
+                IngestJob.status == 'queued',
+                db.and_(IngestJob.status == 'running', IngestJob.updated_at < now - timedelta(seconds=self.lease))
+            ))
+            .order_by(IngestJob.id)
+            .with_for_update(skip_locked=True)
+            .first())
+        if job is None:
+            db.session.rollback()
+            return None
+
+        job.status = 'running'
+        job.attempts += 1
+        job.updated_at = now
+        db.session.commit()
+        return job
+
+    def run(self, job):
+        '''Fetch and store one claimed job and record how it went.'''
+
+        job_id = job.id
+        retry = False
+        try:
+            recipes = fetch_remote_recipes(job.term)
+            error = None if recipes is not None else 'Edamam could not be reached'
+        except Exception as e:
+            db.session.rollback()
+            recipes, error = None, repr(e)
+            # The Edamam client already retried its own failures; anything else gets another go.
+            retry = True
+
+        job = IngestJob.query.get(job_id)
+        if recipes is not None:
+            job.status = 'done'
+            job.recipe_ids = ','.join(str(recipe.id) for recipe in recipes)
+        elif retry and job.attempts < self.max_attempts:
+            job.status = 'queued'
+        else:
+            job.status = 'failed'
+        job.error = error
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+
+        with self._lock:
+            if job.status == 'done':
+                self.completed += 1
+            elif job.status == 'failed':
+                self.failed += 1
+        return job
+
+    def run_pending(self):
+        '''Run jobs until none is left to claim. Returns how many were run.'''
+
+        count = 0
+        while not self._stop.is_set():
+            job = self.claim()
+            if job is None:
+                break
+            self.run(job)
+            count += 1
+        return count
+
+    def work(self):
+        '''Worker loop: run what's pending, then sleep until woken or `poll` seconds pass.'''
+
+        while not self._stop.is_set():
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    self.run_pending()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Ingest worker failed')
+                finally:
+                    db.session.remove()
+            self._wake.wait(self.poll)
+
+    def stats(self):
+        '''Job counters for this process.'''
+
+        with self._lock:
+            return {
+                'completed': self.completed,
+                'failed': self.failed,
+                'threads': len(self._threads),
+            }
+
+
+ingest_queue = IngestQueue()
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    create_app()
+    ingest_queue.work()
@@ -0,0 +1,236 @@
+'''Always-on request, SQL and upstream instrumentation in Prometheus text format.
+
+Flask request signals time every request per route, SQLAlchemy cursor events
+count and time the queries each request runs, and the Edamam client records
+its own call latency and status, plus how often calls were throttled,
+coalesced or replaced by a fallback. Everything is exposed at /metrics.
+
+Numbers are kept per process, so with several gunicorn workers each scrape
+sees the worker that answered it; label or sum them in Prometheus as usual.
+'''
+
+import threading
+import time
+
+from flask import Response, g, has_app_context, request, request_finished, request_started
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    '''Monotonic count per label set.'''
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self.values.items())
+        return [f'{self.name}{format_labels(self.labels, key)} {format_value(value)}' for key, value in values]
+
+
+class Histogram:
+    '''Bucketed observations per label set, with their sum and count.'''
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts, total = self.values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[n] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, _ = self.values.get(tuple(labels[name] for name in self.labels), ([], 0.0))
+        return sum(counts)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+
+        lines = []
+        for key, (counts, total) in values:
+            running = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                running += count
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, key, [("le", format_value(bound))])} {running}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, key)} {running}')
+        return lines
+
+
+class Registry:
+    '''Metrics to expose, plus callbacks read as gauges at scrape time.'''
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = {}
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self, prefix, stats):
+        '''Expose every number in the dict returned by stats() as a gauge named prefix_key.'''
+
+        self.collectors[prefix] = stats
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+
+        for prefix, stats in self.collectors.items():
+            for key, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f'# TYPE {prefix}_{key} gauge')
+                lines.append(f'{prefix}_{key} {format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_seconds = registry.histogram(
+    'http_request_duration_seconds', 'Time spent answering requests.', ['method', 'route'])
+requests_total = registry.counter(
+    'http_requests_total', 'Requests answered, by status code.', ['method', 'route', 'status'])
+request_queries = registry.histogram(
+    'http_request_sql_queries', 'SQL statements run per request.', ['route'], QUERY_COUNT_BUCKETS)
+request_sql_seconds = registry.histogram(
+    'http_request_sql_duration_seconds', 'Time per request spent waiting on SQL.', ['route'])
+sql_seconds = registry.histogram(
+    'sql_query_duration_seconds', 'Time per SQL statement, by leading keyword.', ['statement'])
+upstream_seconds = registry.histogram(
+    'upstream_request_duration_seconds', 'Time per outbound API call, by final status.', ['service', 'status'])
+upstream_throttled = registry.counter(
+    'upstream_throttled_total', 'Outbound calls refused by the shared rate limit.', ['service'])
+upstream_coalesced = registry.counter(
+    'upstream_coalesced_total', 'Outbound calls answered by an identical call already in flight.', ['service'])
+upstream_fallbacks = registry.counter(
+    'upstream_fallback_total', 'Searches answered without the API, by what was served instead.', ['service', 'fallback'])
+
+
+def current_route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else '<unmatched>'
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    sql_seconds.observe(elapsed, statement=keyword)
+
+    if has_app_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+        g.metrics_sql_seconds += elapsed
+
+
+def handle_error(context):
+    # A statement that raised never reaches after_cursor_execute, so its start time is dropped here.
+    started = context.connection.info.get('metrics_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+class Metrics:
+    '''Hooks the instrumentation into an app and serves /metrics.'''
+
+    def __init__(self, registry=registry):
+        self.registry = registry
+
+    def init_app(self, app):
+        request_started.connect(self.request_started, app, weak=False)
+        request_finished.connect(self.request_finished, app, weak=False)
+
+        # Engine-wide and process-wide, so every statement is counted exactly once.
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+            event.listen(Engine, 'handle_error', handle_error)
+
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def view(self):
+        return Response(self.registry.render(), content_type=CONTENT_TYPE)
+
+    def request_started(self, sender, **extra):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_seconds = 0.0
+
+    def request_finished(self, sender, response, **extra):
+        started = g.get('metrics_started')
+        if started is None:
+            return
+
+        route = current_route()
+        request_seconds.observe(time.perf_counter() - started, method=request.method, route=route)
+        requests_total.inc(method=request.method, route=route, status=str(response.status_code))
+        request_queries.observe(g.metrics_queries, route=route)
+        request_sql_seconds.observe(g.metrics_sql_seconds, route=route)
+
+
+metrics = Metrics()
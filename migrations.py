@@ -0,0 +1,183 @@
+'''Versioned schema migrations for databases created before a model change.
+
+db.create_all() only creates missing tables, so indexes, constraints and
+data backfills for existing tables live here. Every step is idempotent and
+recorded in schema_version. Run with:
+
+    python migrations.py
+'''
+
+from sqlalchemy import inspect, text
+
+from models import db, FacetCount, Ingredient, IngestJob, ListingVersion, SearchQuery, SearchSnapshot, split_ingredient_lines
+from search_index import SEARCH_INDEX_DDL
+
+BATCH_SIZE = 1000
+
+
+def add_indexes(conn):
+    '''Index the foreign keys and facet columns used by per-user and per-facet queries.'''
+
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_recipes_user_id ON recipes (user_id)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_recipes_cuisine_type ON recipes (cuisine_type)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_recipes_dish_type ON recipes (dish_type)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_likes_recipe_id ON likes (recipe_id)'))
+
+
+def unique_likes(conn):
+    '''Drop duplicate likes, then make (user_id, recipe_id) unique. The unique index also serves likes.user_id lookups.'''
+
+    conn.execute(text('''DELETE FROM likes WHERE id NOT IN (
+        SELECT MIN(id) FROM likes GROUP BY user_id, recipe_id)'''))
+    conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS likes_user_id_recipe_id_key ON likes (user_id, recipe_id)'))
+
+
+def full_text_index(conn):
+    '''GIN index behind search_index on Postgres.'''
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(SEARCH_INDEX_DDL))
+
+
+def batched(migrate):
+    '''Mark a migration that commits as it goes.
+
+    It is passed the engine instead of a connection and opens a transaction
+    per batch, so a large backfill doesn't hold one transaction open for its
+    whole run, and a rerun after a failure resumes where it stopped.
+    '''
+
+    migrate.batched = True
+    return migrate
+
+
+@batched
+def ingredients_table(engine):
+    '''Create the ingredients table and fill it from the recipe text of existing rows.
+
+    Older rows store ingredients as a stringified Python list or a Postgres
+    array literal; their recipe text is rewritten one line per ingredient.
+    Recipes that already have ingredient rows are skipped.
+    '''
+
+    with engine.begin() as conn:
+        Ingredient.__table__.create(conn, checkfirst=True)
+
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text('''
+                SELECT id, recipe FROM recipes
+                WHERE id > :last_id AND NOT EXISTS (SELECT 1 FROM ingredients WHERE ingredients.recipe_id = recipes.id)
+                ORDER BY id LIMIT :limit'''), {'last_id': last_id, 'limit': BATCH_SIZE}).fetchall()
+            if not rows:
+                break
+
+            ingredients = []
+            recipes = []
+            for recipe_id, recipe in rows:
+                lines = split_ingredient_lines(recipe)
+                ingredients.extend({'recipe_id': recipe_id, 'position': position, 'line': line} for position, line in enumerate(lines))
+                recipes.append({'id': recipe_id, 'recipe': '\n'.join(lines)})
+
+            if ingredients:
+                conn.execute(Ingredient.__table__.insert(), ingredients)
+            conn.execute(text('UPDATE recipes SET recipe = :recipe WHERE id = :id'), recipes)
+
+        last_id = rows[-1][0]
+
+
+def facet_counts(conn):
+    '''Index (cuisine_type, dish_type) and count the existing recipes per pair once.'''
+
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_recipes_cuisine_type_dish_type_id ON recipes (cuisine_type, dish_type, id)'))
+    FacetCount.__table__.create(conn, checkfirst=True)
+    conn.execute(text('DELETE FROM facet_counts'))
+    conn.execute(text('''INSERT INTO facet_counts (cuisine_type, dish_type, count)
+        SELECT cuisine_type, dish_type, COUNT(*) FROM recipes GROUP BY cuisine_type, dish_type'''))
+
+
+def recipe_versions(conn):
+    '''Version counter on recipes, which the rendered-card cache is keyed on.'''
+
+    if 'version' not in {column['name'] for column in inspect(conn).get_columns('recipes')}:
+        conn.execute(text('ALTER TABLE recipes ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+
+
+def listing_versions(conn):
+    '''Per-listing change counters behind the ETags of listing pages.'''
+
+    ListingVersion.__table__.create(conn, checkfirst=True)
+
+
+def ingest_jobs(conn):
+    '''Durable queue of Edamam searches for the background ingestion workers.'''
+
+    IngestJob.__table__.create(conn, checkfirst=True)
+
+
+def search_queries(conn):
+    '''Search history counts for the typeahead.'''
+
+    SearchQuery.__table__.create(conn, checkfirst=True)
+
+
+def search_snapshots(conn):
+    '''Search result snapshots every worker can read.'''
+
+    SearchSnapshot.__table__.create(conn, checkfirst=True)
+
+
+def ingest_job_snapshots(conn):
+    '''Snapshot of a finished ingest job's results, made once and shared by every poll.'''
+
+    if 'snapshot_id' not in {column['name'] for column in inspect(conn).get_columns('ingest_jobs')}:
+        conn.execute(text('ALTER TABLE ingest_jobs ADD COLUMN snapshot_id TEXT'))
+
+
+MIGRATIONS = [
+    (1, 'index foreign keys and facets', add_indexes),
+    (2, 'unique likes', unique_likes),
+    (3, 'full-text index', full_text_index),
+    (4, 'ingredients table', ingredients_table),
+    (5, 'facet counts', facet_counts),
+    (6, 'recipe versions', recipe_versions),
+    (7, 'listing versions', listing_versions),
+    (8, 'ingest jobs', ingest_jobs),
+    (9, 'search queries', search_queries),
+    (10, 'search snapshots', search_snapshots),
+    (11, 'ingest job snapshots', ingest_job_snapshots),
+]
+
+
+def upgrade():
+    '''Apply every migration not yet recorded in schema_version. Returns the versions applied.'''
+
+    with db.engine.begin() as conn:
+        conn.execute(text('''CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)'''))
+        applied = {version for (version,) in conn.execute(text('SELECT version FROM schema_version'))}
+
+    done = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        if getattr(migrate, 'batched', False):
+            migrate(db.engine)
+        with db.engine.begin() as conn:
+            if not getattr(migrate, 'batched', False):
+                migrate(conn)
+            conn.execute(text('INSERT INTO schema_version (version, name) VALUES (:version, :name)'), {'version': version, 'name': name})
+        done.append(version)
+
+    return done
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    with create_app().app_context():
+        for version in upgrade():
+            print(f'Applied migration {version}')
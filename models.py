@@ -1,5 +1,14 @@
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+import ast
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import event, exc, inspect, select
+from sqlalchemy.pool import Pool
+
+from hashing import hash_executor
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -18,11 +27,18 @@ class User(db.Model):
     recipes = db.relationship('Recipe')
     likes = db.relationship('Recipe', secondary='likes')
 
+    @staticmethod
+    def hash_password(password):
+        '''Hash a password on the bcrypt pool with the configured work factor.'''
+
+        rounds = db.get_app().config.get('BCRYPT_LOG_ROUNDS', 12)
+        return hash_executor.run(bcrypt.generate_password_hash, password, rounds).decode('UTF-8')
+
     @classmethod
     def signup(cls, username, email, password):
         '''Sign up user and hashes the password.'''
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = cls.hash_password(password)
 
         user = User(username=username, email=email, password=hashed_pwd)
 
@@ -36,8 +52,11 @@ class User(db.Model):
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_authenticated = bcrypt.check_password_hash(user.password, password)
+            is_authenticated = hash_executor.run(bcrypt.check_password_hash, user.password, password)
             if is_authenticated:
+                # Stored hashes look like $2b$12$..., so the cost sits between the 2nd and 3rd '$'.
+                if int(user.password.split('$')[2]) != db.get_app().config.get('BCRYPT_LOG_ROUNDS', 12):
+                    user.password = cls.hash_password(password)
                 return user
         return False
 
@@ -46,30 +65,431 @@ class Recipe(db.Model):
     '''Recipes.'''
 
     __tablename__ = 'recipes'
+    __table_args__ = (
+        db.Index('ix_recipes_cuisine_type_dish_type_id', 'cuisine_type', 'dish_type', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.Text, nullable=False)
     recipe_image = db.Column(db.Text, nullable=False)
-    dish_type = db.Column(db.Text, nullable=False)
-    cuisine_type = db.Column(db.Text, nullable=False)
+    dish_type = db.Column(db.Text, nullable=False, index=True)
+    cuisine_type = db.Column(db.Text, nullable=False, index=True)
+    # The ingredient lines, one per line. This is the source of truth: the
+    # ingredients rows are derived from it (see Recipe.sync_ingredients).
     recipe = db.Column(db.Text, nullable=False)
     url = db.Column(db.Text, unique=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='cascade'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='cascade'), index=True)
+    # Bumped by the ORM on every update; cached card HTML is keyed on it.
+    version = db.Column(db.Integer, nullable=False, server_default='1')
 
+    __mapper_args__ = {'version_id_col': version}
 
     user = db.relationship('User', overlaps='recipes')
+    ingredients = db.relationship('Ingredient', order_by='Ingredient.position', cascade='all, delete-orphan', passive_deletes=True)
+
+    @property
+    def ingredient_lines(self):
+        '''Ingredient lines for display, one per line of the recipe text.'''
+
+        return split_ingredient_lines(self.recipe)
+
+    def sync_ingredients(self):
+        '''Rewrite the ingredient rows from the recipe text.
+
+        Runs on every flush of a new recipe or a changed `recipe` (see
+        sync_recipe_ingredients below); Ingredient.add_for does the same for
+        rows inserted in bulk. Rows are reused by position, so the unique
+        (recipe_id, position) key holds at every step of the flush.
+        '''
+
+        lines = self.ingredient_lines
+        rows = self.ingredients
+        for position, line in enumerate(lines):
+            if position < len(rows):
+                if rows[position].line != line:
+                    rows[position].line = line
+            else:
+                rows.append(Ingredient(position=position, line=line))
+        del rows[len(lines):]
+
+    @classmethod
+    def keyset_page(cls, after=None, before=None, per_page=24, query=None):
+        '''One page of recipes ordered by id, seeking from a cursor instead of using OFFSET.
+
+        Pass `query` to page through a filtered set. Returns (recipes, has_prev, has_next).
+        '''
+
+        query = query if query is not None else cls.query
+
+        if before is not None:
+            rows = query.filter(cls.id < before).order_by(cls.id.desc()).limit(per_page + 1).all()
+            has_prev = len(rows) > per_page
+            return list(reversed(rows[:per_page])), has_prev, True
+
+        if after is not None:
+            query = query.filter(cls.id > after)
+
+        rows = query.order_by(cls.id).limit(per_page + 1).all()
+        return rows[:per_page], after is not None, len(rows) > per_page
+
+    @staticmethod
+    def hit_to_row(hit, user_id=None):
+        '''Turn one Edamam hit into a dict of column values.'''
+
+        data = hit['recipe']
+
+        return {
+            'title': data['label'],
+            'recipe_image': data['image'],
+            'url': data['url'],
+            'recipe': '\n'.join(data['ingredientLines']),
+            'cuisine_type': data.get('cuisineType', ['none'])[0].capitalize(),
+            'dish_type': data.get('dishType', ['none'])[0].capitalize(),
+            'user_id': user_id,
+        }
+
+    @classmethod
+    def ingest(cls, hits, user_id=None):
+        '''Store the Edamam hits we don't have yet and return the Recipe rows in hit order.
+
+        Known urls are resolved with one IN lookup and the rest go in with one
+        INSERT ... ON CONFLICT (url) DO NOTHING, so a search costs two round trips
+        instead of one per hit.
+        '''
+
+        rows = {}
+        for hit in hits:
+            row = cls.hit_to_row(hit, user_id)
+            rows.setdefault(row['url'], row)
+
+        if not rows:
+            return []
+
+        found = {recipe.url: recipe for recipe in cls.query.filter(cls.url.in_(list(rows)))}
+        missing = [row for url, row in rows.items() if url not in found]
+
+        if missing:
+            stmt = dialect_insert(cls.__table__).values(missing).on_conflict_do_nothing(index_elements=['url'])
+
+            if db.engine.dialect.name == 'postgresql':
+                stmt = stmt.returning(*cls.__table__.c)
+                inserted = db.session.execute(select(cls).from_statement(stmt)).scalars().all()
+            else:
+                # No RETURNING here; SQLite has a single writer, so every missing url is ours.
+                db.session.execute(stmt)
+                inserted = cls.query.filter(cls.url.in_([row['url'] for row in missing])).all()
+
+            found.update((recipe.url, recipe) for recipe in inserted)
+            Ingredient.add_for(inserted)
+            FacetCount.add(inserted)
+            if inserted:
+                ListingVersion.touch('catalog', f'recipes:{user_id}')
+
+            # Rows another worker inserted between our lookup and our insert.
+            raced = [row['url'] for row in missing if row['url'] not in found]
+            if raced:
+                found.update((recipe.url, recipe) for recipe in cls.query.filter(cls.url.in_(raced)))
+
+        return [found[url] for url in rows]
+
+
+class Ingredient(db.Model):
+    '''One ingredient line of a recipe, in recipe order.
+
+    Derived from Recipe.recipe, for queries by ingredient: change the recipe
+    text and these follow. Bulk UPDATEs of recipes.recipe bypass the ORM,
+    so they must rewrite these rows themselves.
+    '''
+
+    __tablename__ = 'ingredients'
+    __table_args__ = (
+        db.UniqueConstraint('recipe_id', 'position', name='ingredients_recipe_id_position_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete='cascade'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    line = db.Column(db.Text, nullable=False)
+
+    @classmethod
+    def add_for(cls, recipes):
+        '''Insert the ingredient rows of recipes stored in bulk (bypassing the ORM) in one executemany.'''
+
+        rows = [
+            {'recipe_id': recipe.id, 'position': position, 'line': line}
+            for recipe in recipes
+            for position, line in enumerate(recipe.ingredient_lines)
+        ]
+        if rows:
+            db.session.execute(cls.__table__.insert(), rows)
+
+
+class FacetCount(db.Model):
+    '''Number of recipes per (cuisine type, dish type) pair.
+
+    Kept current as recipes are added and deleted, so facet navigation reads
+    this small table instead of grouping over all of recipes.
+    '''
+
+    __tablename__ = 'facet_counts'
+
+    cuisine_type = db.Column(db.Text, primary_key=True)
+    dish_type = db.Column(db.Text, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, pairs, delta):
+        '''Add delta to the count of every (cuisine_type, dish_type) in pairs, once per occurrence.'''
+
+        totals = {}
+        for pair in pairs:
+            totals[pair] = totals.get(pair, 0) + delta
+        if not totals:
+            return
+
+        stmt = dialect_insert(cls.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['cuisine_type', 'dish_type'],
+            set_={'count': cls.__table__.c.count + stmt.excluded.count}
+        )
+        db.session.execute(stmt, [
+            {'cuisine_type': cuisine_type, 'dish_type': dish_type, 'count': count}
+            for (cuisine_type, dish_type), count in totals.items()
+        ])
+
+    @classmethod
+    def add(cls, recipes):
+        cls.bump([(recipe.cuisine_type, recipe.dish_type) for recipe in recipes], 1)
+
+    @classmethod
+    def remove(cls, recipes):
+        cls.bump([(recipe.cuisine_type, recipe.dish_type) for recipe in recipes], -1)
+
+    @classmethod
+    def counts(cls, facet, cuisine_type=None, dish_type=None):
+        '''[(value, count)] for 'cuisine_type' or 'dish_type', narrowed by the other facet if given.'''
+
+        column = getattr(cls, facet)
+        query = db.session.query(column, db.func.sum(cls.count)).filter(cls.count > 0)
+        if facet == 'cuisine_type' and dish_type:
+            query = query.filter(cls.dish_type == dish_type)
+        if facet == 'dish_type' and cuisine_type:
+            query = query.filter(cls.cuisine_type == cuisine_type)
+        return query.group_by(column).order_by(column).all()
 
 
 class Likes(db.Model):
     '''Mapping user likes.'''
 
     __tablename__ = 'likes'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'recipe_id', name='likes_user_id_recipe_id_key'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='cascade'))
-    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete='cascade'))
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete='cascade'), index=True)
+
+
+class ListingVersion(db.Model):
+    '''Change counter per listing, for conditional GETs.
+
+    Scopes are 'catalog' for anything shown on recipe cards, 'recipes:<user id>'
+    for a user's own recipes and 'likes:<user id>' for a user's likes. Writes
+    call touch() (ORM changes to recipes and likes are picked up on flush) and
+    every touched scope is bumped in the same transaction when it commits.
+    '''
+
+    __tablename__ = 'listing_versions'
+
+    scope = db.Column(db.Text, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def touch(*scopes):
+        db.session.info.setdefault('touched_listings', set()).update(scopes)
+
+    @classmethod
+    def bump(cls, scopes):
+        '''Add one to the version of every scope and stamp it with the current time.'''
+
+        if not scopes:
+            return
+
+        now = datetime.utcnow()
+        stmt = dialect_insert(cls.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['scope'],
+            set_={'version': cls.__table__.c.version + 1, 'updated_at': stmt.excluded.updated_at}
+        )
+        db.session.execute(stmt, [{'scope': scope, 'version': 1, 'updated_at': now} for scope in sorted(scopes)])
+
+    @classmethod
+    def stamps(cls, scopes):
+        '''{scope: (version, updated_at)} for scopes that were ever bumped.'''
+
+        rows = db.session.query(cls.scope, cls.version, cls.updated_at).filter(cls.scope.in_(list(scopes)))
+        return {scope: (version, updated_at) for scope, version, updated_at in rows}
+
+
+
+class IngestJob(db.Model):
+    '''An Edamam search waiting to be fetched and stored by a background worker (see ingest_jobs.py).
+
+    Status goes queued -> running -> done or failed. A running job whose
+    worker died is claimed again once its lease has run out.
+    '''
+
+    __tablename__ = 'ingest_jobs'
+    __table_args__ = (
+        db.Index('ix_ingest_jobs_status_id', 'status', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.Text, nullable=False)
+    status = db.Column(db.Text, nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Ids of the ingested recipes in Edamam's order, comma separated.
+    recipe_ids = db.Column(db.Text)
+    # Search snapshot of the results once done, made on the first poll (see app.search_job_status).
+    snapshot_id = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @property
+    def result_ids(self):
+        return [int(recipe_id) for recipe_id in self.recipe_ids.split(',') if recipe_id] if self.recipe_ids else []
+
+
+class SearchSnapshot(db.Model):
+    '''A search's ordered result ids, kept for paging (see cache.SearchSnapshots).
+
+    In the database so a snapshot taken by one worker or dyno can be paged
+    through on any other.
+    '''
+
+    __tablename__ = 'search_snapshots'
+
+    key = db.Column(db.Text, primary_key=True)
+    # JSON, as written by cache.DatabaseBackend.
+    value = db.Column(db.Text, nullable=False)
+    expires = db.Column(db.Float, nullable=False, index=True)
+
+
+class SearchQuery(db.Model):
+    '''How often each normalized search term was searched for, behind the typeahead suggestions.'''
+
+    __tablename__ = 'search_queries'
+
+    term = db.Column(db.Text, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    last_searched_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    @classmethod
+    def record(cls, term):
+        '''Count one search for term in one upsert. Returns its new count.'''
+
+        stmt = dialect_insert(cls.__table__).values(term=term, count=1, last_searched_at=datetime.utcnow())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['term'],
+            set_={'count': cls.__table__.c.count + 1, 'last_searched_at': stmt.excluded.last_searched_at}
+        )
+        db.session.execute(stmt)
+        return db.session.query(cls.count).filter(cls.term == term).scalar()
+
+@event.listens_for(db.session, 'after_flush')
+def touch_flushed_listings(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Recipe) and (obj in session.new or obj in session.deleted or session.is_modified(obj)):
+            ListingVersion.touch('catalog', f'recipes:{obj.user_id}')
+        elif isinstance(obj, Likes):
+            ListingVersion.touch(f'likes:{obj.user_id}')
+
+
+@event.listens_for(db.session, 'before_flush')
+def sync_recipe_ingredients(session, flush_context, instances):
+    '''Keep the ingredient rows of recipes added or edited through the ORM in step with their text.'''
+
+    with session.no_autoflush:
+        for obj in list(session.new) + list(session.dirty):
+            if isinstance(obj, Recipe) and (obj in session.new or inspect(obj).attrs.recipe.history.has_changes()):
+                obj.sync_ingredients()
+
+
+@event.listens_for(db.session, 'before_commit')
+def bump_touched_listings(session):
+    # Flush first so the ORM changes in this commit have touched their scopes.
+    session.flush()
+    ListingVersion.bump(session.info.pop('touched_listings', set()))
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def forget_touched_listings(session, previous_transaction):
+    session.info.pop('touched_listings', None)
+
+
+POSTGRES_ARRAY_ITEM = re.compile(r'"((?:[^"\\]|\\.)*)"|([^,{}]+)')
+
+
+def split_ingredient_lines(text):
+    '''Split stored recipe text into ingredient lines.
+
+    Handles the newline-separated text used now as well as the two formats
+    older rows were written in: a stringified Python list and a Postgres
+    array literal.
+    '''
+
+    text = (text or '').strip()
+
+    if text.startswith('[') and text.endswith(']'):
+        try:
+            return [str(line).strip() for line in ast.literal_eval(text) if str(line).strip()]
+        except (ValueError, SyntaxError):
+            pass
+
+    if text.startswith('{') and text.endswith('}'):
+        return [
+            re.sub(r'\\(.)', r'\1', quoted) if quoted else bare.strip()
+            for quoted, bare in POSTGRES_ARRAY_ITEM.findall(text[1:-1])
+            if (quoted or bare).strip()
+        ]
+
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def dialect_insert(table):
+    '''INSERT construct with ON CONFLICT support for the database in use.'''
+
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    return insert(table)
+
+
+@event.listens_for(Pool, 'connect')
+def remember_connection_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(Pool, 'checkout')
+def refuse_inherited_connection(dbapi_connection, connection_record, connection_proxy):
+    '''Make a forked worker open its own connections instead of reusing the parent's sockets.
+
+    The inherited connection is dropped without being closed, since closing it
+    would also end the parent's session.
+    '''
+
+    if connection_record.info.get('pid') != os.getpid():
+        connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+        raise exc.DisconnectionError(f'Connection belongs to pid {connection_record.info.get("pid")}, reconnecting in {os.getpid()}')
 
 
 def connect_db(app):
     db.app = app
     db.init_app(app)
+    bcrypt.init_app(app)
+    hash_executor.init_app(app)
@@ -0,0 +1,324 @@
+'''"Cook with what I have": find recipes by the ingredients on hand.
+
+Ingredient lines are reduced to canonical names ("2 cups finely chopped
+tomatoes" -> "tomato"). IngredientIndex maps every name to the set of recipe
+ids using it, as a bitmap: an array of ids while the name is rare, a
+Python int with one bit per recipe id once it is common enough that the int
+is the smaller of the two.
+
+A query ORs the bitmaps of the names the user has into a bit-sliced counter
+(one int per binary digit of the count), which says for every recipe at once
+how many of its ingredients are covered. Comparing that with the recipes
+grouped by ingredient count gives "missing at most N" without touching a
+row per recipe.
+'''
+
+import re
+import threading
+from array import array
+from collections import defaultdict
+from functools import lru_cache
+
+from indexes import SyncedIndex
+from models import db, Ingredient, Recipe
+
+UNITS = {
+    'bag', 'bottle', 'box', 'bunch', 'can', 'clove', 'container', 'cup', 'dash', 'drop', 'envelope', 'fillet',
+    'g', 'gallon', 'gram', 'handful', 'head', 'inch', 'jar', 'kg', 'kilogram', 'l', 'lb', 'liter', 'litre',
+    'ml', 'ounce', 'oz', 'package', 'packet', 'piece', 'pinch', 'pint', 'pkg', 'pound', 'quart', 'sheet',
+    'slice', 'sprig', 'stalk', 'stick', 'tablespoon', 'tbs', 'tbsp', 'teaspoon', 'tsp',
+}
+
+# Preparation and size words that don't change what the ingredient is.
+DESCRIPTORS = {
+    'about', 'boneless', 'beaten', 'chilled', 'chopped', 'coarsely', 'cold', 'cooked', 'crushed', 'cubed',
+    'diced', 'divided', 'dried', 'drained', 'extra', 'finely', 'for', 'freshly', 'fresh', 'frozen', 'grated',
+    'ground', 'halved', 'hot', 'into', 'large', 'lightly', 'medium', 'melted', 'minced', 'more', 'optional',
+    'packed', 'peeled', 'plus', 'quartered', 'raw', 'rinsed', 'roughly', 'serving', 'shredded', 'skinless',
+    'sliced', 'small', 'softened', 'taste', 'thinly', 'to', 'trimmed', 'virgin', 'warm', 'whole',
+    'a', 'an', 'and', 'in', 'of', 'the', 'with',
+}
+
+# Assumed to be in every kitchen, so they never count as missing.
+STAPLES = {'salt', 'pepper', 'black pepper', 'water', 'ice'}
+
+
+def singular(word):
+    if len(word) <= 3 or word.endswith(('ss', 'us', 'is')):
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith('oes'):
+        return word[:-2]
+    if word.endswith('s'):
+        return word[:-1]
+    return word
+
+
+# Lines like "1 cup rice" repeat across thousands of recipes.
+@lru_cache(maxsize=65536)
+def canonical_ingredient(line):
+    '''Canonical name of the ingredient in an ingredient line, or None for staples and empty lines.
+
+    Quantities, units, preparation words, anything in brackets or after a
+    comma, and all but the first of "x or y" are dropped; the rest is
+    lowercased and made singular.
+    '''
+
+    text = re.sub(r'\([^)]*\)', ' ', (line or '').lower())
+    text = text.split(',')[0].split(' or ')[0]
+
+    words = [singular(word) for word in re.findall(r'[a-z]+', text.replace('-', ' '))]
+    words = [word for word in words if len(word) > 1 and word not in UNITS and word not in DESCRIPTORS]
+
+    name = ' '.join(words)
+    if not name or name in STAPLES:
+        return None
+    return name
+
+
+def bits_of(postings):
+    '''A bitmap as a Python int, whichever form it is stored in.'''
+
+    if isinstance(postings, int):
+        return postings
+    bits = 0
+    for recipe_id in postings:
+        bits |= 1 << recipe_id
+    return bits
+
+
+def ids_of(bits, limit):
+    '''The first `limit` recipe ids set in bits, lowest first.'''
+
+    ids = []
+    while bits and len(ids) < limit:
+        low = bits & -bits
+        ids.append(low.bit_length() - 1)
+        bits ^= low
+    return ids
+
+
+class IngredientIndex:
+    '''In-process ingredient name -> recipe id bitmap index.'''
+
+    def __init__(self):
+        self.names = {}
+        self.postings = {}
+        self.words = defaultdict(set)
+        self.recipe_names = {}
+        self.by_count = defaultdict(int)
+        self.max_id = 0
+        self._lock = threading.Lock()
+
+    def build(self, rows):
+        '''Index (recipe id, ingredient line) rows from scratch, grouped by recipe id.'''
+
+        with self._lock:
+            self.names.clear()
+            self.postings.clear()
+            self.words.clear()
+            self.recipe_names.clear()
+            self.by_count.clear()
+            self.max_id = 0
+
+            lines = defaultdict(list)
+            for recipe_id, line in rows:
+                lines[recipe_id].append(line)
+            for recipe_id, recipe_lines in lines.items():
+                self._add(recipe_id, recipe_lines)
+
+    def add(self, recipe_id, lines):
+        '''Index a recipe's ingredient lines, replacing what was indexed for it before.'''
+
+        with self._lock:
+            self._remove(recipe_id)
+            self._add(recipe_id, lines)
+
+    def remove(self, recipe_id):
+        with self._lock:
+            self._remove(recipe_id)
+
+    def _name_id(self, name):
+        name_id = self.names.get(name)
+        if name_id is None:
+            name_id = self.names[name] = len(self.names)
+            self.postings[name_id] = array('I')
+            for word in name.split():
+                self.words[word].add(name_id)
+        return name_id
+
+    def _add(self, recipe_id, lines):
+        name_ids = sorted({self._name_id(name) for name in map(canonical_ingredient, lines) if name})
+        if not name_ids:
+            return
+
+        self.max_id = max(self.max_id, recipe_id)
+        self.recipe_names[recipe_id] = array('I', name_ids)
+        self.by_count[len(name_ids)] |= 1 << recipe_id
+
+        for name_id in name_ids:
+            postings = self.postings[name_id]
+            if isinstance(postings, int):
+                self.postings[name_id] = postings | (1 << recipe_id)
+                continue
+            postings.append(recipe_id)
+            # An id takes 32 bits in the array and one bit in the int.
+            if len(postings) * 32 > self.max_id:
+                self.postings[name_id] = bits_of(postings)
+
+    def _remove(self, recipe_id):
+        name_ids = self.recipe_names.pop(recipe_id, None)
+        if name_ids is None:
+            return
+
+        bit = 1 << recipe_id
+        self.by_count[len(name_ids)] &= ~bit
+        for name_id in name_ids:
+            postings = self.postings[name_id]
+            if isinstance(postings, int):
+                self.postings[name_id] = postings & ~bit
+            else:
+                postings.remove(recipe_id)
+
+    def matching_names(self, item):
+        '''Ids of the indexed names containing every word of item: "chicken" covers "chicken breast".'''
+
+        name = canonical_ingredient(item)
+        if not name:
+            return set()
+        word_sets = [self.words.get(word, set()) for word in name.split()]
+        return set.intersection(*word_sets)
+
+    def search(self, have, max_missing=0, limit=24):
+        '''[(recipe id, missing count)] of recipes needing at most max_missing ingredients beyond `have`.
+
+        Fewest missing first, then recipes that use more of what you have.
+        '''
+
+        with self._lock:
+            matched = set()
+            for item in have:
+                matched |= self.matching_names(item)
+            if not matched:
+                return []
+
+            # Bit-sliced count of matched ingredients per recipe: planes[i] holds bit i of each count.
+            planes = []
+            candidates = 0
+            for name_id in matched:
+                carry = bits_of(self.postings[name_id])
+                candidates |= carry
+                for n, plane in enumerate(planes):
+                    if not carry:
+                        break
+                    planes[n], carry = plane ^ carry, plane & carry
+                if carry:
+                    planes.append(carry)
+
+            def covered(count):
+                bits = candidates
+                for n, plane in enumerate(planes):
+                    bits &= plane if count >> n & 1 else candidates ^ plane
+                return bits if count < 1 << len(planes) else 0
+
+            results = []
+            for missing in range(max_missing + 1):
+                for count in sorted(self.by_count, reverse=True):
+                    if count - missing < 1 or len(results) >= limit:
+                        continue
+                    bits = self.by_count[count] & covered(count - missing)
+                    results.extend((recipe_id, missing) for recipe_id in ids_of(bits, limit - len(results)))
+            return results
+
+    def __len__(self):
+        return len(self.recipe_names)
+
+
+class PantrySearch(SyncedIndex):
+    '''Keeps an IngredientIndex in step with the ingredients table.
+
+    Recipes added or deleted through this worker are applied as it happens;
+    ingredient rows written by other processes are read every `refresh`
+    seconds by primary key from the last one seen, and the index is rebuilt
+    every `rebuild` seconds. Both run in the background; see indexes.py.
+    '''
+
+    config_prefix = 'PANTRY'
+
+    def __init__(self, refresh=30, rebuild=3600):
+        super().__init__(refresh, rebuild)
+        self.index = IngredientIndex()
+        self.last_ingredient_id = 0
+
+    def reset(self):
+        super().reset()
+        self.index = IngredientIndex()
+        self.last_ingredient_id = 0
+
+    def after_fork(self):
+        super().after_fork()
+        self.index._lock = threading.Lock()
+
+    def _rows(self, after=0):
+        return (db.session.query(Ingredient.id, Ingredient.recipe_id, Ingredient.line)
+            .filter(Ingredient.id > after)
+            .order_by(Ingredient.id)
+            .yield_per(10000))
+
+    def build(self):
+        last_id = 0
+        index = IngredientIndex()
+
+        def rows():
+            nonlocal last_id
+            for ingredient_id, recipe_id, line in self._rows():
+                last_id = ingredient_id
+                yield recipe_id, line
+
+        index.build(rows())
+
+        def install():
+            self.index = index
+            self.last_ingredient_id = last_id
+        return install
+
+    def refresh(self):
+        lines = defaultdict(list)
+        for ingredient_id, recipe_id, line in self._rows(self.last_ingredient_id):
+            lines[recipe_id].append(line)
+            self.last_ingredient_id = ingredient_id
+        for recipe_id, recipe_lines in lines.items():
+            self.index.add(recipe_id, recipe_lines)
+
+    def add(self, recipes):
+        for recipe in recipes:
+            # Read now: a rebuild may apply this again later, after the session is gone.
+            recipe_id, lines = recipe.id, recipe.ingredient_lines
+            self.change(lambda recipe_id=recipe_id, lines=lines: self.index.add(recipe_id, lines))
+
+    def remove(self, recipe_id):
+        self.change(lambda: self.index.remove(recipe_id))
+
+    def search(self, have, max_missing=0, limit=24):
+        '''[(recipe, missing count)] for the ingredients in `have`, in one primary key lookup.
+
+        Answers from the index as it is; before the first build is in, that finds nothing.
+        '''
+
+        self.sync()
+        matches = self.index.search(have, max_missing, limit)
+        if not matches:
+            return []
+
+        recipes = {recipe.id: recipe for recipe in Recipe.query.filter(Recipe.id.in_([recipe_id for recipe_id, _ in matches]))}
+        return [(recipes[recipe_id], missing) for recipe_id, missing in matches if recipe_id in recipes]
+
+    def stats(self):
+        return {
+            'recipes': len(self.index),
+            'ingredients': len(self.index.names),
+        }
+
+
+pantry_search = PantrySearch()
@@ -0,0 +1,115 @@
+'''Request coalescing and a rate limit shared by every worker on the box.
+
+SingleFlight lets concurrent callers asking for the same key share one call:
+the first runs it, the others wait for its result (or its error).
+
+TokenBucket keeps its state in a small sqlite file. Every take is a short
+write transaction, so gunicorn workers draw from one budget without a
+separate lock server.
+'''
+
+import sqlite3
+import threading
+import time
+
+
+class SingleFlight:
+    '''Run at most one call per key at a time; callers arriving meanwhile get its outcome.'''
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        '''(result of fn(*args), True if it was shared with a call already in flight).'''
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
+
+        try:
+            call['result'] = fn(*args)
+            return call['result'], False
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+    def after_fork(self):
+        '''A forked child has none of the parent's calls in flight.'''
+
+        self._calls = {}
+        self._lock = threading.Lock()
+
+
+class TokenBucket:
+    '''`rate` tokens per second up to `burst`, stored in a sqlite file shared between processes.'''
+
+    def __init__(self, path, rate, burst, name='default'):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self._local = threading.local()
+
+        with self._conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL)''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode, so BEGIN IMMEDIATE below controls the transaction.
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        self._local = threading.local()
+
+    def try_take(self, tokens=1):
+        '''Take tokens if the bucket has them. Returns True on success.'''
+
+        conn = self._conn()
+        # Takes the write lock up front, so no other worker reads the same count in between.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE name = ?', (self.name,)).fetchone()
+            available = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+
+            taken = available >= tokens
+            if taken:
+                available -= tokens
+            conn.execute('INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)', (self.name, available, now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return taken
+
+    def take(self, tokens=1, wait=0.0):
+        '''Like try_take(), but keep trying for up to `wait` seconds.'''
+
+        deadline = time.monotonic() + wait
+        while True:
+            if self.try_take(tokens):
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, tokens / self.rate if self.rate > 0 else remaining))
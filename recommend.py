@@ -0,0 +1,270 @@
+'''"People who liked this also liked" recommendations.
+
+The likes table is a sparse user x recipe matrix. CoLikeIndex keeps, per
+recipe, how many users liked it together with each other recipe, and from
+that the K most similar recipes by cosine similarity:
+
+    sim(a, b) = co_likes(a, b) / sqrt(likes(a) * likes(b))
+
+The top-K lists are stored as pairs of arrays (neighbour ids, scores), so
+serving a user is a walk over K entries per recipe they like. Likes are added
+and removed one at a time; the rows they touch are marked and recomputed by
+rerank() on the sync thread, never while serving a request.
+'''
+
+import heapq
+import math
+import threading
+from array import array
+from collections import defaultdict
+
+from cache import MemoryBackend
+from indexes import SyncedIndex
+from models import db, Likes, Recipe
+
+# A user who liked thousands of recipes adds millions of pairs and says little
+# about any of them, so only the first likes of each user are paired up.
+MAX_USER_LIKES = 500
+
+
+class CoLikeIndex:
+    '''In-process co-like counts and the top-K similar recipes per recipe.'''
+
+    def __init__(self, top_k=20):
+        self.top_k = top_k
+        self.user_likes = defaultdict(set)
+        self.like_counts = defaultdict(int)
+        self.co_likes = defaultdict(lambda: defaultdict(int))
+        self.neighbours = {}
+        self.dirty = set()
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def build(self, pairs):
+        '''Index (user id, recipe id) pairs from scratch.'''
+
+        with self._lock:
+            self.user_likes.clear()
+            self.like_counts.clear()
+            self.co_likes.clear()
+            self.neighbours.clear()
+            self.dirty.clear()
+            for user_id, recipe_id in pairs:
+                self._add(user_id, recipe_id, mark=False)
+            for recipe_id in self.co_likes:
+                self._rank(recipe_id)
+            self.generation += 1
+
+    def add(self, user_id, recipe_id):
+        '''Record a like. Adding a like that is already known does nothing.'''
+
+        with self._lock:
+            if self._add(user_id, recipe_id):
+                self.generation += 1
+
+    def remove(self, user_id, recipe_id):
+        with self._lock:
+            liked = self.user_likes.get(user_id)
+            if not liked or recipe_id not in liked:
+                return
+            # Mark first: the rows to recompute are the neighbours before the removal.
+            self._mark(recipe_id)
+            liked.discard(recipe_id)
+            self.like_counts[recipe_id] -= 1
+            if not self.like_counts[recipe_id]:
+                del self.like_counts[recipe_id]
+            if len(liked) < MAX_USER_LIKES:
+                for other in liked:
+                    self._bump(recipe_id, other, -1)
+            self.generation += 1
+
+    def _add(self, user_id, recipe_id, mark=True):
+        liked = self.user_likes[user_id]
+        if recipe_id in liked:
+            return False
+        if len(liked) < MAX_USER_LIKES:
+            for other in liked:
+                self._bump(recipe_id, other, 1)
+        liked.add(recipe_id)
+        self.like_counts[recipe_id] += 1
+        if mark:
+            self._mark(recipe_id)
+        return True
+
+    def _bump(self, a, b, delta):
+        for x, y in ((a, b), (b, a)):
+            row = self.co_likes[x]
+            row[y] += delta
+            if row[y] <= 0:
+                del row[y]
+                if not row:
+                    del self.co_likes[x]
+
+    def _mark(self, recipe_id):
+        # The recipe's like count is in every similarity of its row, and in
+        # the matching entry of each neighbour's row.
+        self.dirty.add(recipe_id)
+        self.dirty.update(self.co_likes.get(recipe_id, ()))
+
+    def _rank(self, recipe_id):
+        row = self.co_likes.get(recipe_id)
+        if not row:
+            self.neighbours.pop(recipe_id, None)
+            return
+
+        count = self.like_counts[recipe_id]
+        best = heapq.nlargest(self.top_k, (
+            (co / math.sqrt(count * self.like_counts[other]), -other)
+            for other, co in row.items()
+        ))
+        self.neighbours[recipe_id] = (array('l', (-other for _, other in best)), array('f', (score for score, _ in best)))
+
+    def rerank(self, batch=1000):
+        '''Recompute the top-K lists of the recipes whose likes changed. Returns how many.
+
+        Takes the lock a batch at a time, so a lookup waits for one batch at most.
+        '''
+
+        ranked = 0
+        while True:
+            with self._lock:
+                if not self.dirty:
+                    break
+                for _ in range(min(batch, len(self.dirty))):
+                    self._rank(self.dirty.pop())
+                    ranked += 1
+                self.generation += 1
+        return ranked
+
+    def similar(self, recipe_id):
+        '''[(recipe id, similarity)] of the recipes most often liked together with recipe_id, as last ranked.'''
+
+        with self._lock:
+            ids, scores = self.neighbours.get(recipe_id, ((), ()))
+            return list(zip(ids, scores))
+
+    def recommend(self, liked_ids, limit=10, exclude=()):
+        '''Ids of recipes similar to the liked ones, best first, leaving out the liked ones and those in exclude.'''
+
+        scores = defaultdict(float)
+        with self._lock:
+            for recipe_id in liked_ids:
+                ids, sims = self.neighbours.get(recipe_id, ((), ()))
+                for other, score in zip(ids, sims):
+                    if other not in liked_ids and other not in exclude:
+                        scores[other] += score
+
+        return heapq.nsmallest(limit, scores, key=lambda recipe_id: (-scores[recipe_id], recipe_id))
+
+    def __len__(self):
+        return len(self.neighbours)
+
+
+class Recommender(SyncedIndex):
+    '''Keeps a CoLikeIndex in step with the likes table and serves per-user recommendations.
+
+    Likes made through this worker are applied as they happen. Likes made
+    through other workers are read every `refresh` seconds by primary key
+    from the last one seen; unlikes elsewhere leave no row behind, so the
+    index is rebuilt from scratch every `rebuild` seconds. Both run in the
+    background; see indexes.py. A like marks the top-K lists it touches and
+    the next sync re-ranks them, also in the background.
+    '''
+
+    config_prefix = 'RECOMMEND'
+
+    def __init__(self, top_k=20, refresh=30, rebuild=3600):
+        super().__init__(refresh, rebuild)
+        self.index = CoLikeIndex(top_k)
+        self.last_like_id = 0
+        self.cache = MemoryBackend(1024)
+
+    def init_app(self, app):
+        self.index = CoLikeIndex(app.config.get('RECOMMEND_TOP_K', self.index.top_k))
+        super().init_app(app)
+
+    def reset(self):
+        super().reset()
+        self.index = CoLikeIndex(self.index.top_k)
+        self.last_like_id = 0
+        self.cache.clear()
+
+    def after_fork(self):
+        super().after_fork()
+        self.index._lock = threading.Lock()
+
+    def build(self):
+        rows = db.session.query(Likes.id, Likes.user_id, Likes.recipe_id).order_by(Likes.id).all()
+        index = CoLikeIndex(self.index.top_k)
+        index.build((user_id, recipe_id) for _, user_id, recipe_id in rows)
+        last_like_id = rows[-1].id if rows else 0
+
+        def install():
+            # Generations keep counting up across builds, so memoized answers for the old index are never reused.
+            index.generation += self.index.generation
+            self.index = index
+            self.last_like_id = last_like_id
+        return install
+
+    def refresh(self):
+        rows = (db.session.query(Likes.id, Likes.user_id, Likes.recipe_id)
+            .filter(Likes.id > self.last_like_id)
+            .order_by(Likes.id)
+            .all())
+        for _, user_id, recipe_id in rows:
+            self.index.add(user_id, recipe_id)
+        if rows:
+            self.last_like_id = rows[-1].id
+        self.index.rerank()
+
+    def behind(self):
+        return bool(self.index.dirty)
+
+    def record(self, user_id, recipe_id, liked):
+        '''Apply a like or unlike made through this worker.'''
+
+        if liked:
+            self.change(lambda: self.index.add(user_id, recipe_id))
+        else:
+            self.change(lambda: self.index.remove(user_id, recipe_id))
+
+    def recommend_ids(self, user_id, liked_ids, limit=10):
+        '''Recommended recipe ids for a user from the index as it is, memoized until it or their likes change.'''
+
+        index = self.index
+        key = (user_id, index.generation, liked_ids, limit)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry[0]
+
+        # The user's own recipes are left out before the cut, so they never take a slot.
+        own = {recipe_id for (recipe_id,) in db.session.query(Recipe.id).filter(Recipe.user_id == user_id)}
+        ids = index.recommend(liked_ids, limit, exclude=own)
+        self.cache.set(key, ids, float('inf'))
+        return ids
+
+    def recipes(self, ids):
+        '''The recipes for recommended ids in one primary key lookup, leaving out deleted ones.'''
+
+        if not ids:
+            return []
+
+        recipes = {recipe.id: recipe for recipe in Recipe.query.filter(Recipe.id.in_(ids))}
+        return [recipes[recipe_id] for recipe_id in ids if recipe_id in recipes]
+
+    def recommend(self, user_id, liked_ids, limit=10):
+        '''Recommended recipes for a user.'''
+
+        self.sync()
+        return self.recipes(self.recommend_ids(user_id, frozenset(liked_ids), limit))
+
+    def stats(self):
+        return {
+            'recipes': len(self.index),
+            'users': len(self.index.user_likes),
+            'generation': self.index.generation,
+            'builds': self.builds,
+        }
+
+
+recommender = Recommender()
@@ -0,0 +1,155 @@
+import math
+import re
+import threading
+from collections import defaultdict
+
+from sqlalchemy import DDL, event, func, literal_column
+
+from models import db, Recipe
+
+STOP_WORDS = {'a', 'an', 'and', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'with'}
+
+# Must stay identical to the indexed expression below or Postgres won't use the index.
+SEARCH_DOCUMENT = func.to_tsvector(
+    literal_column("'english'"),
+    Recipe.title + literal_column("' '") + Recipe.recipe + literal_column("' '")
+    + Recipe.cuisine_type + literal_column("' '") + Recipe.dish_type
+)
+
+SEARCH_INDEX_DDL = '''CREATE INDEX IF NOT EXISTS ix_recipes_search ON recipes USING gin (
+    to_tsvector('english', title || ' ' || recipe || ' ' || cuisine_type || ' ' || dish_type))'''
+
+event.listen(Recipe.__table__, 'after_create', DDL(SEARCH_INDEX_DDL).execute_if(dialect='postgresql'))
+
+
+def tokenize(text):
+    '''Split text into lowercase terms, dropping stop words and plural endings.'''
+
+    terms = []
+    for word in re.findall(r'[a-z0-9]+', (text or '').lower()):
+        if word in STOP_WORDS or len(word) < 2:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+class InvertedIndex:
+    '''In-process term -> {recipe id: term frequency} index for databases without full-text search.'''
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.doc_terms = {}
+        self.built = False
+        self._lock = threading.Lock()
+
+    def build(self, rows):
+        '''Index (id, title, recipe, cuisine_type, dish_type) rows from scratch.'''
+
+        with self._lock:
+            self.postings.clear()
+            self.doc_terms.clear()
+            for row in rows:
+                self._add(row[0], ' '.join(row[1:]))
+            self.built = True
+
+    def add(self, recipe_id, text):
+        with self._lock:
+            self._remove(recipe_id)
+            self._add(recipe_id, text)
+
+    def remove(self, recipe_id):
+        with self._lock:
+            self._remove(recipe_id)
+
+    def _add(self, recipe_id, text):
+        counts = defaultdict(int)
+        for term in tokenize(text):
+            counts[term] += 1
+        for term, count in counts.items():
+            self.postings[term][recipe_id] = count
+        self.doc_terms[recipe_id] = list(counts)
+
+    def _remove(self, recipe_id):
+        for term in self.doc_terms.pop(recipe_id, []):
+            self.postings[term].pop(recipe_id, None)
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def search(self, query, limit=20):
+        '''Ids of recipes containing every query term, best tf-idf score first.'''
+
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            postings = [self.postings.get(term, {}) for term in terms]
+            if not all(postings):
+                return []
+
+            total = len(self.doc_terms)
+            matches = set.intersection(*(set(p) for p in postings))
+            scores = {
+                recipe_id: sum(p[recipe_id] * math.log(1 + total / len(p)) for p in postings)
+                for recipe_id in matches
+            }
+
+        return sorted(scores, key=lambda recipe_id: (-scores[recipe_id], recipe_id))[:limit]
+
+
+class RecipeSearchIndex:
+    '''Ranked full-text search over stored recipes.
+
+    Postgres answers from a GIN index on a tsvector of title, ingredients,
+    cuisine and dish type. Other databases (SQLite in tests and local setups)
+    fall back to an in-process inverted index built on first use.
+    '''
+
+    def __init__(self):
+        self.fallback = InvertedIndex()
+
+    def reset(self):
+        '''Forget the fallback index; it is built again on the next search.'''
+
+        self.fallback = InvertedIndex()
+
+    def uses_postgres(self):
+        return db.engine.dialect.name == 'postgresql'
+
+    def search(self, query, limit=20):
+        '''Return stored recipes matching query, best match first.'''
+
+        if not tokenize(query):
+            return []
+
+        if self.uses_postgres():
+            ts_query = func.plainto_tsquery(literal_column("'english'"), query)
+            return (Recipe.query
+                .filter(SEARCH_DOCUMENT.op('@@')(ts_query))
+                .order_by(func.ts_rank(SEARCH_DOCUMENT, ts_query).desc(), Recipe.id)
+                .limit(limit)
+                .all())
+
+        if not self.fallback.built:
+            self.fallback.build(db.session.query(Recipe.id, Recipe.title, Recipe.recipe, Recipe.cuisine_type, Recipe.dish_type))
+
+        ids = self.fallback.search(query, limit)
+        recipes = {recipe.id: recipe for recipe in Recipe.query.filter(Recipe.id.in_(ids))}
+        return [recipes[recipe_id] for recipe_id in ids if recipe_id in recipes]
+
+    def add(self, recipes):
+        '''Index new or edited recipes. Postgres keeps its index current by itself.'''
+
+        if self.uses_postgres() or not self.fallback.built:
+            return
+        for recipe in recipes:
+            self.fallback.add(recipe.id, ' '.join([recipe.title, recipe.recipe, recipe.cuisine_type, recipe.dish_type]))
+
+    def remove(self, recipe_id):
+        if not self.uses_postgres():
+            self.fallback.remove(recipe_id)
+
+
+search_index = RecipeSearchIndex()
@@ -0,0 +1,20 @@
+// Toggle likes in place instead of posting the form and reloading the page.
+document.addEventListener('click', async function (event) {
+    const button = event.target.closest('button[data-like-id]');
+    if (!button) {
+        return;
+    }
+    event.preventDefault();
+
+    const response = await fetch(`/api/likes/${button.dataset.likeId}/toggle`, {method: 'POST'});
+    if (!response.ok) {
+        // Let the regular form submission show the error.
+        button.form.requestSubmit(button);
+        return;
+    }
+
+    const data = await response.json();
+    const heart = button.querySelector('.fa-heart');
+    heart.classList.toggle('fa-solid', data.liked);
+    heart.classList.toggle('fa-regular', !data.liked);
+});
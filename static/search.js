@@ -0,0 +1,35 @@
+// Poll the background Edamam fetch behind a search and show its results once they are stored.
+(function () {
+    const status = document.getElementById('search-status');
+    if (!status) {
+        return;
+    }
+
+    let delay = 500;
+
+    async function poll() {
+        let data;
+        try {
+            const response = await fetch(status.dataset.statusUrl);
+            if (!response.ok) {
+                status.remove();
+                return;
+            }
+            data = await response.json();
+        } catch (error) {
+            data = {status: 'queued'};
+        }
+
+        if (data.status === 'done') {
+            window.location.replace(data.url);
+        } else if (data.status === 'failed') {
+            status.textContent = data.message;
+            status.classList.replace('text-secondary', 'text-warning');
+        } else {
+            delay = Math.min(delay * 1.5, 5000);
+            setTimeout(poll, delay);
+        }
+    }
+
+    setTimeout(poll, delay);
+})();
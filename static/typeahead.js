@@ -0,0 +1,47 @@
+// Suggest popular searches and recipe titles in the search box as the user types.
+(function () {
+    const input = document.querySelector('input[data-typeahead-url]');
+    if (!input) {
+        return;
+    }
+    const list = document.getElementById(input.getAttribute('list'));
+
+    let timer = null;
+    let controller = null;
+
+    async function suggest() {
+        const prefix = input.value.trim();
+        if (prefix.length < 2) {
+            list.replaceChildren();
+            return;
+        }
+
+        // Only the answer for what is typed now matters.
+        if (controller) {
+            controller.abort();
+        }
+        controller = new AbortController();
+
+        let data;
+        try {
+            const response = await fetch(`${input.dataset.typeaheadUrl}?q=${encodeURIComponent(prefix)}`, {signal: controller.signal});
+            if (!response.ok) {
+                return;
+            }
+            data = await response.json();
+        } catch (error) {
+            return;
+        }
+
+        list.replaceChildren(...data.suggestions.map(function (suggestion) {
+            const option = document.createElement('option');
+            option.value = suggestion.text;
+            return option;
+        }));
+    }
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        timer = setTimeout(suggest, 100);
+    });
+})();
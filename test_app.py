@@ -1,16 +1,30 @@
 import os
+from datetime import datetime, timedelta
 from unittest import TestCase
 from sqlalchemy import exc
 
-from models import db, User, Recipe, Likes
+from models import db, User, Recipe, Likes, Ingredient, FacetCount, IngestJob, SearchQuery, SearchSnapshot
 
 os.environ['DATABASE_URL'] = 'postgresql:///capstone_one_test'
 
-from app import app, CURR_USER_KEY
+from app import create_app, CURR_USER_KEY
+from search_index import search_index
+from edamam import edamam_client
+from cache import search_cache, search_snapshots, DatabaseBackend, SearchSnapshots
+from ingest_jobs import ingest_queue
+from identity import load_identity, identity_cache
+from cards import recipe_cards
+from recommend import recommender
+from pantry import pantry_search
+from typeahead import typeahead
+from likes import liked_ids_cache
+import migrations
 
-db.create_all()
+# Tests run queued Edamam searches themselves with ingest_queue.run_pending(), and build the in-memory indexes inline.
+app = create_app({'WTF_CSRF_ENABLED': False, 'INGEST_WORKERS': 0, 'BACKGROUND_INDEX_BUILDS': False})
 
-app.config['WTF_CSRF_ENABLED'] = False
+with app.app_context():
+    db.create_all()
 
 
 # ------- Views ------- #
@@ -23,6 +37,13 @@ class UserViewTestCase(TestCase):
 
         db.drop_all()
         db.create_all()
+        # Ids are reused across tests, so cached cards would show the previous test's recipes.
+        recipe_cards.clear()
+        liked_ids_cache.clear()
+        search_index.reset()
+        recommender.reset()
+        pantry_search.reset()
+        typeahead.reset()
 
         self.client = app.test_client()
 
@@ -171,6 +192,562 @@ class UserViewTestCase(TestCase):
             self.assertIn('Access unauthorized', str(response.data))
 
 
+    # ------- Likes ------- #
+
+    def test_liked_state_follows_like_and_unlike(self):
+        '''Test if the cached liked ids are refreshed right after a like and an unlike.'''
+
+        db.session.add(Recipe(id=1111, title='Test Recipe 1', recipe_image='image1', dish_type='dishtype1', cuisine_type='cuisinetype1', recipe='steps1'))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+            self.assertNotIn('fa-solid', str(c.get('/').data))
+
+            c.post('/users/add_like/1111')
+            self.assertIn('fa-solid', str(c.get('/').data))
+
+            c.post('/users/add_like/1111')
+            self.assertNotIn('fa-solid', str(c.get('/').data))
+
+    def test_liked_state_is_shared_by_sessions_of_one_user(self):
+        '''Test if a like made in one session shows in another session of the same user right away.'''
+
+        db.session.add(Recipe(id=1111, title='Test Recipe 1', recipe_image='image1', dish_type='dishtype1', cuisine_type='cuisinetype1', recipe='steps1'))
+        db.session.commit()
+
+        phone = app.test_client()
+        laptop = app.test_client()
+        for client in (phone, laptop):
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+        self.assertNotIn('fa-solid', str(phone.get('/').data))
+        self.assertNotIn('fa-solid', str(laptop.get('/').data))
+
+        laptop.post('/users/add_like/1111')
+        self.assertIn('fa-solid', str(laptop.get('/').data))
+        self.assertIn('fa-solid', str(phone.get('/').data))
+
+        phone.post('/users/add_like/1111')
+        self.assertNotIn('fa-solid', str(laptop.get('/').data))
+
+
+    def test_likes_and_recipes_pages_stream(self):
+        '''Test if the likes and recipes pages are streamed and list every card.'''
+
+        db.session.add_all([
+            Recipe(id=n, title=f'Streamed Recipe {n}', recipe_image='image', dish_type='dish', cuisine_type='cuisine', recipe='steps', user_id=self.testuser1_id if n % 2 else None)
+            for n in range(1, 8)
+        ])
+        db.session.commit()
+        db.session.add_all([Likes(user_id=self.testuser1_id, recipe_id=n) for n in (2, 4)])
+        db.session.commit()
+
+        app.config['STREAM_YIELD_PER'] = 2
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser1_id
+
+                resp = c.get(f'/users/{self.testuser1_id}/likes')
+                self.assertTrue(resp.is_streamed)
+                page = str(resp.data)
+                self.assertIn('Streamed Recipe 2', page)
+                self.assertIn('Streamed Recipe 4', page)
+                self.assertNotIn('Streamed Recipe 1', page)
+                self.assertNotIn('have any likes', page)
+
+                page = str(c.get(f'/users/{self.testuser1_id}/recipes').data)
+                self.assertEqual([n for n in range(1, 8) if f'Streamed Recipe {n}<' in page], [1, 3, 5, 7])
+
+                Likes.query.delete()
+                db.session.commit()
+                self.assertIn('have any likes', str(c.get(f'/users/{self.testuser1_id}/likes').data))
+        finally:
+            app.config['STREAM_YIELD_PER'] = 100
+
+
+    def test_toggle_like_json(self):
+        '''Test if the JSON endpoint toggles a like in place and refuses own recipes.'''
+
+        db.session.add_all([
+            Recipe(id=1111, title='Test Recipe 1', recipe_image='image1', dish_type='dishtype1', cuisine_type='cuisinetype1', recipe='steps1'),
+            Recipe(id=2222, title='Test Recipe 2', recipe_image='image2', dish_type='dishtype2', cuisine_type='cuisinetype2', recipe='steps2', user_id=self.testuser1_id),
+        ])
+        db.session.commit()
+
+        with self.client as c:
+            self.assertEqual(c.post('/api/likes/1111/toggle').status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+            self.assertEqual(c.post('/api/likes/1111/toggle').json, {'recipe_id': 1111, 'liked': True})
+            self.assertEqual(Likes.query.filter_by(user_id=self.testuser1_id, recipe_id=1111).count(), 1)
+
+            self.assertEqual(c.post('/api/likes/1111/toggle').json, {'recipe_id': 1111, 'liked': False})
+            self.assertEqual(Likes.query.count(), 0)
+
+            self.assertEqual(c.post('/api/likes/2222/toggle').status_code, 403)
+            self.assertEqual(c.post('/api/likes/9999/toggle').status_code, 404)
+
+
+    # ------- Browse View ------- #
+
+    def test_browse_by_facets(self):
+        '''Test if browsing filters by cuisine and dish type and shows the facet counts.'''
+
+        Recipe.ingest([
+            make_hit(1, cuisineType=['indian'], dishType=['soup']),
+            make_hit(2, cuisineType=['indian'], dishType=['main course']),
+            make_hit(3, cuisineType=['french'], dishType=['soup']),
+        ])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+            page = str(c.get('/recipes/browse?cuisine=Indian').data)
+            self.assertIn('Hit Recipe 1', page)
+            self.assertIn('Hit Recipe 2', page)
+            self.assertNotIn('Hit Recipe 3', page)
+            self.assertIn('Indian (2)', page)
+            self.assertIn('Soup (1)', page)
+
+            page = str(c.get('/recipes/browse?cuisine=Indian&dish=Soup').data)
+            self.assertIn('Hit Recipe 1', page)
+            self.assertNotIn('Hit Recipe 2', page)
+
+    def test_facet_counts_follow_add_and_delete(self):
+        '''Test if adding and deleting recipes keeps the facet counts current.'''
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+            c.post('/recipes/add', data={'title': 'Mine', 'recipe_image': 'image', 'dish_type': 'Soup', 'cuisine_type': 'Nordic', 'recipe': '1 fish\n2 potatoes'})
+            self.assertEqual(FacetCount.counts('cuisine_type'), [('Nordic', 1)])
+
+            recipe = Recipe.query.filter_by(title='Mine').one()
+            self.assertEqual(recipe.ingredient_lines, ['1 fish', '2 potatoes'])
+
+            c.post(f'/recipes/{recipe.id}/delete')
+            self.assertEqual(FacetCount.counts('cuisine_type'), [])
+
+
+    def test_pantry_finds_recipes_by_ingredients_on_hand(self):
+        '''Test if the pantry page groups recipes by missing ingredients and sees recipes added later.'''
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+            c.post('/recipes/add', data={'title': 'Fish Pie', 'recipe_image': 'image', 'dish_type': 'Soup', 'cuisine_type': 'Nordic', 'recipe': '1 fish\n2 potatoes\nsalt'})
+            page = str(c.get('/recipes/pantry?have=fish,+potato').data)
+            self.assertIn('You have everything', page)
+            self.assertIn('Fish Pie', page)
+
+            c.post('/recipes/add', data={'title': 'Fish Soup', 'recipe_image': 'image', 'dish_type': 'Soup', 'cuisine_type': 'Nordic', 'recipe': '1 fish\n1 leek\n2 cups cream'})
+            page = str(c.get('/recipes/pantry?have=fish&missing=1').data)
+            self.assertIn('Missing 1 ingredient', page)
+            self.assertNotIn('Fish Soup', page)
+
+            page = str(c.get('/recipes/pantry?have=fish&missing=2').data)
+            self.assertIn('Missing 2 ingredients', page)
+            self.assertIn('Fish Soup', page)
+
+            self.assertIn('No recipes can be made', str(c.get('/recipes/pantry?have=lamb').data))
+
+    def test_typeahead_suggests_titles_and_popular_searches(self):
+        '''Test if the typeahead suggests recipe titles as they are added and searches once they are popular.'''
+
+        db.session.add(Recipe(title='Chicken Curry', recipe_image='image', dish_type='dish', cuisine_type='cuisine', recipe='steps'))
+        db.session.commit()
+
+        self.assertEqual(self.client.get('/api/typeahead?q=cu').status_code, 401)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+            data = c.get('/api/typeahead?q=cu').get_json()
+            self.assertEqual(data['suggestions'], [{'text': 'Chicken Curry', 'kind': 'recipe'}])
+
+            c.post('/recipes/add', data={'title': 'Curried Lentils', 'recipe_image': 'image', 'dish_type': 'Soup', 'cuisine_type': 'Nordic', 'recipe': '1 cup lentils'})
+            data = c.get('/api/typeahead?q=CURR').get_json()
+            self.assertEqual([s['text'] for s in data['suggestions']], ['Curried Lentils', 'Chicken Curry'])
+
+            for n in range(typeahead.min_count):
+                c.post('/users/search', data={'query': ' Curry  Puffs'})
+            self.assertEqual(SearchQuery.query.get('curry puffs').count, typeahead.min_count)
+
+            data = c.get('/api/typeahead?q=curr').get_json()
+            self.assertEqual(data['suggestions'][0], {'text': 'curry puffs', 'kind': 'query'})
+            self.assertEqual(len(data['suggestions']), 3)
+
+
+    # ------- Home View ------- #
+
+    def test_homepage_keyset_pages(self):
+        '''Test if the homepage pages through recipes with next and previous cursors.'''
+
+        for n in range(1, 6):
+            db.session.add(Recipe(id=n, title=f'Paged Recipe {n}', recipe_image='image', dish_type='dish', cuisine_type='cuisine', recipe='steps'))
+        db.session.commit()
+
+        app.config['RECIPES_PER_PAGE'] = 2
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser1_id
+
+                first = str(c.get('/').data)
+                self.assertIn('Paged Recipe 1', first)
+                self.assertIn('Paged Recipe 2', first)
+                self.assertNotIn('Paged Recipe 3', first)
+                self.assertIn('/?after=2', first)
+                self.assertNotIn('recipes</p>', first)
+
+                second = str(c.get('/?after=2').data)
+                self.assertIn('Paged Recipe 3', second)
+                self.assertIn('Paged Recipe 4', second)
+                self.assertIn('/?before=3', second)
+
+                previous = str(c.get('/?before=3').data)
+                self.assertIn('Paged Recipe 1', previous)
+                self.assertNotIn('Paged Recipe 3', previous)
+
+                counted = str(c.get('/?count=1').data)
+                self.assertIn('5 recipes', counted)
+        finally:
+            app.config['RECIPES_PER_PAGE'] = 24
+
+
+    def test_recipe_cards_are_cached_per_version(self):
+        '''Test if card HTML is reused across users with their own liked state and re-rendered after an edit.'''
+
+        db.session.add(Recipe(id=1111, title='Cached Recipe', recipe_image='image1', dish_type='dish', cuisine_type='cuisine', recipe='steps'))
+        db.session.commit()
+        db.session.add(Likes(user_id=self.testuser1_id, recipe_id=1111))
+        db.session.commit()
+
+        other = User.signup('otheruser', 'other@email.com', 'otheruser')
+        db.session.commit()
+        other_id = other.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+            self.assertIn('fa-solid', str(c.get('/').data))
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = other_id
+            page = str(c.get('/').data)
+            self.assertIn('Cached Recipe', page)
+            self.assertNotIn('fa-solid', page)
+            self.assertEqual(recipe_cards.stats()['misses'], 1)
+
+            recipe = Recipe.query.get(1111)
+            recipe.title = 'Edited Recipe'
+            db.session.commit()
+            self.assertEqual(recipe.version, 2)
+
+            page = str(c.get('/').data)
+            self.assertIn('Edited Recipe', page)
+            self.assertNotIn('Cached Recipe', page)
+
+
+    def test_listing_pages_answer_conditional_gets(self):
+        '''Test if listing pages send 304 to a current client and a fresh page after a write.'''
+
+        db.session.add(Recipe(id=1111, title='Test Recipe 1', recipe_image='image1', dish_type='dishtype1', cuisine_type='cuisinetype1', recipe='steps1'))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+            for url in ['/', f'/users/{self.testuser1_id}/recipes', f'/users/{self.testuser1_id}/likes']:
+                resp = c.get(url)
+                self.assertEqual(resp.status_code, 200)
+                etag = resp.headers['ETag']
+
+                resp = c.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(resp.data, b'')
+
+            etag = c.get('/').headers['ETag']
+            c.post('/api/likes/1111/toggle')
+            resp = c.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('fa-solid', str(resp.data))
+
+            etag = c.get(f'/users/{self.testuser1_id}/recipes').headers['ETag']
+            c.post('/recipes/add', data={'title': 'Mine', 'recipe_image': 'image', 'dish_type': 'Soup', 'cuisine_type': 'Nordic', 'recipe': '1 fish\n2 potatoes'})
+            resp = c.get(f'/users/{self.testuser1_id}/recipes', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Mine', str(resp.data))
+
+
+    def test_homepage_recommends_recipes_liked_together(self):
+        '''Test if the homepage recommends what users with the same likes also liked, and keeps up with new likes.'''
+
+        for n, title in enumerate(['Shared Soup', 'My Pie', 'Also Liked Stew'], 1):
+            db.session.add(Recipe(id=n, title=title, recipe_image='image', dish_type='dish', cuisine_type='cuisine', recipe='steps'))
+        other = User.signup('otheruser', 'other@email.com', 'otheruser')
+        db.session.commit()
+        other_id = other.id
+        Recipe.query.get(2).user_id = self.testuser1_id
+        db.session.add_all([
+            Likes(user_id=other_id, recipe_id=1),
+            Likes(user_id=other_id, recipe_id=2),
+            Likes(user_id=other_id, recipe_id=3),
+            Likes(user_id=self.testuser1_id, recipe_id=1),
+        ])
+        db.session.commit()
+
+        limit = app.config['RECOMMEND_LIMIT']
+        app.config['RECOMMEND_LIMIT'] = 1
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser1_id
+
+                # The user's own recipe ties with the stew but never takes the only slot.
+                resp = c.get('/')
+                self.assertIn('Recommended for you', str(resp.data))
+                self.assertIn('Also Liked Stew', str(resp.data))
+                self.assertEqual(recommender.recommend_ids(self.testuser1_id, frozenset([1]), limit=1), [3])
+
+                etag = resp.headers['ETag']
+                self.assertEqual(c.get('/', headers={'If-None-Match': etag}).status_code, 304)
+                c.post('/api/likes/3/toggle')
+                resp = c.get('/', headers={'If-None-Match': etag})
+                self.assertEqual(resp.status_code, 200)
+                self.assertNotIn('Recommended for you', str(resp.data))
+
+                self.assertNotIn('Recommended for you', str(c.get('/?after=1').data))
+        finally:
+            app.config['RECOMMEND_LIMIT'] = limit
+        self.assertEqual(recommender.stats()['builds'], 1)
+
+
+    # ------- Search View ------- #
+
+    def test_search_answers_from_local_index(self):
+        '''Test if a search with enough stored matches is answered without calling Edamam.'''
+
+        db.session.add_all([
+            Recipe(title='Lemon Chicken', recipe_image='image1', dish_type='Main course', cuisine_type='Greek', recipe="['1 chicken', '2 lemons']"),
+            Recipe(title='Beef Stew', recipe_image='image2', dish_type='Soup', cuisine_type='British', recipe="['1 lb beef']"),
+        ])
+        db.session.commit()
+
+        app.config['SEARCH_LOCAL_MIN'] = 1
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser1_id
+
+                response = c.post('/users/search', data={'query': 'lemons'}, follow_redirects=True)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Lemon Chicken', str(response.data))
+                self.assertNotIn('Beef Stew', str(response.data))
+        finally:
+            app.config['SEARCH_LOCAL_MIN'] = 10
+
+
+    def test_search_snapshots_are_shared_between_workers(self):
+        '''Test if snapshots are kept in the database, readable by another worker, and dropped once expired.'''
+
+        self.assertIsInstance(search_snapshots.backend, DatabaseBackend)
+        other_worker = SearchSnapshots(DatabaseBackend(SearchSnapshot.__table__), ttl=60)
+
+        snapshot_id = search_snapshots.create('lemon', [3, 1, 2], job_id=7)
+        self.assertEqual(other_worker.get(snapshot_id), {'query': 'lemon', 'ids': [3, 1, 2], 'job': 7})
+
+        expired = SearchSnapshots(DatabaseBackend(SearchSnapshot.__table__), ttl=-1)
+        expired_id = expired.create('beef', [1])
+        self.assertIsNone(expired.get(expired_id))
+        other_worker.create('fish', [2])
+        self.assertIsNone(SearchSnapshot.query.get(expired_id))
+        self.assertEqual(len(other_worker.backend), 2)
+
+
+    def test_search_results_are_paged_snapshots(self):
+        '''Test if a search redirects to a snapshot whose pages and like clicks never search again.'''
+
+        for n in range(1, 4):
+            db.session.add(Recipe(id=n, title=f'Lemon Dish {n}', recipe_image='image', dish_type='dish', cuisine_type='cuisine', recipe="['2 lemons']"))
+        db.session.commit()
+
+        app.config['SEARCH_LOCAL_MIN'] = 1
+        app.config['RECIPES_PER_PAGE'] = 2
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser1_id
+
+                response = c.post('/users/search', data={'query': 'lemon'})
+                self.assertEqual(response.status_code, 303)
+                snapshot_url = response.location
+                self.assertIn('rs=', snapshot_url)
+
+                # Renamed recipes no longer match, but the snapshot still pages through them.
+                Recipe.query.filter(Recipe.id != 3).update({'title': 'Gone'}, synchronize_session=False)
+                db.session.commit()
+
+                first = str(c.get(snapshot_url).data)
+                self.assertIn('Results for', first)
+                self.assertIn('Gone', first)
+                self.assertIn('page=2', first)
+                second = str(c.get(f'{snapshot_url}&page=2').data)
+                self.assertIn('Lemon Dish 3', second)
+
+                response = c.post('/users/like/3')
+                self.assertEqual(response.status_code, 302)
+                self.assertIn('page=2', response.location)
+                self.assertIn('fa-solid', str(c.get(response.location).data))
+
+                response = c.get('/users/search?rs=unknown', follow_redirects=True)
+                self.assertIn('expired', str(response.data))
+        finally:
+            app.config['SEARCH_LOCAL_MIN'] = 10
+            app.config['RECIPES_PER_PAGE'] = 24
+
+
+    def test_search_when_edamam_unreachable(self):
+        '''Test if the search page still renders local matches when Edamam can't be reached.'''
+
+        db.session.add(Recipe(title='Lemon Chicken', recipe_image='image1', dish_type='Main course', cuisine_type='Greek', recipe="['1 chicken', '2 lemons']"))
+        db.session.commit()
+
+        base_url, retries = edamam_client.base_url, edamam_client.retries
+        edamam_client.base_url, edamam_client.retries = 'http://127.0.0.1:9/api', 0
+        edamam_client.close()
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser1_id
+
+                response = c.post('/users/search', data={'query': 'lemon'}, follow_redirects=True)
+
+                # Local matches come back right away; the Edamam fetch is queued.
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Lemon Chicken', str(response.data))
+                self.assertIn('Looking for more recipes', str(response.data))
+
+                status_url = f'/api/search/jobs/{IngestJob.query.one().id}'
+                self.assertEqual(c.get(status_url).json, {'status': 'queued'})
+
+                self.assertEqual(ingest_queue.run_pending(), 1)
+                status = c.get(status_url).json
+                self.assertEqual(status['status'], 'failed')
+                self.assertIn('Recipe search is slow right now', status['message'])
+        finally:
+            edamam_client.base_url, edamam_client.retries = base_url, retries
+            edamam_client.close()
+
+
+    def test_search_falls_back_to_stale_results(self):
+        '''Test if an expired cached response is served when Edamam can't be asked.'''
+
+        search_cache.backend.set('saffron', {'hits': [make_hit(1, label='Stale Saffron Rice')], '_links': {}}, 0)
+
+        base_url, retries = edamam_client.base_url, edamam_client.retries
+        edamam_client.base_url, edamam_client.retries = 'http://127.0.0.1:9/api', 0
+        edamam_client.close()
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser1_id
+
+                response = c.post('/users/search', data={'query': 'Saffron'}, follow_redirects=True)
+                self.assertIn('Looking for more recipes', str(response.data))
+                self.assertEqual(ingest_queue.run_pending(), 1)
+
+                status = c.get(f'/api/search/jobs/{IngestJob.query.one().id}').json
+                self.assertEqual(status['status'], 'done')
+                self.assertIn('Stale Saffron Rice', str(c.get(status['url']).data))
+        finally:
+            edamam_client.base_url, edamam_client.retries = base_url, retries
+            edamam_client.close()
+            search_cache.backend.delete('saffron')
+
+
+    def test_finished_search_keeps_local_matches(self):
+        '''Test if the results of a finished fetch keep the local matches and every poll gets the same snapshot.'''
+
+        db.session.add(Recipe(title='Saffron Cake', recipe_image='image1', dish_type='Desserts', cuisine_type='Italian', recipe='1 pinch saffron'))
+        db.session.commit()
+        search_cache.backend.set('saffron', {'hits': [], '_links': {}}, 0)
+
+        base_url, retries = edamam_client.base_url, edamam_client.retries
+        edamam_client.base_url, edamam_client.retries = 'http://127.0.0.1:9/api', 0
+        edamam_client.close()
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser1_id
+
+                response = c.post('/users/search', data={'query': 'Saffron'})
+                snapshot_id = response.location.split('rs=')[1]
+                self.assertEqual(ingest_queue.run_pending(), 1)
+
+                status_url = f'/api/search/jobs/{IngestJob.query.one().id}?rs={snapshot_id}'
+                first = c.get(status_url).json
+                self.assertEqual(first['status'], 'done')
+                self.assertIn('Saffron Cake', str(c.get(first['url']).data))
+                self.assertEqual(c.get(status_url).json, first)
+                self.assertEqual(c.get(status_url.split('?')[0]).json, first)
+        finally:
+            edamam_client.base_url, edamam_client.retries = base_url, retries
+            edamam_client.close()
+            search_cache.backend.delete('saffron')
+
+
+    def test_ingest_queue_dedupes_and_reclaims_jobs(self):
+        '''Test if identical searches share a queued job and a job left running by a dead worker is run again.'''
+
+        first = ingest_queue.enqueue('Lemon  Tart')
+        self.assertEqual(ingest_queue.enqueue('lemon tart').id, first.id)
+
+        job = ingest_queue.claim()
+        self.assertEqual((job.id, job.status, job.attempts), (first.id, 'running', 1))
+        self.assertIsNone(ingest_queue.claim())
+
+        job.updated_at = datetime.utcnow() - timedelta(seconds=ingest_queue.lease + 1)
+        db.session.commit()
+        job = ingest_queue.claim()
+        self.assertEqual((job.id, job.attempts), (first.id, 2))
+
+
+def make_hit(n, **fields):
+    '''Build a fake Edamam search hit.'''
+
+    recipe = {
+        'label': f'Hit Recipe {n}',
+        'image': f'image{n}',
+        'url': f'https://example.com/recipes/{n}',
+        'ingredientLines': [f'{n} cups of flour', 'salt'],
+        'cuisineType': ['american'],
+        'dishType': ['main course'],
+    }
+    recipe.update(fields)
+    return {'recipe': recipe}
+
+
 # -------  Models ------- #
 
 class ModelsTestCase(TestCase):
@@ -181,6 +758,8 @@ class ModelsTestCase(TestCase):
 
         db.drop_all()
         db.create_all()
+        # Ids are reused across tests, so the SQLite fallback index must not keep the previous test's recipes.
+        search_index.reset()
 
         self.client = app.test_client()
 
@@ -303,3 +882,174 @@ class ModelsTestCase(TestCase):
         like = Likes.query.filter(Likes.user_id == new_test_user_id).all()
         self.assertEqual(len(like), 1)
 
+    def test_ingest_hits(self):
+        '''Test if ingesting hits stores new recipes once and returns them in hit order.'''
+
+        existing = Recipe(title='Hit Recipe 2', recipe_image='image2', dish_type='Main course', cuisine_type='American', recipe='steps', url='https://example.com/recipes/2')
+        db.session.add(existing)
+        db.session.commit()
+
+        hits = [make_hit(3), make_hit(2), make_hit(1), make_hit(3)]
+        recipes = Recipe.ingest(hits, user_id=self.testuser1_id)
+        db.session.commit()
+
+        self.assertEqual([recipe.title for recipe in recipes], ['Hit Recipe 3', 'Hit Recipe 2', 'Hit Recipe 1'])
+        self.assertEqual(recipes[1].id, existing.id)
+        self.assertEqual(Recipe.query.count(), 3)
+
+        again = Recipe.ingest(hits)
+        self.assertEqual([recipe.id for recipe in again], [recipe.id for recipe in recipes])
+        self.assertEqual(Recipe.query.count(), 3)
+
+    def test_ingest_hit_without_dish_type(self):
+        '''Test if hits missing a dish type still get stored.'''
+
+        hit = make_hit(1)
+        del hit['recipe']['dishType']
+
+        recipes = Recipe.ingest([hit])
+        db.session.commit()
+
+        self.assertEqual(recipes[0].dish_type, 'None')
+
+    def test_full_text_search_ranking(self):
+        '''Test if the full-text index matches every term and ranks the better match first.'''
+
+        db.session.add_all([
+            Recipe(title='Chicken Soup', recipe_image='image1', dish_type='Soup', cuisine_type='American', recipe="['1 chicken', 'carrots']"),
+            Recipe(title='Chicken Curry', recipe_image='image2', dish_type='Main course', cuisine_type='Indian', recipe="['1 chicken', 'curry paste', 'more chicken']"),
+            Recipe(title='Tomato Soup', recipe_image='image3', dish_type='Soup', cuisine_type='Italian', recipe="['tomatoes']"),
+        ])
+        db.session.commit()
+
+        self.assertEqual([recipe.title for recipe in search_index.search('chicken')], ['Chicken Curry', 'Chicken Soup'])
+        self.assertEqual([recipe.title for recipe in search_index.search('chicken soup')], ['Chicken Soup'])
+        self.assertEqual(search_index.search('the'), [])
+
+    def test_duplicate_like(self):
+        '''Test if a user can't like the same recipe twice.'''
+
+        recipe = Recipe(id=1111, title='Test Recipe 1', recipe_image='image1', dish_type='dishtype1', cuisine_type='cuisinetype1', recipe='steps1')
+        db.session.add(recipe)
+        db.session.commit()
+
+        db.session.add_all([Likes(user_id=self.testuser1_id, recipe_id=1111), Likes(user_id=self.testuser1_id, recipe_id=1111)])
+
+        with self.assertRaises(exc.IntegrityError):
+            db.session.commit()
+
+    def test_load_identity(self):
+        '''Test if the request principal carries id and username and loads the full user lazily.'''
+
+        identity_cache.clear()
+
+        principal = load_identity(self.testuser1_id)
+        self.assertEqual((principal.id, principal.username), (self.testuser1_id, 'testuser1'))
+        self.assertIsNone(principal._user)
+
+        self.assertEqual(principal.email, 'email1@email.com')
+        self.assertEqual(principal.likes, [])
+
+        self.assertIsNone(load_identity(9999))
+
+    def test_rehash_on_login(self):
+        '''Test if logging in upgrades a hash made with an outdated work factor.'''
+
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+        try:
+            # The work factor is read from the current app.
+            with app.app_context():
+                user = User.signup('rehashuser', 'rehash@email.com', 'rehashpassword')
+                db.session.commit()
+                self.assertTrue(user.password.startswith('$2b$04$'))
+
+                app.config['BCRYPT_LOG_ROUNDS'] = 5
+                user = User.authenticate('rehashuser', 'rehashpassword')
+                db.session.commit()
+
+                self.assertTrue(user.password.startswith('$2b$05$'))
+                self.assertTrue(User.authenticate('rehashuser', 'rehashpassword'))
+        finally:
+            app.config['BCRYPT_LOG_ROUNDS'] = 12
+
+    def test_ingest_stores_ingredients(self):
+        '''Test if ingested recipes get one ingredient row per line, in order.'''
+
+        recipe = Recipe.ingest([make_hit(1)])[0]
+        db.session.commit()
+
+        self.assertEqual([ingredient.line for ingredient in recipe.ingredients], ['1 cups of flour', 'salt'])
+        self.assertEqual(recipe.ingredient_lines, ['1 cups of flour', 'salt'])
+
+    def test_ingredients_follow_recipe_text(self):
+        '''Test if recipes added or edited through the ORM get their ingredient rows rewritten from the text.'''
+
+        recipe = Recipe(title='Toast', recipe_image='image', dish_type='dish', cuisine_type='cuisine', recipe='bread\nbutter')
+        db.session.add(recipe)
+        db.session.commit()
+        self.assertEqual([ingredient.line for ingredient in recipe.ingredients], ['bread', 'butter'])
+
+        recipe.recipe = 'rye bread\nbutter\nhoney'
+        db.session.commit()
+        self.assertEqual([(i.position, i.line) for i in Ingredient.query.order_by(Ingredient.position)], [(0, 'rye bread'), (1, 'butter'), (2, 'honey')])
+
+        recipe.recipe = 'jam'
+        db.session.commit()
+        self.assertEqual([i.line for i in Ingredient.query.filter_by(recipe_id=recipe.id)], ['jam'])
+
+        recipe.title = 'Jam Toast'
+        db.session.commit()
+        self.assertEqual(Ingredient.query.count(), 1)
+
+    def test_migrations_backfill_ingredients(self):
+        '''Test if the migrations build the ingredients table from old recipe text formats.'''
+
+        db.session.commit()
+        Ingredient.__table__.drop(db.engine)
+        db.session.execute('DROP TABLE IF EXISTS schema_version')
+        db.session.execute(Recipe.__table__.insert(), [
+            {'id': 1, 'title': 'Old 1', 'recipe_image': 'image', 'dish_type': 'dish', 'cuisine_type': 'cuisine', 'recipe': "['1 egg', 'salt, to taste']"},
+            {'id': 2, 'title': 'Old 2', 'recipe_image': 'image', 'dish_type': 'dish', 'cuisine_type': 'cuisine', 'recipe': '{"2 cups milk",sugar}'},
+        ])
+        db.session.commit()
+
+        self.assertEqual(migrations.upgrade(), [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11])
+        self.assertEqual(migrations.upgrade(), [])
+
+        lines = db.session.query(Ingredient.recipe_id, Ingredient.line).order_by(Ingredient.recipe_id, Ingredient.position).all()
+        self.assertEqual(lines, [(1, '1 egg'), (1, 'salt, to taste'), (2, '2 cups milk'), (2, 'sugar')])
+        self.assertEqual(Recipe.query.get(2).recipe, '2 cups milk\nsugar')
+
+    def test_ingredients_backfill_resumes(self):
+        '''Test if the ingredients backfill keeps the batches done before a failure and picks up after them.'''
+
+        db.session.commit()
+        Ingredient.__table__.drop(db.engine)
+        db.session.execute('DROP TABLE IF EXISTS schema_version')
+        db.session.execute(Recipe.__table__.insert(), [
+            {'id': n, 'title': f'Old {n}', 'recipe_image': 'image', 'dish_type': 'dish', 'cuisine_type': 'cuisine', 'recipe': f"['{n} egg']"}
+            for n in range(1, 4)
+        ])
+        db.session.commit()
+
+        split = migrations.split_ingredient_lines
+        def split_failing_on_3(recipe):
+            if recipe == "['3 egg']":
+                raise ValueError(recipe)
+            return split(recipe)
+
+        batch_size, migrations.BATCH_SIZE = migrations.BATCH_SIZE, 1
+        migrations.split_ingredient_lines = split_failing_on_3
+        try:
+            with self.assertRaises(ValueError):
+                migrations.upgrade()
+            self.assertEqual(db.session.query(Ingredient.line).order_by(Ingredient.recipe_id).all(), [('1 egg',), ('2 egg',)])
+
+            migrations.split_ingredient_lines = split
+            self.assertEqual(migrations.upgrade(), [4, 5, 6, 7, 8, 9, 10, 11])
+        finally:
+            migrations.BATCH_SIZE = batch_size
+            migrations.split_ingredient_lines = split
+
+        lines = db.session.query(Ingredient.recipe_id, Ingredient.line).order_by(Ingredient.recipe_id).all()
+        self.assertEqual(lines, [(1, '1 egg'), (2, '2 egg'), (3, '3 egg')])
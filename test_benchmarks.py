@@ -0,0 +1,89 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from urllib.parse import parse_qs
+
+from benchmarks.driver import LoginFailed, VirtualUser, percentile, regressions
+from benchmarks.stub_edamam import StubEdamam
+from edamam import EdamamClient
+
+
+def fake_app(accept_logins):
+    '''A server with just the login form and a homepage, accepting logins or not.'''
+
+    posted = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = b'<input id="csrf_token" name="csrf_token" type="hidden" value="tok3n">' if self.path == '/login' else b'<a href="/users/42/recipes">'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            posted.append(parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode()))
+            self.send_response(302 if accept_logins else 200)
+            self.send_header('Location', '/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, posted
+
+
+class BenchmarkToolsTestCase(TestCase):
+    '''Test the load-test helpers.'''
+
+    def test_stub_serves_linked_pages(self):
+        '''Testing if the stub Edamam server answers the real client with linked pages.'''
+
+        stub = StubEdamam(latency=0, pages=2)
+        server = stub.serve()
+        try:
+            client = EdamamClient(base_url=f'http://127.0.0.1:{server.server_port}/api/recipes/v2')
+            results = client.search('chicken', pages=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(results['hits']), 40)
+        self.assertEqual(stub.requests, 2)
+
+    def test_percentiles_and_regressions(self):
+        '''Testing if percentiles and p95 regressions are computed from the reports.'''
+
+        values = sorted(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 51)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+        baseline = {'routes': {'home': {'p95_ms': 10.0}, 'search': {'p95_ms': 100.0}}}
+        report = {'routes': {'home': {'p95_ms': 13.0}, 'search': {'p95_ms': 110.0}}}
+        self.assertEqual(regressions(report, baseline, threshold=0.2), ['home'])
+
+    def test_driver_login_sends_csrf_token_and_fails_loudly(self):
+        '''Testing if bench users log in with the form's CSRF token and a refused login stops the run.'''
+
+        server, posted = fake_app(accept_logins=True)
+        try:
+            vuser = VirtualUser(f'http://127.0.0.1:{server.server_port}', 0, [1])
+            vuser.sign_in()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(vuser.user_id, '42')
+        self.assertEqual(posted[0]['username'], ['benchuser0'])
+        self.assertEqual(posted[0]['csrf_token'], ['tok3n'])
+
+        server, _ = fake_app(accept_logins=False)
+        try:
+            with self.assertRaises(LoginFailed):
+                VirtualUser(f'http://127.0.0.1:{server.server_port}', 0, [1]).sign_in()
+        finally:
+            server.shutdown()
+            server.server_close()
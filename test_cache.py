@@ -0,0 +1,101 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from cache import SearchCache, SearchSnapshots, MemoryBackend, SqliteBackend, make_backend, normalize_query
+
+
+class SearchCacheTestCase(TestCase):
+    '''Test the Edamam search response cache.'''
+
+    def test_normalize_query(self):
+        '''Testing if queries that only differ by case and spacing share a key.'''
+
+        self.assertEqual(normalize_query('  Chicken   Soup '), 'chicken soup')
+        self.assertEqual(normalize_query(None), '')
+
+    def test_hit_and_miss(self):
+        '''Testing if the cache counts hits and misses.'''
+
+        cache = SearchCache(MemoryBackend(), ttl=60)
+
+        self.assertIsNone(cache.get('chicken'))
+        cache.set('Chicken', {'hits': []})
+
+        self.assertEqual(cache.get('chicken '), {'hits': []})
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_ttl_expiry(self):
+        '''Testing if expired entries are treated as misses.'''
+
+        cache = SearchCache(MemoryBackend(), ttl=-1)
+        cache.set('chicken', {'hits': []})
+
+        self.assertIsNone(cache.get('chicken'))
+
+    def test_lru_eviction(self):
+        '''Testing if the least recently used entry goes first when the cache is full.'''
+
+        cache = SearchCache(MemoryBackend(maxsize=2), ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_sqlite_backend_is_shared(self):
+        '''Testing if two caches on the same sqlite file see each other's entries and stay bounded.'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.sqlite')
+            first = SearchCache(SqliteBackend(path, maxsize=2), ttl=60)
+            second = SearchCache(SqliteBackend(path, maxsize=2), ttl=60)
+
+            first.set('chicken', {'hits': [1]})
+            self.assertEqual(second.get('chicken'), {'hits': [1]})
+
+            time.sleep(0.01)
+            second.set('beef', {'hits': [2]})
+            time.sleep(0.01)
+            second.set('pork', {'hits': [3]})
+
+            self.assertIsNone(first.get('chicken'))
+            self.assertEqual(len(first.backend), 2)
+
+    def test_make_backend_paths(self):
+        '''Testing if a sqlite backend can be made in a new directory and under a bare filename.'''
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsInstance(make_backend('sqlite', os.path.join(tmp, 'new', 'cache.sqlite'), 10), SqliteBackend)
+            os.chdir(tmp)
+            try:
+                self.assertIsInstance(make_backend('sqlite', 'cache.sqlite', 10), SqliteBackend)
+            finally:
+                os.chdir(cwd)
+
+
+class SearchSnapshotsTestCase(TestCase):
+    '''Test the stored search result id lists.'''
+
+    def test_snapshots_across_workers(self):
+        '''Testing if a snapshot keeps its order, is readable from another worker and expires.'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'snapshots.sqlite')
+            first = SearchSnapshots(SqliteBackend(path), ttl=60)
+            second = SearchSnapshots(SqliteBackend(path), ttl=60)
+
+            snapshot_id = first.create('chicken', [3, 1, 2])
+            self.assertEqual(second.get(snapshot_id), {'query': 'chicken', 'ids': [3, 1, 2]})
+            self.assertNotEqual(first.create('chicken', [3, 1, 2]), snapshot_id)
+
+        expired = SearchSnapshots(MemoryBackend(), ttl=-1)
+        self.assertIsNone(expired.get(expired.create('beef', [1])))
+        self.assertIsNone(expired.get('unknown'))
+        self.assertEqual(expired.stats()['misses'], 2)
@@ -0,0 +1,152 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from urllib.parse import urlparse, parse_qs
+
+from flask import Flask
+
+from edamam import EdamamClient, EdamamError, EdamamThrottled
+from metrics import upstream_coalesced, upstream_throttled
+from quota import TokenBucket
+
+
+class StubEdamamHandler(BaseHTTPRequestHandler):
+    '''Serves three pages of fake hits, plus a slow and a flaky endpoint.'''
+
+    failures = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        if url.path == '/slow':
+            time.sleep(0.5)
+
+        if url.path == '/flaky' and StubEdamamHandler.failures > 0:
+            StubEdamamHandler.failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        page = int(params.get('page', ['1'])[0])
+        body = {
+            'hits': [{'recipe': {'label': f'{params.get("q", ["?"])[0]} {page}', 'url': f'u{page}', 'calories': 1}}],
+            '_links': {},
+        }
+        if page < 3:
+            body['_links']['next'] = {'href': f'http://{self.headers["Host"]}{url.path}?page={page + 1}&q={params.get("q", ["?"])[0]}'}
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class EdamamClientTestCase(TestCase):
+    '''Test the Edamam client against a local stub server.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubEdamamHandler)
+        cls.base = f'http://127.0.0.1:{cls.server.server_port}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_search_follows_next_pages(self):
+        '''Testing if search collects hits from the requested number of pages and trims fields.'''
+
+        client = EdamamClient(base_url=f'{self.base}/api')
+
+        results = client.search('chicken', pages=2)
+
+        self.assertEqual([hit['recipe']['label'] for hit in results['hits']], ['chicken 1', 'chicken 2'])
+        self.assertNotIn('calories', results['hits'][0]['recipe'])
+
+        results = client.search('chicken', pages=10)
+        self.assertEqual(len(results['hits']), 3)
+
+    def test_search_many(self):
+        '''Testing if several queries can be searched concurrently.'''
+
+        client = EdamamClient(base_url=f'{self.base}/api', pool_size=2)
+
+        results = client.search_many(['beef', 'pork', 'fish'], pages=3)
+
+        self.assertEqual(results['fish']['hits'][2]['recipe']['label'], 'fish 3')
+
+    def test_read_timeout(self):
+        '''Testing if a slow answer raises EdamamError instead of hanging.'''
+
+        client = EdamamClient(base_url=f'{self.base}/slow', timeout=(1, 0.1), retries=0)
+
+        with self.assertRaises(EdamamError):
+            client.search('chicken')
+
+    def test_retry_on_server_error(self):
+        '''Testing if 5xx answers are retried and give up after the retry budget.'''
+
+        StubEdamamHandler.failures = 1
+        client = EdamamClient(base_url=f'{self.base}/flaky', retries=2, backoff=0)
+        self.assertEqual(len(client.search('chicken')['hits']), 1)
+
+        StubEdamamHandler.failures = 5
+        client = EdamamClient(base_url=f'{self.base}/flaky', retries=1, backoff=0)
+        with self.assertRaises(EdamamError):
+            client.search('chicken')
+        StubEdamamHandler.failures = 0
+
+    def test_identical_searches_are_coalesced(self):
+        '''Testing if identical searches made at the same time share one upstream call.'''
+
+        client = EdamamClient(base_url=f'{self.base}/slow', retries=0)
+        coalesced = upstream_coalesced.value(service='edamam')
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.search(' Chicken'))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(upstream_coalesced.value(service='edamam'), coalesced + 3)
+
+    def test_quota_throttles_calls(self):
+        '''Testing if calls over the shared budget raise EdamamThrottled without reaching Edamam.'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            client = EdamamClient(base_url=f'{self.base}/api', retries=0)
+            client.quota = TokenBucket(os.path.join(tmp, 'quota.sqlite'), rate=0.001, burst=2)
+            throttled = upstream_throttled.value(service='edamam')
+
+            self.assertEqual(len(client.search('beef', pages=2)['hits']), 2)
+            with self.assertRaises(EdamamThrottled):
+                client.search('beef')
+            self.assertEqual(upstream_throttled.value(service='edamam'), throttled + 1)
+
+    def test_quota_under_a_bare_filename(self):
+        '''Testing if EDAMAM_QUOTA_PATH may name a file in the working directory.'''
+
+        app = Flask(__name__)
+        app.config.update(EDAMAM_RATE=1, EDAMAM_QUOTA_PATH='quota.sqlite')
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                client = EdamamClient()
+                client.init_app(app)
+                self.assertIsInstance(client.quota, TokenBucket)
+            finally:
+                os.chdir(cwd)
@@ -0,0 +1,51 @@
+import threading
+from unittest import TestCase
+
+from hashing import HashExecutor, HashingBusy
+
+
+class HashExecutorTestCase(TestCase):
+    '''Test the bounded bcrypt pool.'''
+
+    def test_run_returns_result(self):
+        '''Testing if work runs on the pool and is counted.'''
+
+        executor = HashExecutor(max_workers=1, max_queue=0)
+
+        self.assertEqual(executor.run(sum, [1, 2]), 3)
+        self.assertEqual(executor.stats()['completed'], 1)
+
+    def test_failures_are_not_completions(self):
+        '''Testing if a hash that raises is counted as failed and frees its slot.'''
+
+        executor = HashExecutor(max_workers=1, max_queue=0)
+
+        with self.assertRaises(ValueError):
+            executor.run(int, 'not a number')
+        self.assertEqual(executor.stats()['completed'], 0)
+        self.assertEqual(executor.stats()['failed'], 1)
+        self.assertEqual(executor.run(int, '2'), 2)
+
+    def test_rejects_when_full(self):
+        '''Testing if work beyond the worker and queue limits is refused.'''
+
+        executor = HashExecutor(max_workers=1, max_queue=0)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        worker = threading.Thread(target=executor.run, args=(block,))
+        worker.start()
+        started.wait()
+
+        with self.assertRaises(HashingBusy):
+            executor.run(sum, [1])
+
+        release.set()
+        worker.join()
+
+        self.assertEqual(executor.stats()['rejected'], 1)
+        self.assertEqual(executor.run(sum, [1]), 1)
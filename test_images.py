@@ -0,0 +1,152 @@
+import base64
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase, skipIf
+
+from flask import Flask
+
+import images
+from images import DiskCache, ImageProxy, ImageFetchError, is_public_host
+
+PIXEL = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==')
+
+
+class StubImageHandler(BaseHTTPRequestHandler):
+    '''Serves a 1x1 PNG at /pixel.png and a text page anywhere else.'''
+
+    requests = 0
+
+    def do_GET(self):
+        StubImageHandler.requests += 1
+        if self.path == '/moved.png':
+            self.send_response(302)
+            self.send_header('Location', '/pixel.png')
+            self.end_headers()
+            return
+
+        is_image = self.path == '/pixel.png'
+        body = PIXEL if is_image else b'<html></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png' if is_image else 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageProxyTestCase(TestCase):
+    '''Test the image proxy against a local stub server.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubImageHandler)
+        cls.base = f'http://127.0.0.1:{cls.server.server_port}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config.update(SECRET_KEY='test', IMAGE_CACHE_DIR=self.tmp.name, IMAGE_PROXY_ALLOW_PRIVATE=True)
+        self.proxy = ImageProxy()
+        self.proxy.init_app(self.app)
+
+    def tearDown(self):
+        self.proxy.close()
+        self.tmp.cleanup()
+
+    def test_fetches_once_and_serves_from_disk(self):
+        '''Testing if the image is downloaded on the first request only and served with long-lived headers.'''
+
+        url = self.proxy.url_for(f'{self.base}/moved.png')
+        before = StubImageHandler.requests
+
+        with self.app.test_client() as client:
+            first = client.get(url)
+            second = client.get(url)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.content_type.startswith('image/'))
+        self.assertEqual(second.data, first.data)
+        self.assertIn('immutable', second.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', second.headers['Cache-Control'])
+        self.assertEqual(StubImageHandler.requests - before, 2)
+
+    def test_rejects_tampered_tokens_and_non_images(self):
+        '''Testing if unsigned urls 404 and a non-image source falls back to the original url.'''
+
+        with self.app.test_client() as client:
+            self.assertEqual(client.get('/images/not-a-token').status_code, 404)
+
+            resp = client.get(self.proxy.url_for(f'{self.base}/page.html'))
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(resp.headers['Location'], f'{self.base}/page.html')
+
+        self.assertEqual(self.proxy.url_for('image1'), 'image1')
+
+    def test_refuses_private_hosts(self):
+        '''Testing if private addresses are refused unless explicitly allowed.'''
+
+        self.proxy.allow_private = False
+        self.assertFalse(is_public_host('127.0.0.1'))
+        self.assertFalse(is_public_host('169.254.169.254'))
+
+        with self.assertRaises(ImageFetchError):
+            self.proxy.fetch(f'{self.base}/pixel.png')
+
+    def test_connects_to_the_checked_address(self):
+        '''Testing if a host that passed the check but resolves to a private address on connect is refused.'''
+
+        self.proxy.allow_private = False
+        before = StubImageHandler.requests
+        is_public = images.is_public_host
+        images.is_public_host = lambda host: True
+        try:
+            with self.assertRaises(ImageFetchError):
+                self.proxy.fetch(f'{self.base}/pixel.png')
+        finally:
+            images.is_public_host = is_public
+        self.assertEqual(StubImageHandler.requests, before)
+
+    @skipIf(images.Image is None, 'Pillow is not installed')
+    def test_refuses_decompression_bombs(self):
+        '''Testing if an image over Pillow's pixel limit is reported as unreadable.'''
+
+        max_pixels, images.Image.MAX_IMAGE_PIXELS = images.Image.MAX_IMAGE_PIXELS, 0
+        try:
+            with self.assertRaises(ImageFetchError):
+                self.proxy.thumbnail(f'{self.base}/pixel.png')
+        finally:
+            images.Image.MAX_IMAGE_PIXELS = max_pixels
+
+
+class DiskCacheTestCase(TestCase):
+    '''Test the content-addressed thumbnail store.'''
+
+    def test_dedupes_and_evicts_least_recently_served(self):
+        '''Testing if equal bytes share a blob and old blobs go first once over the size limit.'''
+
+        with tempfile.TemporaryDirectory() as root:
+            cache = DiskCache(root, max_bytes=25)
+
+            first = cache.set('a', b'x' * 10, 'image/jpeg')
+            self.assertEqual(cache.set('b', b'x' * 10, 'image/jpeg'), first)
+
+            cache.set('c', b'y' * 10, 'image/jpeg')
+            os.utime(first, (1, 1))
+            cache.get('c')
+
+            cache.set('d', b'z' * 10, 'image/jpeg')
+
+            self.assertIsNone(cache.get('a'))
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.get('c')[1], 'image/jpeg')
+            self.assertIsNotNone(cache.get('d'))
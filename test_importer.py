@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Recipe, Ingredient
+
+os.environ['DATABASE_URL'] = 'postgresql:///capstone_one_test'
+
+from app import create_app
+from importer import Checkpoint, jsonl_hits, load, run_import
+
+# No background ingest or index build threads in tests.
+app = create_app({'INGEST_WORKERS': 0, 'BACKGROUND_INDEX_BUILDS': False})
+
+with app.app_context():
+    db.create_all()
+
+
+def make_page(start, count):
+    '''Build a fake Edamam page of `count` hits.'''
+
+    return {
+        'hits': [
+            {'recipe': {
+                'label': f'Imported {n}',
+                'image': f'image{n}',
+                'url': f'https://example.com/imported/{n}',
+                'ingredientLines': [f'{n} eggs'],
+                'cuisineType': ['french'],
+                'dishType': ['egg'],
+            }}
+            for n in range(start, start + count)
+        ],
+        '_links': {},
+    }
+
+
+class ImporterTestCase(TestCase):
+    '''Test the bulk importer.'''
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        db.drop_all()
+        db.create_all()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump = os.path.join(self.tmp.name, 'dump.jsonl')
+        self.checkpoint = os.path.join(self.tmp.name, 'checkpoint.json')
+
+        with open(self.dump, 'w') as f:
+            for start in (1, 4, 7):
+                f.write(json.dumps(make_page(start, 3)) + '\n')
+            f.write(json.dumps(make_page(2, 2)) + '\n')
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+        self.tmp.cleanup()
+
+    def test_jsonl_import_dedupes(self):
+        '''Testing if a JSONL load stores every recipe once, with its ingredients.'''
+
+        User.signup('Recipe King', 'recipeking@email.com', 'thekingishere')
+        db.session.commit()
+
+        seen, stored = run_import(jsonl=[self.dump], checkpoint_path=self.checkpoint, batch_size=4)
+
+        self.assertEqual((seen, stored), (11, 9))
+        self.assertEqual(Recipe.query.count(), 9)
+        self.assertEqual(Ingredient.query.count(), 9)
+        self.assertEqual(Recipe.query.filter_by(user_id=None).count(), 0)
+
+    def test_resume_from_checkpoint(self):
+        '''Testing if an interrupted load resumes after the last committed line and never drops data.'''
+
+        checkpoint = Checkpoint(self.checkpoint)
+        hits = jsonl_hits([self.dump], checkpoint)
+
+        # Stop after the first two pages, as if the process had been killed.
+        partial = (item for n, item in enumerate(hits) if n < 6)
+        load(partial, checkpoint, batch_size=3)
+        self.assertEqual(Recipe.query.count(), 6)
+
+        seen, stored = run_import(jsonl=[self.dump], checkpoint_path=self.checkpoint, username=None)
+
+        self.assertEqual((seen, stored), (5, 3))
+        self.assertEqual(Recipe.query.count(), 9)
+
+        self.assertEqual(run_import(jsonl=[self.dump], checkpoint_path=self.checkpoint, username=None), (0, 0))
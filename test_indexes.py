@@ -0,0 +1,88 @@
+import threading
+from unittest import TestCase
+
+from flask import Flask
+
+from indexes import SyncedIndex
+
+
+class ListIndex(SyncedIndex):
+    '''A "table" of numbers read into a list, with builds that wait for a go-ahead.'''
+
+    config_prefix = 'TEST'
+
+    def __init__(self):
+        super().__init__(refresh=0, rebuild=3600)
+        self.table = [1, 2]
+        self.index = []
+        self.reading = threading.Event()
+        self.go = threading.Event()
+        self.built = threading.Event()
+
+    def build(self):
+        index = list(self.table)
+        self.reading.set()
+        self.go.wait(5)
+
+        def install():
+            self.index = index
+        return install
+
+    def _rebuild(self):
+        super()._rebuild()
+        self.built.set()
+
+    def refresh(self):
+        self.index.extend(n for n in self.table if n not in self.index)
+
+    def add(self, n):
+        self.table.append(n)
+        self.change(lambda: self.index.append(n) if n not in self.index else None)
+
+
+class SyncedIndexTestCase(TestCase):
+    '''Test that index builds run off the request thread and lose no changes in the swap.'''
+
+    def setUp(self):
+        self.index = ListIndex()
+        self.index.init_app(Flask(__name__))
+
+    def test_build_runs_in_the_background(self):
+        '''Testing if sync() returns at once and the old index keeps answering until the new one is installed.'''
+
+        self.index.sync()
+        self.assertTrue(self.index.reading.wait(5))
+        self.assertFalse(self.index.ready)
+        self.assertEqual(self.index.index, [])
+
+        # A second sync while the build runs starts nothing.
+        self.index.sync()
+
+        self.index.go.set()
+        self.assertTrue(self.index.built.wait(5))
+        self.assertTrue(self.index.ready)
+        self.assertEqual(self.index.index, [1, 2])
+        self.assertEqual(self.index.builds, 1)
+
+    def test_changes_during_a_rebuild_are_kept(self):
+        '''Testing if a change made while the tables are read is applied to the new index too.'''
+
+        self.index.sync()
+        self.index.reading.wait(5)
+        self.index.add(3)
+        self.index.go.set()
+        self.index.built.wait(5)
+        self.assertEqual(self.index.index, [1, 2, 3])
+
+    def test_inline_builds(self):
+        '''Testing if builds run on the calling thread with background builds off, followed by refreshes.'''
+
+        self.index.background = False
+        self.index.go.set()
+        self.index.sync()
+        self.assertEqual(self.index.index, [1, 2])
+
+        self.index.table.append(4)
+        self.index.sync()
+        self.assertEqual(self.index.index, [1, 2, 4])
+        self.assertEqual(self.index.builds, 1)
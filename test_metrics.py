@@ -0,0 +1,77 @@
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import create_engine, exc, text
+
+from metrics import Histogram, Metrics, Registry, requests_total, request_queries
+
+
+class HistogramTestCase(TestCase):
+    '''Test the Prometheus text rendering.'''
+
+    def test_buckets_are_cumulative(self):
+        '''Testing if each bucket counts every observation at or below its bound.'''
+
+        histogram = Histogram('latency_seconds', 'Latency.', ['route'], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value, route='/')
+
+        self.assertEqual(histogram.render(), [
+            'latency_seconds_bucket{route="/",le="0.1"} 1',
+            'latency_seconds_bucket{route="/",le="1.0"} 3',
+            'latency_seconds_bucket{route="/",le="+Inf"} 4',
+            'latency_seconds_sum{route="/"} 4.25',
+            'latency_seconds_count{route="/"} 4',
+        ])
+
+    def test_collect_exposes_stats_as_gauges(self):
+        '''Testing if numeric stats() values are exposed and the rest skipped.'''
+
+        registry = Registry()
+        registry.collect('cache', lambda: {'hits': 3, 'hit_rate': 0.5, 'name': 'memory'})
+
+        rendered = registry.render()
+
+        self.assertIn('cache_hits 3\n', rendered)
+        self.assertIn('cache_hit_rate 0.5\n', rendered)
+        self.assertNotIn('cache_name', rendered)
+
+
+class MetricsAppTestCase(TestCase):
+    '''Test request and SQL instrumentation on a small app.'''
+
+    def test_counts_requests_and_queries_per_route(self):
+        '''Testing if a request is timed under its route pattern with its SQL statement count.'''
+
+        engine = create_engine('sqlite://')
+        app = Flask(__name__)
+        Metrics().init_app(app)
+
+        @app.route('/things/<int:n>')
+        def things(n):
+            with engine.connect() as conn:
+                for _ in range(n):
+                    conn.execute(text('SELECT 1'))
+            return 'ok'
+
+        before = request_queries.count(route='/things/<int:n>')
+        with app.test_client() as client:
+            self.assertEqual(client.get('/things/3').status_code, 200)
+            body = client.get('/metrics').get_data(as_text=True)
+
+        self.assertEqual(request_queries.count(route='/things/<int:n>'), before + 1)
+        self.assertEqual(requests_total.value(method='GET', route='/things/<int:n>', status='200'), 1)
+        self.assertIn('http_request_sql_queries_bucket{route="/things/<int:n>",le="5"}', body)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/things/<int:n>"} 1', body)
+
+    def test_failed_statements_leave_no_start_time(self):
+        '''Testing if a statement that raises doesn't leave its start time on the connection.'''
+
+        engine = create_engine('sqlite://')
+        Metrics().init_app(Flask(__name__))
+
+        with engine.connect() as conn:
+            with self.assertRaises(exc.OperationalError):
+                conn.execute(text('SELECT * FROM missing'))
+            conn.execute(text('SELECT 1'))
+            self.assertEqual(conn.info['metrics_started'], [])
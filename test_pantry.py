@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+from pantry import IngredientIndex, canonical_ingredient
+
+
+class IngredientIndexTestCase(TestCase):
+    '''Test the ingredient bitmap index behind "cook with what I have".'''
+
+    def setUp(self):
+        self.index = IngredientIndex()
+        self.index.build([
+            (1, '2 boneless chicken breasts, cubed'), (1, '1 cup rice'), (1, 'salt, to taste'),
+            (2, '1 lb ground beef'), (2, '1 cup rice'), (2, '2 cloves garlic, minced'),
+            (3, '3 large tomatoes (about 1 lb)'), (3, 'Fresh basil or parsley'),
+            (4, '1 cup rice'),
+        ])
+
+    def test_canonical_ingredient(self):
+        '''Testing if quantities, units, preparation words and staples are dropped and names made singular.'''
+
+        self.assertEqual(canonical_ingredient('2 boneless chicken breasts, cubed'), 'chicken breast')
+        self.assertEqual(canonical_ingredient('3 large tomatoes (about 1 lb)'), 'tomato')
+        self.assertEqual(canonical_ingredient('1/2 tsp freshly ground black pepper'), None)
+        self.assertEqual(canonical_ingredient('Fresh basil or parsley'), 'basil')
+        self.assertEqual(canonical_ingredient('2 cups fresh blueberries'), 'blueberry')
+        self.assertEqual(canonical_ingredient('1 tbsp extra-virgin olive oil'), 'olive oil')
+
+    def test_missing_at_most(self):
+        '''Testing if recipes are ranked by missing ingredients and staples never count as missing.'''
+
+        self.assertEqual(self.index.search(['rice']), [(4, 0)])
+        self.assertEqual(self.index.search(['Chicken', 'rice']), [(1, 0), (4, 0)])
+        self.assertEqual(self.index.search(['chicken', 'rice'], max_missing=2), [(1, 0), (4, 0), (2, 2)])
+        self.assertEqual(self.index.search(['tomatoes'], max_missing=1), [(3, 1)])
+        self.assertEqual(self.index.search(['lamb'], max_missing=3), [])
+        self.assertEqual(self.index.search(['rice'], max_missing=2, limit=2), [(4, 0), (1, 1)])
+
+    def test_add_remove_and_dense_bitmaps(self):
+        '''Testing if recipes can be re-indexed and removed, and common names switch to int bitmaps.'''
+
+        self.index.add(1, ['1 cup rice'])
+        self.index.remove(4)
+        self.assertEqual(self.index.search(['rice']), [(1, 0)])
+
+        for recipe_id in range(10, 60):
+            self.index.add(recipe_id, ['1 cup rice', 'an egg'])
+        rice = self.index.names['rice']
+        self.assertIsInstance(self.index.postings[rice], int)
+        self.assertEqual(len(self.index.search(['rice', 'eggs'], limit=100)), 51)
+
+        self.index.remove(10)
+        self.assertEqual(len(self.index.search(['rice', 'eggs'], limit=100)), 50)
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from quota import SingleFlight, TokenBucket
+
+
+class SingleFlightTestCase(TestCase):
+    '''Test request coalescing.'''
+
+    def test_concurrent_calls_share_one_result(self):
+        '''Testing if callers arriving while a call is in flight get its result instead of calling again.'''
+
+        flights = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def slow(value):
+            calls.append(value)
+            started.set()
+            time.sleep(0.2)
+            return value * 2
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do('key', slow, 21)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(flights.do('key', slow, 21))) for _ in range(4)]
+        for thread in followers:
+            thread.start()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(calls, [21])
+        self.assertEqual(sorted(results), [(42, False)] + [(42, True)] * 4)
+        self.assertEqual(flights.do('key', slow, 1), (2, False))
+
+    def test_errors_are_shared_and_not_kept(self):
+        '''Testing if an error reaches the caller and the next call runs again.'''
+
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            flights.do('key', fail)
+        self.assertEqual(flights.do('key', lambda: 'ok'), ('ok', False))
+
+
+class TokenBucketTestCase(TestCase):
+    '''Test the rate limit shared through a sqlite file.'''
+
+    def test_bucket_is_shared_and_refills(self):
+        '''Testing if two buckets on one file draw from the same budget, which refills over time.'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'quota.sqlite')
+            first = TokenBucket(path, rate=20, burst=2)
+            second = TokenBucket(path, rate=20, burst=2)
+
+            self.assertTrue(first.try_take())
+            self.assertTrue(second.try_take())
+            self.assertFalse(first.try_take())
+            self.assertFalse(second.try_take())
+
+            self.assertTrue(second.take(wait=0.5))
+            time.sleep(0.1)
+            self.assertTrue(first.try_take())
@@ -0,0 +1,57 @@
+from unittest import TestCase
+
+from recommend import CoLikeIndex
+
+
+class CoLikeIndexTestCase(TestCase):
+    '''Test the item-item co-like index.'''
+
+    def setUp(self):
+        self.index = CoLikeIndex(top_k=2)
+        self.index.build([
+            (1, 10), (1, 20), (1, 30),
+            (2, 10), (2, 20),
+            (3, 10), (3, 40),
+        ])
+
+    def test_similar_recipes(self):
+        '''Testing if neighbours are ranked by cosine similarity and cut at top_k.'''
+
+        neighbours = self.index.similar(20)
+        self.assertEqual([recipe_id for recipe_id, _ in neighbours], [10, 30])
+        self.assertAlmostEqual(neighbours[0][1], 2 / (3 * 2) ** 0.5, places=5)
+        self.assertEqual(len(self.index.similar(10)), 2)
+        self.assertEqual(self.index.similar(99), [])
+
+    def test_recommend_leaves_out_liked_recipes(self):
+        '''Testing if scores add up across liked recipes and liked ones are never recommended.'''
+
+        self.assertEqual(self.index.recommend(frozenset([20, 30])), [10])
+        self.assertEqual(self.index.recommend(frozenset([40])), [10])
+        self.assertEqual(self.index.recommend(frozenset()), [])
+        self.assertEqual(self.index.recommend(frozenset([20]), exclude={10}), [30])
+
+    def test_incremental_add_and_remove(self):
+        '''Testing if likes added and removed one at a time give the same index as a rebuild.'''
+
+        generation = self.index.generation
+        self.index.add(3, 30)
+        self.index.add(3, 30)
+        self.assertEqual(self.index.generation, generation + 1)
+
+        # Lookups answer from the lists as last ranked until rerank() runs.
+        self.assertNotIn(40, [recipe_id for recipe_id, _ in self.index.similar(30)])
+        self.assertEqual(self.index.rerank(), 4)
+        self.assertEqual(self.index.similar(30)[0][0], 10)
+        self.assertIn(40, [recipe_id for recipe_id, _ in self.index.similar(30)])
+
+        self.index.remove(3, 30)
+        self.index.remove(1, 30)
+        self.index.rerank()
+        self.assertEqual(self.index.similar(30), [])
+        self.assertEqual(self.index.recommend(frozenset([20])), [10])
+
+        rebuilt = CoLikeIndex(top_k=2)
+        rebuilt.build([(1, 10), (1, 20), (2, 10), (2, 20), (3, 10), (3, 40)])
+        for recipe_id in (10, 20, 40):
+            self.assertEqual(self.index.similar(recipe_id), rebuilt.similar(recipe_id))
@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+from search_index import InvertedIndex, tokenize
+
+
+class InvertedIndexTestCase(TestCase):
+    '''Test the in-process full-text fallback index.'''
+
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.build([
+            (1, 'Chicken Soup', "['1 chicken', 'carrots']", 'American', 'Soup'),
+            (2, 'Chicken Curry', "['1 chicken', 'curry paste', 'more chicken']", 'Indian', 'Main course'),
+            (3, 'Tomato Soup', "['tomatoes']", 'Italian', 'Soup'),
+        ])
+
+    def test_tokenize(self):
+        '''Testing if text is lowercased and stop words and plurals are dropped.'''
+
+        self.assertEqual(tokenize('The Carrots and 2 Tomatoes'), ['carrot', 'tomatoe'])
+
+    def test_ranked_search(self):
+        '''Testing if every term has to match and higher term frequency ranks first.'''
+
+        self.assertEqual(self.index.search('chicken'), [2, 1])
+        self.assertEqual(self.index.search('chicken soup'), [1])
+        self.assertEqual(self.index.search('tomato'), [3])
+        self.assertEqual(self.index.search('lamb'), [])
+
+    def test_add_and_remove(self):
+        '''Testing if added recipes become searchable and removed ones disappear.'''
+
+        self.index.add(4, 'Lamb Soup')
+        self.assertEqual(self.index.search('lamb'), [4])
+
+        self.index.remove(1)
+        self.assertEqual(self.index.search('soup'), [3, 4])
+        self.assertEqual(self.index.search('carrot'), [])
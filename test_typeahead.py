@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+from typeahead import PrefixIndex, normalize, prefix_keys
+
+
+class PrefixIndexTestCase(TestCase):
+    '''Test the sorted-array prefix index behind the search box suggestions.'''
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.build([
+            (1, 'Chicken Curry', 1),
+            (2, 'Curry Chicken with Rice', 1),
+            (3, "Mom's Chili", 1),
+            (4, 'chicken  curry', 1),
+            (5, 'Chickpea Salad', 1),
+        ])
+
+    def test_keys(self):
+        '''Testing if texts are found under their start and every word but stop words.'''
+
+        self.assertEqual(normalize("Mom's  Chili!"), 'mom s chili')
+        self.assertEqual(prefix_keys('Curry Chicken with Rice'), ['curry chicken with rice', 'chicken with rice', 'rice'])
+
+    def test_lookup(self):
+        '''Testing if matches at the start come first and texts that normalize the same are returned once.'''
+
+        self.assertEqual(self.index.lookup('curry'), [(2, 'Curry Chicken with Rice'), (1, 'Chicken Curry')])
+        self.assertEqual(self.index.lookup('CHICK'), [(1, 'Chicken Curry'), (5, 'Chickpea Salad'), (2, 'Curry Chicken with Rice')])
+        self.assertEqual(self.index.lookup("mom's"), [(3, "Mom's Chili")])
+        self.assertEqual(self.index.lookup('rice', limit=0), [])
+        self.assertEqual(self.index.lookup('with'), [])
+        self.assertEqual(self.index.lookup('  '), [])
+
+    def test_weights_add_and_remove(self):
+        '''Testing if heavier texts come first and texts can be re-indexed and removed.'''
+
+        self.index.add(6, 'Chicken Soup', 5)
+        self.assertEqual(self.index.lookup('chicken')[0], (6, 'Chicken Soup'))
+
+        self.index.add(6, 'Beef Soup', 5)
+        self.assertEqual(self.index.lookup('soup'), [(6, 'Beef Soup')])
+        self.assertNotIn((6, 'Chicken Soup'), self.index.lookup('chicken'))
+
+        self.index.remove(6)
+        self.index.remove(6)
+        self.assertEqual(self.index.lookup('soup'), [])
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.keys, sorted(self.index.keys))
+
+    def test_short_prefixes_rank_the_whole_range(self):
+        '''Testing if a heavy text is found by a prefix that matches more keys than a lookup scans.'''
+
+        index = PrefixIndex(scan=16, top_k=4)
+        items = [(n, f'Ca{n:03d} Stew', 1) for n in range(400)]
+        index.build(items + [(400, 'Cake', 10000)])
+
+        self.assertEqual(index.lookup('c', 2), [(400, 'Cake'), (0, 'Ca000 Stew')])
+        self.assertEqual(index.lookup('ca', 1), [(400, 'Cake')])
+
+        index.add(401, 'Carrot Cake', 20000)
+        self.assertEqual(index.lookup('ca', 2), [(401, 'Carrot Cake'), (400, 'Cake')])
+        index.add(5, 'Ca005 Stew', 30000)
+        self.assertEqual(index.lookup('c', 1), [(5, 'Ca005 Stew')])
+
+        index.remove(401)
+        index.add(5, 'Ca005 Stew', 1)
+        self.assertEqual(index.lookup('c', 2), [(400, 'Cake'), (0, 'Ca000 Stew')])
+        self.assertEqual(index.lookup('ca0', 1), [(0, 'Ca000 Stew')])
+        self.assertEqual(index.lookup('st', 1), [(0, 'Ca000 Stew')])
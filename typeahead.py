@@ -0,0 +1,322 @@
+'''Search box suggestions: recipe titles and popular past searches.
+
+PrefixIndex keeps one sorted list of (key, id) pairs. Each text is indexed
+under itself and under every later word that isn't a stop word, so "cu"
+finds "Chicken Curry" as well as "Curry Chicken". A lookup is a bisect to
+the keys starting with the prefix. When there are at most `scan` of them
+they are ranked on the spot; a short prefix like "c" can match most of the
+catalog, so for those the best `top_k` matches are kept ranked ahead of
+time and updated as texts are added and removed.
+'''
+
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+from indexes import SyncedIndex
+from models import db, Recipe, SearchQuery
+from search_index import STOP_WORDS
+
+# Sorts after any key that starts with the prefix it is appended to.
+PAST_PREFIX = chr(0x10ffff)
+
+
+def normalize(text):
+    '''Lowercase words separated by single spaces: "Mom's  Chili" -> "mom s chili".'''
+
+    return ' '.join(re.findall(r'\w+', (text or '').lower()))
+
+
+def prefix_keys(text):
+    '''The keys a text is found under: its normalized form and each suffix starting at a word.'''
+
+    words = normalize(text).split()
+    return [' '.join(words[n:]) for n, word in enumerate(words) if n == 0 or word not in STOP_WORDS]
+
+
+class PrefixIndex:
+    '''In-process sorted-array prefix index over short texts with a weight each.'''
+
+    def __init__(self, scan=256, top_k=32):
+        self.scan = scan
+        self.top_k = top_k
+        self.keys = []
+        self.entries = {}
+        self.top = {}
+        self._lock = threading.Lock()
+
+    def build(self, items):
+        '''Index (id, text, weight) items from scratch.'''
+
+        entries = {}
+        keys = []
+        for ident, text, weight in items:
+            entries[ident] = (text, weight, normalize(text))
+            keys.extend((key, ident) for key in prefix_keys(text))
+        keys.sort()
+        top = self._rank_prefixes(keys, entries)
+
+        with self._lock:
+            self.entries = entries
+            self.keys = keys
+            self.top = top
+
+    def add(self, ident, text, weight=1):
+        '''Index a text, replacing what was indexed under ident before.'''
+
+        with self._lock:
+            old = self.entries.get(ident)
+            if old is not None and old[0] == text:
+                # Search counts only go up, so this can only move it up the ranked prefixes.
+                self._unrank(ident, text, dropped=weight < old[1])
+                self.entries[ident] = (text, weight, old[2])
+                self._rank(ident, text)
+                return
+            self._remove(ident)
+            self.entries[ident] = (text, weight, normalize(text))
+            for key in prefix_keys(text):
+                insort(self.keys, (key, ident))
+            self._rank(ident, text)
+
+    def remove(self, ident):
+        with self._lock:
+            self._remove(ident)
+
+    def _remove(self, ident):
+        entry = self.entries.get(ident)
+        if entry is None:
+            return
+        self._unrank(ident, entry[0], dropped=True)
+        del self.entries[ident]
+        for key in prefix_keys(entry[0]):
+            n = bisect_left(self.keys, (key, ident))
+            if n < len(self.keys) and self.keys[n] == (key, ident):
+                del self.keys[n]
+
+    @staticmethod
+    def _ranked(key, ident, entries):
+        '''(rank, id) of a key: heaviest first, then matches at the start of the text, then shorter texts.'''
+
+        text, weight, same = entries[ident]
+        return (-weight, key != same, len(text), text), ident
+
+    def _best(self, keys, entries):
+        return heapq.nsmallest(self.top_k, (self._ranked(key, ident, entries) for key, ident in keys))
+
+    def _rank_prefixes(self, keys, entries):
+        '''{prefix: best matches} for every prefix matching more than `scan` keys.
+
+        A prefix's best matches are the best of its one-letter-longer
+        prefixes' and of the keys equal to it, so each key is ranked once.
+        '''
+
+        top = {}
+
+        def rank(prefix, start, end):
+            if end - start <= self.scan:
+                return self._best(keys[start:end], entries)
+            candidates = []
+            n = start
+            while n < end:
+                key, ident = keys[n]
+                if len(key) == len(prefix):
+                    candidates.append(self._ranked(key, ident, entries))
+                    n += 1
+                    continue
+                longer = key[:len(prefix) + 1]
+                stop = bisect_left(keys, (longer + PAST_PREFIX,), n, end)
+                candidates.extend(rank(longer, n, stop))
+                n = stop
+            best = top[prefix] = heapq.nsmallest(self.top_k, candidates)
+            return best
+
+        rank('', 0, len(keys))
+        top.pop('', None)
+        return top
+
+    def _ranked_prefixes(self, text):
+        return {key[:n] for key in prefix_keys(text) for n in range(1, len(key) + 1) if key[:n] in self.top}
+
+    def _rank(self, ident, text):
+        for key in prefix_keys(text):
+            for n in range(1, len(key) + 1):
+                best = self.top.get(key[:n])
+                if best is not None:
+                    insort(best, self._ranked(key, ident, self.entries))
+                    del best[self.top_k:]
+
+    def _unrank(self, ident, text, dropped):
+        '''Take ident out of the ranked prefixes its text is under.
+
+        If it dropped out of a full list, a match that didn't make the cut
+        may belong in it now, so that prefix is ranked again on its next lookup.
+        '''
+
+        for prefix in self._ranked_prefixes(text):
+            best = self.top[prefix]
+            kept = [item for item in best if item[1] != ident]
+            if dropped and len(kept) < len(best) == self.top_k:
+                del self.top[prefix]
+            else:
+                self.top[prefix] = kept
+
+    def lookup(self, prefix, limit=8):
+        '''[(id, text)] of texts with a word starting with prefix.
+
+        Heaviest first, then matches at the start of the text, then shorter
+        texts. Texts that normalize the same are only returned once.
+        '''
+
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        with self._lock:
+            start = bisect_left(self.keys, (prefix,))
+            end = bisect_left(self.keys, (prefix + PAST_PREFIX,), start)
+            if end - start > self.scan:
+                best = self.top.get(prefix)
+                if best is None:
+                    best = self.top[prefix] = self._best(self.keys[start:end], self.entries)
+            else:
+                best = sorted(self._ranked(key, ident, self.entries) for key, ident in self.keys[start:end])
+
+            matches = []
+            seen = set()
+            for _, ident in best:
+                text, _, same = self.entries[ident]
+                if len(matches) < limit and same not in seen:
+                    seen.add(same)
+                    matches.append((ident, text))
+
+        return matches
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Typeahead(SyncedIndex):
+    '''Keeps a title index and a popular-search index in step with the database.
+
+    Recipes added or deleted through this worker, and searches made through
+    it, are applied as they happen; recipes and searches recorded by other
+    processes are read every `refresh` seconds, and everything is rebuilt
+    every `rebuild` seconds. Both run in the background; see indexes.py.
+    A search term is only suggested once it was searched `min_count` times,
+    which keeps typos and one-off searches out of the list. That counts
+    searches, not people, so it is no guarantee about who searched for it.
+    '''
+
+    config_prefix = 'TYPEAHEAD'
+
+    def __init__(self, min_count=3, max_queries=5000, refresh=30, rebuild=3600):
+        super().__init__(refresh, rebuild)
+        self.titles = PrefixIndex()
+        self.queries = PrefixIndex()
+        self.min_count = min_count
+        self.max_queries = max_queries
+        self.last_recipe_id = 0
+        self.queries_seen_at = None
+
+    def init_app(self, app):
+        self.min_count = app.config.get('TYPEAHEAD_MIN_COUNT', self.min_count)
+        self.max_queries = app.config.get('TYPEAHEAD_MAX_QUERIES', self.max_queries)
+        super().init_app(app)
+
+    def reset(self):
+        super().reset()
+        self.titles = PrefixIndex()
+        self.queries = PrefixIndex()
+        self.last_recipe_id = 0
+        self.queries_seen_at = None
+
+    def after_fork(self):
+        super().after_fork()
+        self.titles._lock = threading.Lock()
+        self.queries._lock = threading.Lock()
+
+    def _recipes(self, after=0):
+        return (db.session.query(Recipe.id, Recipe.title)
+            .filter(Recipe.id > after)
+            .order_by(Recipe.id)
+            .yield_per(10000))
+
+    def _popular(self, since=None):
+        rows = db.session.query(SearchQuery.term, SearchQuery.count).filter(SearchQuery.count >= self.min_count)
+        if since is not None:
+            rows = rows.filter(SearchQuery.last_searched_at >= since)
+        return rows.order_by(SearchQuery.count.desc()).limit(self.max_queries)
+
+    def build(self):
+        # Searches recorded while we read are picked up again by the next refresh rather than missed.
+        seen_at = datetime.utcnow() - timedelta(seconds=1)
+        last_id = 0
+        titles = PrefixIndex()
+        queries = PrefixIndex()
+
+        def recipes():
+            nonlocal last_id
+            for recipe_id, title in self._recipes():
+                last_id = recipe_id
+                yield recipe_id, title, 1
+
+        titles.build(recipes())
+        queries.build((term, term, count) for term, count in self._popular())
+
+        def install():
+            self.titles, self.queries = titles, queries
+            self.last_recipe_id = last_id
+            self.queries_seen_at = seen_at
+        return install
+
+    def refresh(self):
+        seen_at = datetime.utcnow() - timedelta(seconds=1)
+        for recipe_id, title in self._recipes(self.last_recipe_id):
+            self.titles.add(recipe_id, title)
+            self.last_recipe_id = recipe_id
+        for term, count in self._popular(self.queries_seen_at):
+            self.queries.add(term, term, count)
+        self.queries_seen_at = seen_at
+
+    def add(self, recipes):
+        for recipe in recipes:
+            # Read now: a rebuild may apply this again later, after the session is gone.
+            recipe_id, title = recipe.id, recipe.title
+            self.change(lambda recipe_id=recipe_id, title=title: self.titles.add(recipe_id, title))
+
+    def remove(self, recipe_id):
+        self.change(lambda: self.titles.remove(recipe_id))
+
+    def record(self, term, count):
+        '''Apply a search made through this worker, now searched `count` times in all.'''
+
+        if term and count >= self.min_count:
+            self.change(lambda: self.queries.add(term, term, count))
+
+    def suggest(self, prefix, limit=8):
+        '''[{'text', 'kind'}] for what's typed so far: popular searches first, then recipe titles.
+
+        Answers from the indexes as they are, so a keystroke never waits for a build.
+        '''
+
+        self.sync()
+        suggestions = []
+        seen = set()
+        for kind, index in (('query', self.queries), ('recipe', self.titles)):
+            for _, text in index.lookup(prefix, limit):
+                if len(suggestions) < limit and normalize(text) not in seen:
+                    seen.add(normalize(text))
+                    suggestions.append({'text': text, 'kind': kind})
+        return suggestions
+
+    def stats(self):
+        return {
+            'titles': len(self.titles),
+            'queries': len(self.queries),
+            'keys': len(self.titles.keys) + len(self.queries.keys),
+        }
+
+
+typeahead = Typeahead()
@@ -0,0 +1,5 @@
+'''Entry point for gunicorn, as run by the Procfile: `gunicorn --preload --worker-class gthread wsgi:app`.'''
+
+from app import create_app
+
+app = create_app()